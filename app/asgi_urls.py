@@ -0,0 +1,11 @@
+from django.urls import path, include
+
+from documents.urls import async_urlpatterns
+
+
+# URLs served by the ASGI workers (SERVER_MODE=asgi, see scripts/server_run.sh).
+# Sync views run on a single thread per worker under ASGI, so only the async
+# question views are served, every other route goes to the WSGI workers.
+urlpatterns = [
+    path("api/documents/", include((async_urlpatterns, "documents"))),
+]
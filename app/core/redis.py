@@ -11,6 +11,13 @@ class RedisStorage:
             password=settings.REDIS_PASSWORD,
             decode_responses=True,
         )
+        # raw bytes values, e.g. packed embedding vectors
+        self.binary_connection = redis.Redis(
+            host=settings.REDIS_SERVER,
+            db=settings.REDIS_APP_DB,
+            password=settings.REDIS_PASSWORD,
+            decode_responses=False,
+        )
 
 
 redis_storage = RedisStorage()
@@ -15,6 +15,7 @@ def on_worker_init(*_, **__):
 @worker_shutdown.connect
 def on_worker_shutdown(*_, **__):
     redis_storage.connection.close()
+    redis_storage.binary_connection.close()
 
 
 @shared_task(name="celery_test_task")
@@ -1,8 +1,11 @@
 from django.contrib import admin
+from django.db import transaction
 from unfold.admin import ModelAdmin as UnfoldModelAdmin
 from django.utils.safestring import mark_safe
 
 from documents import models as document_models
+from documents import enums as document_enums
+from documents import tasks as document_tasks
 
 
 @admin.register(document_models.Document)
@@ -10,6 +13,8 @@ class DocumentAdmin(UnfoldModelAdmin):
     readonly_fields = [
         "uid",
         "user",
+        "file_hash",
+        "content_hash",
         "created_at",
         "updated_at",
         "file_preview",
@@ -42,10 +47,24 @@ class DocumentAdmin(UnfoldModelAdmin):
         "document_file",
         "file_preview",
         "status",
+        "file_hash",
+        "content_hash",
         "created_at",
         "updated_at",
     ]
 
+    def save_model(self, request, obj, form, change):
+        file_changed = change and "document_file" in form.changed_data
+        if file_changed:
+            # the upload hash no longer matches, it is computed again at ingestion
+            obj.file_hash = ""
+            obj.status = document_enums.DocumentProcessingStatus.PENDING
+        super().save_model(request, obj, form, change)
+        if file_changed:
+            transaction.on_commit(
+                lambda: document_tasks.ingest_document_task.delay(obj.id)
+            )
+
     def file_preview(self, obj):
         if obj.document_file:
             return mark_safe(f'<a href="{obj.document_file.url}" target="_blank">View File</a>')
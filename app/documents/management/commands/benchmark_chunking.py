@@ -0,0 +1,75 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
+from langchain_openai import OpenAIEmbeddings
+
+import settings
+
+from documents import models as document_models
+from documents.services.chunking import DocumentChunker
+from documents.services.parsers import DocumentParser
+
+
+DEFAULT_QUERIES = [
+    "What is this document about?",
+    "Summarize the main points of the document.",
+]
+
+
+class Command(BaseCommand):
+    help = "Compare prompt tokens and retrieval latency of whole pages vs token chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("document_uid", type=str)
+        parser.add_argument("--query", action="append", dest="queries")
+        parser.add_argument("--k", type=int, default=5)
+
+    def handle(self, *args, **options):
+        document = document_models.Document.objects.filter(uid=options["document_uid"]).first()
+        if not document:
+            raise CommandError("Document not found.")
+
+        queries = options["queries"] or DEFAULT_QUERIES
+        chunker = DocumentChunker()
+        parser = DocumentParser(document)
+        pages = list(parser.download_and_parse_document(document))
+
+        variants = {
+            "pages": pages,
+            "chunks": list(chunker.chunk(pages)),
+        }
+        embeddings = OpenAIEmbeddings(api_key=settings.OPENAI_API_KEY)
+
+        for name, texts_and_metadata in variants.items():
+            vector_store = Chroma(
+                collection_name=f"benchmark_chunking_{name}",
+                embedding_function=embeddings,
+            )
+            try:
+                vector_store.add_documents([
+                    Document(page_content=text, metadata={"idx": idx})
+                    for idx, (text, _) in enumerate(texts_and_metadata)
+                ])
+                retriever = vector_store.as_retriever(search_kwargs={"k": options["k"]})
+
+                latencies = []
+                prompt_tokens = []
+                for query in queries:
+                    start = time.perf_counter()
+                    context = retriever.invoke(query)
+                    latencies.append(time.perf_counter() - start)
+                    prompt_tokens.append(chunker.count_tokens(str(context)))
+
+                input_tokens = [chunker.count_tokens(text) for text, _ in texts_and_metadata]
+                self.stdout.write(
+                    f"{name:>6}: vectors={len(texts_and_metadata)} "
+                    f"max_input_tokens={max(input_tokens, default=0)} "
+                    f"avg_prompt_tokens={sum(prompt_tokens) / len(prompt_tokens):.0f} "
+                    f"avg_retrieval_ms={1000 * sum(latencies) / len(latencies):.1f}"
+                )
+            finally:
+                vector_store.delete_collection()
+
+# to run this command use: python manage.py benchmark_chunking <document_uid> --query "..."
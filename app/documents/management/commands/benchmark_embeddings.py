@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+import settings
+
+from documents import models as document_models
+from documents.services.chunking import DocumentChunker
+from documents.services.parsers import DocumentParser
+from documents.services.registry import EMBEDDING_BACKENDS
+
+
+SAMPLE_TEXT = (
+    "The supplier shall deliver the goods listed in clause 4.2 within thirty days "
+    "of the purchase order. Late deliveries are subject to the penalties of annex B."
+)
+
+
+class Command(BaseCommand):
+    help = "Compare the throughput of the embedding backends, without the embeddings cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--document-uid", type=str, help="Embed the chunks of this document")
+        parser.add_argument("--texts", type=int, default=256, help="Number of sample texts otherwise")
+        parser.add_argument("--batch-size", type=int, default=settings.EMBEDDING_BATCH_SIZE)
+        parser.add_argument("--backend", action="append", dest="backends", choices=list(EMBEDDING_BACKENDS))
+
+    def get_texts(self, options):
+        if not options["document_uid"]:
+            return [f"{i} {SAMPLE_TEXT}" for i in range(options["texts"])]
+        document = document_models.Document.objects.filter(uid=options["document_uid"]).first()
+        if not document:
+            raise CommandError("Document not found.")
+        parser = DocumentParser(document)
+        pages = parser.download_and_parse_document(document)
+        return [text for text, _ in DocumentChunker().chunk(pages)]
+
+    def handle(self, *args, **options):
+        texts = self.get_texts(options)
+        batch_size = options["batch_size"]
+        backends = options["backends"] or list(EMBEDDING_BACKENDS)
+        if "openai" in backends and not settings.OPENAI_API_KEY:
+            self.stdout.write("OPENAI_API_KEY is not set, skipping openai")
+            backends.remove("openai")
+
+        for backend in backends:
+            embeddings = EMBEDDING_BACKENDS[backend]()
+            start = time.perf_counter()
+            for i in range(0, len(texts), batch_size):
+                embeddings.embed_documents(texts[i:i + batch_size])
+            elapsed = time.perf_counter() - start
+
+            start = time.perf_counter()
+            embeddings.embed_query(texts[0])
+            query_time = time.perf_counter() - start
+            self.stdout.write(
+                f"{backend}: {len(texts)} texts in {elapsed:.2f}s "
+                f"({len(texts) / elapsed if elapsed else 0:.1f} texts/s), "
+                f"query {1000 * query_time:.1f} ms"
+            )
+
+# to run this command use: python manage.py benchmark_embeddings --texts 512
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+import settings
+
+from documents.services import pdf_pages
+
+
+class Command(BaseCommand):
+    help = "Measure PDF pages extraction throughput (pages/s) against the number of workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("file_path", type=str)
+        parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+        parser.add_argument("--pages-per-task", type=int, default=settings.DOCUMENT_PDF_PAGES_PER_TASK)
+
+    def handle(self, *args, **options):
+        file_path = options["file_path"]
+        page_count = pdf_pages.get_page_count(file_path)
+        self.stdout.write(f"{file_path}: {page_count} pages")
+
+        for workers in options["workers"]:
+            start = time.perf_counter()
+            if workers < 2:
+                extracted = len(pdf_pages.extract_pages(file_path, 0, page_count))
+            else:
+                extracted = sum(1 for _ in pdf_pages.extract_pages_parallel(
+                    file_path,
+                    workers=workers,
+                    pages_per_task=options["pages_per_task"],
+                ))
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f"workers={workers}: {extracted} pages in {elapsed:.2f}s "
+                f"({extracted / elapsed:.1f} pages/s)"
+            )
+
+# to run this command use: python manage.py benchmark_pdf_parsing /path/to/file.pdf --workers 1 2 4 8
@@ -0,0 +1,102 @@
+import os
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from documents import models as document_models
+from documents.services.flat_store import QUANTIZATIONS, FlatVectorStore
+from documents.services.registry import vector_registry
+
+
+class Command(BaseCommand):
+    help = "Compare memory scanned, disk size, recall@k and latency of the flat index quantization modes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--document-uid", type=str, help="Use the chunks of this document")
+        parser.add_argument("--vectors", type=int, default=5000, help="Number of random vectors otherwise")
+        parser.add_argument("--dimensions", type=int, default=1536)
+        parser.add_argument("--queries", type=int, default=100)
+        parser.add_argument("--k", type=int, default=5)
+        parser.add_argument("--rescore-factor", type=int, default=4)
+        parser.add_argument("--noise", type=float, default=0.3, help="Noise added to the vectors used as queries")
+
+    def get_matrix(self, options) -> np.ndarray:
+        if not options["document_uid"]:
+            rng = np.random.default_rng(0)
+            return rng.normal(size=(options["vectors"], options["dimensions"])).astype(np.float32)
+        document = document_models.Document.objects.filter(uid=options["document_uid"]).first()
+        if not document or not document.content_hash:
+            raise CommandError("Indexed document not found.")
+        chunks = vector_registry.get_vector_store().get(
+            where={"content_hash": document.content_hash},
+            include=["documents"],
+        )
+        if not chunks["ids"]:
+            raise CommandError("The document has no chunks.")
+        vectors = vector_registry.get_embeddings().embed_documents(chunks["documents"])
+        return np.asarray(vectors, dtype=np.float32)
+
+    @staticmethod
+    def get_disk_size(directory: str) -> int:
+        """Return the size of the segment files of the store directory."""
+        return sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(directory)
+            for name in names
+            if not name.endswith((".json", ".lock"))
+        )
+
+    def handle(self, *args, **options):
+        matrix = self.get_matrix(options)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+        count = len(matrix)
+        ids = [str(i) for i in range(count)]
+        k = min(options["k"], count)
+
+        rng = np.random.default_rng(1)
+        rows = rng.integers(0, count, options["queries"])
+        queries = matrix[rows] + rng.normal(0, options["noise"] / np.sqrt(matrix.shape[1]), (len(rows), matrix.shape[1]))
+        queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+        expected = [set(np.argsort(-(matrix @ query))[:k].astype(str)) for query in queries]
+
+        self.stdout.write(f"{count} vectors of {matrix.shape[1]} dimensions, {len(queries)} queries, k={k}")
+        for quantization in QUANTIZATIONS:
+            with tempfile.TemporaryDirectory() as directory:
+                store = FlatVectorStore(
+                    embeddings=None,
+                    directory=directory,
+                    quantization=quantization,
+                    rescore_factor=options["rescore_factor"],
+                )
+                store.add_embeddings(
+                    [""] * count,
+                    matrix.tolist(),
+                    [{"content_hash": "benchmark"}] * count,
+                    ids,
+                )
+                segment = store.load("benchmark")
+                scored_bytes = segment.matrix.nbytes if segment.codes is None else (
+                    segment.codes.nbytes + segment.scales.nbytes
+                )
+                # the float32 matrix is stored for re-scoring next to the quantized codes
+                disk_bytes = self.get_disk_size(directory)
+
+                found = 0
+                timings = []
+                for query, relevant in zip(queries, expected):
+                    start = time.perf_counter()
+                    results = store.similarity_search_by_vector(query, k=k, filter={"content_hash": "benchmark"})
+                    timings.append(time.perf_counter() - start)
+                    found += len(relevant & {result.id for result in results})
+                timings.sort()
+                self.stdout.write(
+                    f"{quantization}: scanned matrix {scored_bytes / 2 ** 20:.1f} MiB "
+                    f"({scored_bytes / segment.matrix.nbytes:.0%} of float32), "
+                    f"on disk {disk_bytes / 2 ** 20:.1f} MiB ({disk_bytes / segment.matrix.nbytes:.0%} of float32), "
+                    f"recall@{k} {found / (k * len(queries)):.3f}, "
+                    f"p50 {1000 * timings[len(timings) // 2]:.2f} ms"
+                )
+
+# to run this command use: python manage.py benchmark_quantization --vectors 20000 --dimensions 1536
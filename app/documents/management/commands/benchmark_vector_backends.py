@@ -0,0 +1,90 @@
+import random
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from langchain_community.vectorstores import Chroma
+
+from documents import models as document_models
+from documents.services.pgvector_store import PgVectorStore
+from documents.services.registry import (
+    CHROMA_PERSIST_DIR,
+    get_collection_name,
+    vector_registry,
+)
+
+
+class Command(BaseCommand):
+    help = "Compare recall@k and search latency of Chroma and pgvector on the chunks of a document"
+
+    def add_arguments(self, parser):
+        parser.add_argument("document_uid", type=str)
+        parser.add_argument("--queries", type=int, default=50)
+        parser.add_argument("--k", type=int, default=5)
+        parser.add_argument("--noise", type=float, default=0.05, help="Noise added to the chunk vectors used as queries")
+
+    def handle(self, *args, **options):
+        document = document_models.Document.objects.filter(uid=options["document_uid"]).first()
+        if not document or not document.content_hash:
+            raise CommandError("Indexed document not found.")
+
+        embeddings = vector_registry.get_embeddings()
+        chroma = Chroma(
+            collection_name=get_collection_name(),
+            persist_directory=CHROMA_PERSIST_DIR,
+            embedding_function=embeddings,
+        )
+        search_filter = {"content_hash": document.content_hash}
+        chunks = chroma._collection.get(where=search_filter, include=["embeddings", "documents", "metadatas"])
+        if not chunks["ids"]:
+            raise CommandError("The document has no chunks in Chroma.")
+        ids = list(chunks["ids"])
+        matrix = np.asarray(chunks["embeddings"], dtype=np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+
+        # scratch table, the live chunks table is not written to
+        pgvector = PgVectorStore(embeddings, table_name=f"chunk_vectors_benchmark_{get_collection_name()}")
+        pgvector.drop_table()
+        pgvector.create_table(matrix.shape[1])
+        try:
+            pgvector.add_embeddings(chunks["documents"], matrix.tolist(), chunks["metadatas"], ids)
+            pgvector.create_index()
+            self.run_benchmark(document, ids, matrix, chroma, pgvector, search_filter, options)
+        finally:
+            pgvector.drop_table()
+
+    def run_benchmark(self, document, ids, matrix, chroma, pgvector, search_filter, options):
+        k = min(options["k"], len(ids))
+        rng = np.random.default_rng(0)
+        queries = []
+        for row in random.Random(0).choices(range(len(ids)), k=options["queries"]):
+            query = matrix[row] + rng.normal(0, options["noise"], matrix.shape[1]).astype(np.float32)
+            queries.append(query / np.linalg.norm(query))
+        # exact top k by cosine similarity
+        expected = [set(ids[i] for i in np.argsort(-(matrix @ query))[:k]) for query in queries]
+
+        backends = {
+            "chroma": lambda query: chroma.similarity_search_by_vector(query, k=k, filter=search_filter),
+            "pgvector": lambda query: pgvector.similarity_search_by_vector(query, k=k, filter={
+                **search_filter,
+                "document_uid": document.uid,
+                "user_id": document.user_id,
+            }),
+        }
+        self.stdout.write(f"{len(ids)} chunks, {len(queries)} queries, k={k}")
+        for name, search in backends.items():
+            found = 0
+            timings = []
+            for query, relevant in zip(queries, expected):
+                start = time.perf_counter()
+                results = search(query.tolist())
+                timings.append(time.perf_counter() - start)
+                found += len(relevant & {result.id for result in results})
+            timings.sort()
+            self.stdout.write(
+                f"{name}: recall@{k} {found / (k * len(queries)):.3f}, "
+                f"p50 {1000 * timings[len(timings) // 2]:.2f} ms, "
+                f"p95 {1000 * timings[int(len(timings) * 0.95) - 1]:.2f} ms"
+            )
+
+# to run this command use: python manage.py benchmark_vector_backends <document_uid> --queries 100
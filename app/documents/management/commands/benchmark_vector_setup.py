@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from documents.services.registry import (
+    create_embeddings,
+    create_vector_store,
+    vector_registry,
+)
+
+
+class Command(BaseCommand):
+    help = "Compare per request setup cost of new vs pooled vector store clients"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=50)
+
+    def handle(self, *args, **options):
+        iterations = options["iterations"]
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            create_vector_store(create_embeddings())
+        fresh = (time.perf_counter() - start) / iterations
+
+        vector_registry.close()
+        start = time.perf_counter()
+        for _ in range(iterations):
+            vector_registry.get_vector_store()
+        pooled = (time.perf_counter() - start) / iterations
+
+        self.stdout.write(f"new clients per request: {1000 * fresh:.3f} ms")
+        self.stdout.write(f"pooled clients per request: {1000 * pooled:.3f} ms (first call included)")
+
+# to run this command use: python manage.py benchmark_vector_setup --iterations 50
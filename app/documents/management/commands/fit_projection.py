@@ -0,0 +1,122 @@
+import os
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+import settings
+
+from documents import models as document_models
+from documents.services.projection import Projection
+from documents.services.registry import (
+    create_base_embeddings,
+    get_projection_path,
+    vector_registry,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Report the recall loss and the search speed-up of reducing the embeddings "
+        "dimensions, and save the PCA projection used by EMBEDDING_PROJECTION=pca"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sample", type=int, default=5000, help="Number of chunks sampled from the collection")
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--k", type=int, default=5)
+        parser.add_argument("--dimensions", type=int, nargs="+", default=[64, 128, 256, 512])
+        parser.add_argument("--save", action="store_true", help="Save the PCA of EMBEDDING_PROJECTION_DIMENSIONS")
+        parser.add_argument(
+            "--version",
+            default=settings.EMBEDDING_PROJECTION_VERSION,
+            help="Version of the saved PCA, an existing version is never overwritten",
+        )
+
+    def sample_texts(self, sample: int):
+        texts = []
+        content_hashes = (
+            document_models.Document.objects
+            .exclude(content_hash="")
+            .values_list("content_hash", flat=True)
+            .distinct()
+        )
+        vector_store = vector_registry.get_vector_store()
+        for content_hash in content_hashes.iterator():
+            chunks = vector_store.get(where={"content_hash": content_hash}, include=["documents"])
+            texts.extend(chunks["documents"])
+            if len(texts) >= sample:
+                break
+        return texts[:sample]
+
+    @staticmethod
+    def search_time(matrix: np.ndarray, queries: np.ndarray, k: int) -> float:
+        start = time.perf_counter()
+        for query in queries:
+            scores = matrix @ query
+            np.argpartition(-scores, k)[:k]
+        return (time.perf_counter() - start) / len(queries)
+
+    def handle(self, *args, **options):
+        path = get_projection_path(options["version"])
+        if options["save"] and os.path.exists(path):
+            # vectors stored with this PCA would be searched with queries projected by another one
+            raise CommandError(
+                f"PCA projection {path} already exists, save the new one with another --version, "
+                f"then set EMBEDDING_PROJECTION_VERSION to it and run reindex_documents."
+            )
+        texts = self.sample_texts(options["sample"])
+        if len(texts) < 2 * options["k"]:
+            raise CommandError("Not enough indexed chunks to sample.")
+        embeddings = create_base_embeddings()
+        matrix = np.asarray([
+            vector
+            for i in range(0, len(texts), settings.EMBEDDING_BATCH_SIZE)
+            for vector in embeddings.embed_documents(texts[i:i + settings.EMBEDDING_BATCH_SIZE])
+        ], dtype=np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+
+        # queries are sampled chunks, their neighbours are searched among the others
+        k = options["k"]
+        rng = np.random.default_rng(0)
+        query_rows = rng.choice(len(matrix), size=min(options["queries"], len(matrix)), replace=False)
+
+        def neighbours(vectors):
+            results = []
+            for row in query_rows:
+                scores = vectors @ vectors[row]
+                scores[row] = -np.inf
+                results.append(set(np.argsort(-scores)[:k]))
+            return results
+
+        expected = neighbours(matrix)
+        full_time = self.search_time(matrix, matrix[query_rows], k)
+        self.stdout.write(
+            f"{len(matrix)} chunks of {matrix.shape[1]} dimensions, {len(query_rows)} queries, "
+            f"full search {1000 * full_time:.3f} ms"
+        )
+        for dimensions in options["dimensions"]:
+            if dimensions >= matrix.shape[1]:
+                continue
+            projections = {"truncate": Projection(dimensions)}
+            if dimensions <= min(matrix.shape):
+                projections["pca"] = Projection.fit_pca(matrix, dimensions)
+            for mode, projection in projections.items():
+                reduced = projection.transform(matrix)
+                found = sum(len(a & b) for a, b in zip(expected, neighbours(reduced)))
+                reduced_time = self.search_time(reduced, reduced[query_rows], k)
+                self.stdout.write(
+                    f"{mode} {dimensions}: recall@{k} {found / (k * len(query_rows)):.3f}, "
+                    f"speed-up {full_time / reduced_time if reduced_time else 0:.1f}x, "
+                    f"index memory {dimensions / matrix.shape[1]:.0%}"
+                )
+
+        if options["save"]:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            Projection.fit_pca(matrix, settings.EMBEDDING_PROJECTION_DIMENSIONS).save(path)
+            self.stdout.write(
+                f"Saved the PCA projection to {path}, enable it with EMBEDDING_PROJECTION=pca "
+                f"and EMBEDDING_PROJECTION_VERSION={options['version']}"
+            )
+
+# to run this command use: python manage.py fit_projection --sample 5000 --dimensions 128 256 --save --version 2
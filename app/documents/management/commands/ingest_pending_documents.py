@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from documents import enums as document_enums
+from documents import models as document_models
+from documents import tasks as document_tasks
+
+
+class Command(BaseCommand):
+    help = "Queue the ingestion of the documents still pending, e.g. uploaded before background ingestion"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--include-processing",
+            action="store_true",
+            help="Also queue the documents stuck in processing, e.g. after a worker crash",
+        )
+
+    def handle(self, *args, **options):
+        statuses = [document_enums.DocumentProcessingStatus.PENDING]
+        if options["include_processing"]:
+            statuses.append(document_enums.DocumentProcessingStatus.PROCESSING)
+        document_ids = document_models.Document.objects.filter(status__in=statuses).values_list("id", flat=True)
+        count = 0
+        for document_id in document_ids.iterator():
+            document_tasks.ingest_document_task.delay(document_id)
+            count += 1
+        self.stdout.write(f"{count} documents queued for ingestion")
+
+# to run this command use: python manage.py ingest_pending_documents
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from documents import enums as document_enums
+from documents import models as document_models
+from documents import tasks as document_tasks
+
+
+class Command(BaseCommand):
+    help = "Index all documents again, e.g. after changing the embedding backend"
+
+    def handle(self, *args, **options):
+        documents = document_models.Document.objects.exclude(
+            status=document_enums.DocumentProcessingStatus.FAILED,
+        )
+        # the indexed content is served until its chunks are upserted again,
+        # one document is enough to index a content shared by many documents
+        queued_hashes = set()
+        count = 0
+        for document_id, content_hash in documents.values_list("id", "content_hash"):
+            if content_hash and content_hash in queued_hashes:
+                continue
+            queued_hashes.add(content_hash)
+            document_tasks.ingest_document_task.delay(document_id, force=True)
+            count += 1
+        self.stdout.write(f"{count} documents queued for indexing")
+
+# to run this command use: python manage.py reindex_documents
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+import settings
+
+from documents.services.pgvector_store import PgVectorStore
+from documents.services.registry import vector_registry
+
+
+class Command(BaseCommand):
+    help = "Create the pgvector chunks table of the embeddings collection and its indexes, run at deploy"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dimensions", type=int, default=None, help="Embeddings dimension, probed by default")
+        parser.add_argument(
+            "--rebuild-index",
+            action="store_true",
+            help="Build the approximate index again, e.g. IVFFlat after the table has grown",
+        )
+
+    def handle(self, *args, **options):
+        if settings.VECTOR_STORE_BACKEND != "pgvector":
+            self.stdout.write("VECTOR_STORE_BACKEND is not pgvector, nothing to do")
+            return
+        store = vector_registry.get_vector_store()
+        if not isinstance(store, PgVectorStore):
+            raise CommandError("The vector store is not a pgvector store.")
+
+        if not store.table_exists():
+            dimensions = options["dimensions"] or len(store.embeddings.embed_query("dimensions"))
+            store.create_table(dimensions)
+            self.stdout.write(f"Created table {store.table_name} ({dimensions} dimensions)")
+
+        rows = store.count()
+        if store.index_type == "ivfflat" and not rows:
+            # lists are clustered on the rows present at build time
+            self.stdout.write("Table is empty, run this command again to build the IVFFlat index once chunks are indexed")
+            return
+        if options["rebuild_index"] or not store.index_exists():
+            store.create_index(rebuild=options["rebuild_index"])
+            self.stdout.write(f"Built {store.index_type} index of {store.table_name} on {rows} chunks")
+
+# to run this command use: python manage.py setup_pgvector
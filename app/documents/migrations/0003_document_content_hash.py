@@ -0,0 +1,18 @@
+# Generated by Django 4.2.3 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0002_document_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', help_text='SHA-256 of the file content indexed in the vector store.', max_length=64, verbose_name='Indexed Content Hash'),
+        ),
+    ]
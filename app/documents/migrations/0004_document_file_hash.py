@@ -0,0 +1,23 @@
+# Generated by Django 4.2.3 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0003_document_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='file_hash',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='SHA-256 of the uploaded file, files with the same content share one stored file.', max_length=64, verbose_name='File Hash'),
+        ),
+        migrations.AlterField(
+            model_name='document',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='SHA-256 of the file content indexed in the vector store.', max_length=64, verbose_name='Indexed Content Hash'),
+        ),
+    ]
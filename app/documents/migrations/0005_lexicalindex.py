@@ -0,0 +1,24 @@
+# Generated by Django 4.2.3 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0004_document_file_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LexicalIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64, unique=True, verbose_name='Content Hash')),
+                ('index', models.JSONField(help_text='Chunk ids, lengths and postings of the content terms.', verbose_name='Index')),
+                ('chunks_count', models.PositiveIntegerField(default=0, verbose_name='Chunks Count')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+            ],
+        ),
+    ]
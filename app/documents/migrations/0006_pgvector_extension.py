@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+def create_vector_extension(apps, schema_editor):
+    """Create the pgvector extension used by VECTOR_STORE_BACKEND=pgvector, when the server provides it."""
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'vector'")
+        if cursor.fetchone():
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS vector")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0005_lexicalindex'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_vector_extension, migrations.RunPython.noop),
+    ]
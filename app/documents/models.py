@@ -37,6 +37,22 @@ class Document(models.Model):
         default=document_enums.DocumentProcessingStatus.PENDING,
         verbose_name=_("Processing Status"),
     )
+    file_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        default="",
+        db_index=True,
+        verbose_name=_("File Hash"),
+        help_text=_("SHA-256 of the uploaded file, files with the same content share one stored file."),
+    )
+    content_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        default="",
+        db_index=True,
+        verbose_name=_("Indexed Content Hash"),
+        help_text=_("SHA-256 of the file content indexed in the vector store."),
+    )
     created_at = models.DateTimeField(
         auto_now_add=True,
         verbose_name=_("Created At"),
@@ -47,3 +63,28 @@ class Document(models.Model):
     )
 
 
+
+
+class LexicalIndex(models.Model):
+    """BM25 inverted index of the chunks of one indexed content."""
+    content_hash = models.CharField(
+        max_length=64,
+        unique=True,
+        verbose_name=_("Content Hash"),
+    )
+    index = models.JSONField(
+        verbose_name=_("Index"),
+        help_text=_("Chunk ids, lengths and postings of the content terms."),
+    )
+    chunks_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_("Chunks Count"),
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name=_("Created At"),
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name=_("Updated At"),
+    )
@@ -0,0 +1,21 @@
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+
+def format_event(event: str, data) -> str:
+    """Return a Server-Sent Event message with JSON data."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Renders `text/event-stream` responses. Streaming views return the event
+    stream themselves, regular responses (errors) are sent as one `error` event.
+    """
+    media_type = "text/event-stream"
+    format = "event-stream"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return format_event("error", data).encode(self.charset)
@@ -1,7 +1,11 @@
+import hashlib
 
 from rest_framework import serializers
 
+import settings
+
 from documents import models as document_models
+from documents.services.vector import SEARCH_TYPES, RetrievalOptions
 
 
 class DocumentDetailSerializer(serializers.ModelSerializer):
@@ -31,10 +35,55 @@ class DocumentUploadSerializer(serializers.ModelSerializer):
         fields = ("uid", "title", "description", "document_file")
         read_only_fields = ("uid", "created_at", "updated_at")
 
+    def get_file_hash(self, document_file) -> str:
+        """Return the sha256 of the uploaded file, computed while it was received if possible."""
+        upload_hashes = getattr(self.context["request"], "upload_hashes", {})
+        if "document_file" in upload_hashes:
+            return upload_hashes["document_file"]
+        file_hash = hashlib.sha256()
+        for chunk in document_file.chunks():
+            file_hash.update(chunk)
+        document_file.seek(0)
+        return file_hash.hexdigest()
+
     def create(self, validated_data):
         user = self.context["request"].user
+        file_hash = self.get_file_hash(validated_data["document_file"])
+        stored = document_models.Document.objects.filter(
+            file_hash=file_hash,
+        ).exclude(document_file="").first()
+        if stored:
+            # same content is already stored, share the file instead of a new copy
+            validated_data["document_file"] = stored.document_file.name
+
         document = document_models.Document.objects.create(
             user=user,
+            file_hash=file_hash,
             **validated_data
         )
         return document
+
+
+class RetrievalOptionsSerializer(serializers.Serializer):
+    """Chunks search options of a question, missing ones come from the settings."""
+    search_type = serializers.ChoiceField(choices=SEARCH_TYPES, required=False)
+    k = serializers.IntegerField(min_value=1, max_value=20, required=False)
+    fetch_k = serializers.IntegerField(min_value=1, max_value=100, required=False)
+    lambda_mult = serializers.FloatField(min_value=0, max_value=1, required=False)
+    score_threshold = serializers.FloatField(min_value=0, max_value=1, required=False)
+
+    def get_options(self) -> RetrievalOptions:
+        return RetrievalOptions()._replace(**self.validated_data)
+
+
+class BatchQuestionsSerializer(RetrievalOptionsSerializer):
+    """Questions about one document, answered in one request."""
+    questions = serializers.ListField(
+        child=serializers.CharField(max_length=2000, trim_whitespace=True),
+        min_length=1,
+        max_length=settings.BATCH_ASK_MAX_QUESTIONS,
+    )
+
+    def get_options(self) -> RetrievalOptions:
+        options = {key: value for key, value in self.validated_data.items() if key != "questions"}
+        return RetrievalOptions()._replace(**options)
@@ -0,0 +1,119 @@
+import hashlib
+import re
+
+from typing import Optional
+
+import redis
+from django.core.cache import cache
+
+import settings
+
+from documents import models as document_models
+
+from core.custom_logger import logger
+
+
+KEY_PREFIX = "answer_cache"
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase the question, collapse whitespaces and strip the final punctuation."""
+    question = re.sub(r"\s+", " ", question.lower()).strip()
+    return question.rstrip("?!. ")
+
+
+def content_version_key(content_hash: str) -> str:
+    return f"{KEY_PREFIX}:version:{content_hash}"
+
+
+def get_content_version(content_hash: str) -> int:
+    try:
+        return cache.get(content_version_key(content_hash), 0)
+    except redis.RedisError as e:
+        logger.warning(f"Answer cache version read error: {e}")
+        return 0
+
+
+def bump_content_version(content_hash: str) -> None:
+    """Invalidate the cached answers about a content, called when it is re-indexed."""
+    key = content_version_key(content_hash)
+    try:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+    except redis.RedisError as e:
+        logger.error(f"Answer cache version bump error, answers about content {content_hash} may be stale: {e}")
+
+
+class AnswerCache:
+    """
+    Cache of answers keyed by (document uid, indexed content version, normalized
+    question, model, prompt version, variant such as the retrieval options).
+    Answers expire after ANSWER_CACHE_TTL and are invalidated when the document
+    content is indexed again. Redis errors are logged and treated as misses.
+    """
+
+    def __init__(self, model_name: str, prompt_version: str):
+        self.model_name = model_name
+        self.prompt_version = prompt_version
+
+    def make_key(
+        self,
+        document: document_models.Document,
+        question: str,
+        version: int,
+        variant: str = "",
+    ) -> str:
+        question_key = "|".join([
+            normalize_question(question),
+            self.model_name,
+            self.prompt_version,
+            variant,
+        ])
+        question_hash = hashlib.sha256(question_key.encode("utf-8")).hexdigest()
+        return f"{KEY_PREFIX}:{document.uid}:{document.content_hash}:{version}:{question_hash}"
+
+    def get(self, document: document_models.Document, question: str, variant: str = "") -> Optional[str]:
+        if not settings.ANSWER_CACHE_ENABLED:
+            return None
+        try:
+            version = cache.get(content_version_key(document.content_hash), 0)
+            return cache.get(self.make_key(document, question, version, variant))
+        except redis.RedisError as e:
+            logger.warning(f"Answer cache read error: {e}")
+            return None
+
+    def set(self, document: document_models.Document, question: str, answer: str, variant: str = "") -> None:
+        if not settings.ANSWER_CACHE_ENABLED:
+            return
+        try:
+            version = cache.get(content_version_key(document.content_hash), 0)
+            cache.set(
+                self.make_key(document, question, version, variant),
+                answer,
+                timeout=settings.ANSWER_CACHE_TTL,
+            )
+        except redis.RedisError as e:
+            logger.warning(f"Answer cache write error: {e}")
+
+    async def aget(self, document: document_models.Document, question: str, variant: str = "") -> Optional[str]:
+        if not settings.ANSWER_CACHE_ENABLED:
+            return None
+        try:
+            version = await cache.aget(content_version_key(document.content_hash), 0)
+            return await cache.aget(self.make_key(document, question, version, variant))
+        except redis.RedisError as e:
+            logger.warning(f"Answer cache read error: {e}")
+            return None
+
+    async def aset(self, document: document_models.Document, question: str, answer: str, variant: str = "") -> None:
+        if not settings.ANSWER_CACHE_ENABLED:
+            return
+        try:
+            version = await cache.aget(content_version_key(document.content_hash), 0)
+            await cache.aset(
+                self.make_key(document, question, version, variant),
+                answer,
+                timeout=settings.ANSWER_CACHE_TTL,
+            )
+        except redis.RedisError as e:
+            logger.warning(f"Answer cache write error: {e}")
@@ -0,0 +1,109 @@
+import re
+
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+import tiktoken
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+import settings
+
+from core.custom_logger import logger
+
+
+class LocalEncoding:
+    """
+    Approximation of a BPE tokenizer which needs no encoding file: words are
+    cut in pieces of at most 6 characters, each punctuation mark is a token.
+    It slightly over-counts English text compared to cl100k_base.
+    """
+
+    name = "local"
+    pattern = re.compile(r"\w{1,6}|[^\w\s]")
+
+    def encode(self, text: str, disallowed_special=()) -> List[str]:
+        return self.pattern.findall(text)
+
+
+def get_encoding(encoding_name: str = settings.DOCUMENT_CHUNK_ENCODING):
+    """
+    Return the tiktoken encoding used to count tokens. tiktoken downloads the
+    encoding file on first use unless it is in TIKTOKEN_CACHE_DIR (see the
+    Dockerfile); with the offline hashing embeddings, the local approximation
+    is used when it cannot be loaded.
+    """
+    try:
+        return tiktoken.get_encoding(encoding_name)
+    except Exception as e:
+        if settings.EMBEDDING_BACKEND != "hashing":
+            raise
+        logger.warning(f"Token encoding {encoding_name} not available, counting tokens locally: {e}")
+        return LocalEncoding()
+
+
+class DocumentChunker:
+    """
+    Split parsed document pages into token bounded chunks.
+    Sizes are measured in tokens of the embedding model tokenizer, the text is
+    split on the first separator of `separators` that gives small enough pieces.
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = settings.DOCUMENT_CHUNK_SIZE,
+        chunk_overlap: int = settings.DOCUMENT_CHUNK_OVERLAP,
+        separators: List[str] = None,
+        encoding_name: str = settings.DOCUMENT_CHUNK_ENCODING,
+    ):
+        if chunk_overlap >= chunk_size:
+            raise ValueError("Chunk overlap must be smaller than the chunk size.")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = separators or settings.DOCUMENT_CHUNK_SEPARATORS
+        self.encoding = get_encoding(encoding_name)
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            separators=self.separators,
+            length_function=self.count_tokens,
+        )
+
+    def count_tokens(self, text: str) -> int:
+        """Return the number of tokens of the text."""
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def split_text(self, text: str) -> Iterator[Tuple[str, int, int]]:
+        """Yield (chunk, start offset, end offset) for the given text."""
+        offset = 0
+        for chunk in self.splitter.split_text(text):
+            start = text.find(chunk, offset)
+            if start == -1:
+                start = offset
+            end = start + len(chunk)
+            # next chunk overlaps the previous one, search from its start
+            offset = start + 1
+            yield chunk, start, end
+
+    def chunk(
+        self,
+        texts_and_metadata: Iterable[Tuple[str, Dict[str, Any]]],
+    ) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Chunk a stream of (page text, page metadata) pairs.
+        Every chunk gets its own metadata with the page, the chunk position
+        and the character offsets of the chunk in the page text.
+        """
+        chunk_index = 0
+        for page_index, (text, metadata) in enumerate(texts_and_metadata):
+            if not text or not text.strip():
+                continue
+            page = metadata.get("page", page_index)
+            for chunk, start, end in self.split_text(text):
+                yield chunk, {
+                    **metadata,
+                    "page": page,
+                    "chunk_index": chunk_index,
+                    "start_index": start,
+                    "end_index": end,
+                    "token_count": self.count_tokens(chunk),
+                }
+                chunk_index += 1
@@ -0,0 +1,94 @@
+from typing import List, Optional
+
+from langchain_core.documents import Document
+
+import settings
+
+from documents.services.chunking import get_encoding
+
+
+class ContextBuilder:
+    """
+    Pack the retrieved chunks into the prompt context.
+    Chunks are kept in relevance order, overlapping chunks of the same page are
+    merged, and chunks are added until `max_tokens` is reached. Only the page
+    number and the text of each chunk go in the prompt, the loader metadata is
+    left out. Tokens are counted with `encoding_name`, an approximation of the
+    LLM tokenizer.
+    """
+
+    separator = "\n\n---\n\n"
+
+    def __init__(
+        self,
+        max_tokens: int = settings.CONTEXT_MAX_TOKENS,
+        encoding_name: str = settings.DOCUMENT_CHUNK_ENCODING,
+    ):
+        self.max_tokens = max_tokens
+        self.encoding = get_encoding(encoding_name)
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    @staticmethod
+    def merge(first: Document, second: Document) -> Optional[Document]:
+        """Return the two chunks merged if they overlap in the same page, else None."""
+        first_meta, second_meta = first.metadata, second.metadata
+        if first.id is not None and first.id == second.id:
+            return first
+        if first.page_content == second.page_content:
+            return first
+        if first_meta.get("page") != second_meta.get("page"):
+            return None
+        try:
+            first_start, first_end = int(first_meta["start_index"]), int(first_meta["end_index"])
+            second_start, second_end = int(second_meta["start_index"]), int(second_meta["end_index"])
+        except (KeyError, TypeError, ValueError):
+            return None
+        if second_start < first_start:
+            first, second = second, first
+            first_start, first_end, second_start, second_end = second_start, second_end, first_start, first_end
+        if second_start > first_end:
+            return None
+        if second_end <= first_end:
+            return first
+        text = first.page_content + second.page_content[first_end - second_start:]
+        return Document(
+            page_content=text,
+            metadata={**first.metadata, "start_index": first_start, "end_index": second_end},
+            id=first.id,
+        )
+
+    def deduplicate(self, chunks: List[Document]) -> List[Document]:
+        """Merge the duplicated and overlapping chunks, at the rank of the best one."""
+        packed = []
+        for chunk in chunks:
+            for position, kept in enumerate(packed):
+                merged = self.merge(kept, chunk)
+                if merged is not None:
+                    packed[position] = merged
+                    break
+            else:
+                packed.append(chunk)
+        return packed
+
+    @staticmethod
+    def format_chunk(chunk: Document) -> str:
+        page = chunk.metadata.get("page")
+        header = f"[page {int(page) + 1}]\n" if isinstance(page, (int, float)) else ""
+        return f"{header}{chunk.page_content.strip()}"
+
+    def pack(self, chunks: List[Document]) -> List[Document]:
+        """Return the chunks fitting in the token budget, most relevant first."""
+        packed = []
+        used = 0
+        for chunk in self.deduplicate(chunks):
+            tokens = self.count_tokens(self.format_chunk(chunk) + self.separator)
+            if used + tokens > self.max_tokens:
+                continue
+            packed.append(chunk)
+            used += tokens
+        return packed
+
+    def format(self, chunks: List[Document]) -> str:
+        return self.separator.join(self.format_chunk(chunk) for chunk in chunks)
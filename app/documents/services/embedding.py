@@ -0,0 +1,92 @@
+import random
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterable, Iterator, List
+
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+import settings
+
+from documents.services.pipeline import close_db_connections
+
+
+def is_rate_limit_error(exc: Exception) -> bool:
+    """Check if an embedding provider error is a rate limit (HTTP 429) error."""
+    if getattr(exc, "status_code", None) == 429:
+        return True
+    return exc.__class__.__name__ in ("RateLimitError", "ResourceExhausted")
+
+
+class BatchEmbedder:
+    """
+    Embed and store documents in size bounded batches.
+    Batches are limited both by the number of documents and by the sum of their
+    `token_count` metadata, at most `max_workers` batches are in flight at once.
+    """
+
+    def __init__(
+        self,
+        vector_store: VectorStore,
+        batch_size: int = settings.EMBEDDING_BATCH_SIZE,
+        batch_max_tokens: int = settings.EMBEDDING_BATCH_MAX_TOKENS,
+        max_workers: int = settings.EMBEDDING_MAX_WORKERS,
+        max_retries: int = settings.EMBEDDING_MAX_RETRIES,
+    ):
+        self.vector_store = vector_store
+        self.batch_size = batch_size
+        self.batch_max_tokens = batch_max_tokens
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+
+    def make_batches(self, documents: Iterable[Document]) -> Iterator[List[Document]]:
+        """Group documents into batches bounded by count and tokens."""
+        batch = []
+        batch_tokens = 0
+        for document in documents:
+            tokens = document.metadata.get("token_count", 0)
+            if batch and (
+                len(batch) >= self.batch_size
+                or batch_tokens + tokens > self.batch_max_tokens
+            ):
+                yield batch
+                batch = []
+                batch_tokens = 0
+            batch.append(document)
+            batch_tokens += tokens
+        if batch:
+            yield batch
+
+    def _add_batch(self, batch: List[Document]) -> int:
+        """Store one batch, backing off exponentially on rate limit errors."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.vector_store.add_documents(
+                    documents=batch,
+                    ids=[document.id for document in batch],
+                )
+                return len(batch)
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == self.max_retries:
+                    raise
+                delay = min(
+                    settings.EMBEDDING_BACKOFF_MAX,
+                    settings.EMBEDDING_BACKOFF_BASE * 2 ** attempt,
+                )
+                time.sleep(delay + random.uniform(0, delay / 2))
+        return 0
+
+    def add_documents(self, documents: Iterable[Document]) -> int:
+        """Embed and store all documents, return the number of stored documents."""
+        stored = 0
+        add_batch = close_db_connections(self._add_batch)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            in_flight = set()
+            for batch in self.make_batches(documents):
+                if len(in_flight) >= self.max_workers:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    stored += sum(future.result() for future in done)
+                in_flight.add(executor.submit(add_batch, batch))
+            stored += sum(future.result() for future in in_flight)
+        return stored
@@ -0,0 +1,189 @@
+import hashlib
+import threading
+import time
+
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import redis
+from langchain_core.embeddings import Embeddings
+
+import settings
+
+from core.redis import redis_storage
+from core.custom_logger import logger
+
+
+REDIS_KEY_PREFIX = "embedding_cache"
+REDIS_LRU_KEY = f"{REDIS_KEY_PREFIX}:lru"
+REDIS_STATS_KEY = f"{REDIS_KEY_PREFIX}:stats"
+
+
+def pack_vector(vector: List[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def unpack_vector(data: bytes) -> List[float]:
+    vector = array("f")
+    vector.frombytes(data)
+    return vector.tolist()
+
+
+class LocalLRUCache:
+    """Thread safe in-process LRU cache bounded by the number of entries."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class RedisLRUCache:
+    """
+    Redis cache bounded by the number of entries.
+    Last access times are kept in a sorted set, the least recently used
+    entries are evicted when the cache grows over `max_size`.
+    Redis errors are logged and treated as misses.
+    """
+
+    def __init__(self, max_size: int, connection: redis.Redis = None):
+        self.max_size = max_size
+        self.connection = connection or redis_storage.binary_connection
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        if not keys:
+            return {}
+        try:
+            values = self.connection.mget([f"{REDIS_KEY_PREFIX}:{key}" for key in keys])
+            found = {key: value for key, value in zip(keys, values) if value is not None}
+            if found:
+                now = time.time()
+                self.connection.zadd(REDIS_LRU_KEY, {key: now for key in found})
+        except redis.RedisError as e:
+            logger.warning(f"Embedding cache read error: {e}")
+            return {}
+        return {key: unpack_vector(value) for key, value in found.items()}
+
+    def set_many(self, items: Dict[str, List[float]]) -> None:
+        if not items or self.max_size <= 0:
+            return
+        now = time.time()
+        try:
+            pipeline = self.connection.pipeline()
+            for key, vector in items.items():
+                pipeline.set(f"{REDIS_KEY_PREFIX}:{key}", pack_vector(vector))
+            pipeline.zadd(REDIS_LRU_KEY, {key: now for key in items})
+            pipeline.zcard(REDIS_LRU_KEY)
+            size = pipeline.execute()[-1]
+            if size > self.max_size:
+                evicted = self.connection.zpopmin(REDIS_LRU_KEY, size - self.max_size)
+                if evicted:
+                    self.connection.delete(*[
+                        f"{REDIS_KEY_PREFIX}:{key.decode()}" for key, _ in evicted
+                    ])
+        except redis.RedisError as e:
+            logger.warning(f"Embedding cache write error: {e}")
+
+    def incr_stats(self, **counters: int) -> None:
+        try:
+            pipeline = self.connection.pipeline()
+            for name, value in counters.items():
+                if value:
+                    pipeline.hincrby(REDIS_STATS_KEY, name, value)
+            pipeline.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Embedding cache stats error: {e}")
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper caching vectors by (model, sha256 of the text).
+    Lookups go to the in-process LRU first, then to the shared Redis LRU,
+    only the remaining texts are sent to the wrapped embeddings. The local LRU
+    keeps packed float32 vectors (4 bytes per dimension) rather than lists of
+    Python floats, which take about 8 times more memory.
+    """
+
+    local_cache = LocalLRUCache(settings.EMBEDDING_CACHE_LOCAL_SIZE)
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model_name: str,
+        redis_cache: RedisLRUCache = None,
+    ):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.redis_cache = redis_cache or RedisLRUCache(settings.EMBEDDING_CACHE_REDIS_SIZE)
+        self.stats = {"local_hits": 0, "redis_hits": 0, "misses": 0}
+        self._stats_lock = threading.Lock()
+
+    def cache_key(self, text: str) -> str:
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{self.model_name}:{digest}"
+
+    def _count(self, **counters: int) -> None:
+        with self._stats_lock:
+            for name, value in counters.items():
+                self.stats[name] += value
+        self.redis_cache.incr_stats(**counters)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self.cache_key(text) for text in texts]
+        vectors = {}
+        for key in keys:
+            packed = self.local_cache.get(key)
+            if packed is not None:
+                vectors[key] = unpack_vector(packed)
+        local_hits = len(vectors)
+
+        missing = [key for key in dict.fromkeys(keys) if key not in vectors]
+        from_redis = self.redis_cache.get_many(missing)
+        for key, vector in from_redis.items():
+            self.local_cache.set(key, pack_vector(vector))
+        vectors.update(from_redis)
+
+        # embed every distinct missing text once
+        to_embed = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                to_embed.setdefault(key, text)
+        if to_embed:
+            embedded = dict(zip(
+                to_embed.keys(),
+                self.embeddings.embed_documents(list(to_embed.values())),
+            ))
+            for key, vector in embedded.items():
+                self.local_cache.set(key, pack_vector(vector))
+            self.redis_cache.set_many(embedded)
+            vectors.update(embedded)
+
+        self._count(
+            local_hits=local_hits,
+            redis_hits=len(from_redis),
+            misses=len(to_embed),
+        )
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
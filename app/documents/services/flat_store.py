@@ -0,0 +1,476 @@
+import fcntl
+import json
+import os
+import shutil
+import time
+
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+import settings
+
+from documents.services.embedding_cache import LocalLRUCache
+
+
+QUANTIZATIONS = ("none", "float16", "int8")
+
+# rows scored at once on the quantized matrix, bounds the float32 temporary copy
+SCORE_BLOCK_ROWS = 8192
+
+
+def quantize(matrix: np.ndarray, quantization: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return the quantized codes of the matrix rows and their scale factors,
+    a row is approximated by codes[row] * scales[row].
+    """
+    if quantization == "float16":
+        return matrix.astype(np.float16), np.ones(len(matrix), dtype=np.float32)
+    if quantization == "int8":
+        scales = np.abs(matrix).max(axis=1) / 127 if len(matrix) else np.empty(0, dtype=np.float32)
+        scales = scales.astype(np.float32)
+        scales[scales == 0] = 1
+        codes = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales
+    raise ValueError(f"Unknown quantization: {quantization}")
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Return the positions of the `k` highest scores, highest first."""
+    k = min(k, len(scores))
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best])]
+
+
+class Segment(NamedTuple):
+    matrix: np.ndarray
+    chunks: Dict[str, List[Any]]
+    codes: Optional[np.ndarray] = None
+    scales: Optional[np.ndarray] = None
+
+
+class FlatVectorStore(VectorStore):
+    """
+    Exact vector store of one float32 matrix file per content.
+    Each content has a directory of segments, a segment is a `.npy` matrix of
+    normalized embeddings next to a `.json` file of the chunk ids, texts and
+    metadata. Every stored batch is a new segment, segments are merged into a
+    single one after indexing (or on first read). Searches memory-map the
+    matrix, so the OS page cache is shared by all the processes of the node,
+    and run an exact dot product with an `argpartition` top k.
+
+    With `quantization` (float16, or int8 with a scale factor per vector) the
+    segments also store the quantized matrix. Searches score it first, which
+    keeps the hot pages 2x or 4x smaller, then re-score the `rescore_factor * k`
+    best candidates exactly with the float32 rows. The float32 matrix is kept
+    for that re-scoring, so quantization trades disk space (1.25x or 1.5x of
+    the float32 size) for less memory scanned per search, it does not save storage.
+
+    Searches and `get` must be filtered by `content_hash`, `delete` takes it
+    as `where` like the Chroma one.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        directory: str,
+        quantization: str = settings.FLAT_INDEX_QUANTIZATION,
+        rescore_factor: int = settings.FLAT_INDEX_RESCORE_FACTOR,
+    ):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization: {quantization}")
+        self._embeddings = embeddings
+        self.directory = directory
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+        # memory maps and chunks of the segments, a segment file never changes
+        self._segments = LocalLRUCache(settings.FLAT_INDEX_CACHE_SIZE)
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embeddings
+
+    def content_directory(self, content_hash: str) -> str:
+        if not content_hash or not content_hash.isalnum():
+            raise ValueError(f"Invalid content hash: {content_hash!r}")
+        return os.path.join(self.directory, content_hash)
+
+    @contextmanager
+    def locked(self, content_hash: str) -> Iterator[str]:
+        """Hold the content lock, shared by threads and processes, yield its directory."""
+        directory = self.content_directory(content_hash)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield directory
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def list_segments(directory: str) -> List[str]:
+        """Return the segment names, oldest first."""
+        if not os.path.isdir(directory):
+            return []
+        return sorted(name[:-4] for name in os.listdir(directory) if name.endswith(".npy"))
+
+    def write_segment(self, directory: str, matrix: np.ndarray, chunks: Dict[str, List[Any]]) -> None:
+        """
+        Write a segment, it is visible to readers once its matrix file exists.
+        Quantized codes are written next to the float32 matrix, not instead of it.
+        """
+        name = f"{time.time_ns():020d}-{os.getpid()}"
+        with open(os.path.join(directory, f"{name}.json"), "w") as chunks_file:
+            json.dump(chunks, chunks_file)
+        if self.quantization != "none":
+            codes, scales = quantize(np.asarray(matrix, dtype=np.float32), self.quantization)
+            with open(os.path.join(directory, f"{name}.codes"), "wb") as codes_file:
+                np.save(codes_file, codes)
+            with open(os.path.join(directory, f"{name}.scales"), "wb") as scales_file:
+                np.save(scales_file, scales)
+        tmp_path = os.path.join(directory, f"{name}.tmp")
+        with open(tmp_path, "wb") as matrix_file:
+            np.save(matrix_file, np.ascontiguousarray(matrix, dtype=np.float32))
+        os.replace(tmp_path, os.path.join(directory, f"{name}.npy"))
+
+    @staticmethod
+    def remove_segments(directory: str, names: Iterable[str]) -> None:
+        for name in names:
+            for extension in (".npy", ".json", ".codes", ".scales"):
+                try:
+                    os.remove(os.path.join(directory, f"{name}{extension}"))
+                except FileNotFoundError:
+                    pass
+
+    def read_segment(self, directory: str, name: str) -> Segment:
+        key = os.path.join(directory, name)
+        segment = self._segments.get(key)
+        if segment is None:
+            matrix = np.load(f"{key}.npy", mmap_mode="r")
+            with open(f"{key}.json") as chunks_file:
+                chunks = json.load(chunks_file)
+            codes = scales = None
+            if os.path.exists(f"{key}.codes"):
+                codes = np.load(f"{key}.codes", mmap_mode="r")
+                scales = np.load(f"{key}.scales")
+            segment = Segment(matrix, chunks, codes, scales)
+            self._segments.set(key, segment)
+        return segment
+
+    def merge_segments(self, directory: str, names: List[str]) -> Tuple[np.ndarray, Dict[str, List[Any]]]:
+        """Return the chunks of the segments, a chunk id keeps its latest version."""
+        rows = {}
+        segments = [self.read_segment(directory, name) for name in names]
+        for segment_index, segment in enumerate(segments):
+            for row, _id in enumerate(segment.chunks["ids"]):
+                rows[_id] = (segment_index, row)
+        merged = {"ids": [], "documents": [], "metadatas": []}
+        vectors = []
+        for _id, (segment_index, row) in rows.items():
+            matrix, chunks = segments[segment_index][:2]
+            merged["ids"].append(_id)
+            merged["documents"].append(chunks["documents"][row])
+            merged["metadatas"].append(chunks["metadatas"][row])
+            vectors.append(matrix[row])
+        dimensions = segments[0].matrix.shape[1] if segments else 0
+        matrix = np.vstack(vectors) if vectors else np.empty((0, dimensions), dtype=np.float32)
+        return matrix, merged
+
+    def compact(self, content_hash: str) -> None:
+        """Merge the content segments into one matrix file."""
+        with self.locked(content_hash) as directory:
+            names = self.list_segments(directory)
+            if len(names) < 2:
+                return
+            matrix, chunks = self.merge_segments(directory, names)
+            if chunks["ids"]:
+                self.write_segment(directory, matrix, chunks)
+            self.remove_segments(directory, names)
+
+    def load(self, content_hash: str) -> Optional[Segment]:
+        """Return the memory-mapped segment of the content."""
+        directory = self.content_directory(content_hash)
+        for _ in range(3):
+            names = self.list_segments(directory)
+            if not names:
+                return None
+            if len(names) > 1:
+                self.compact(content_hash)
+                continue
+            try:
+                return self.read_segment(directory, names[0])
+            except FileNotFoundError:
+                # replaced by a compaction meanwhile
+                continue
+        return None
+
+    def add_embeddings(
+        self,
+        texts: List[str],
+        vectors: List[List[float]],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+    ) -> List[str]:
+        """Store already embedded chunks, one segment per content."""
+        metadatas = metadatas or [{} for _ in texts]
+        if ids is None:
+            raise ValueError("Chunk ids are required.")
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        matrix /= norms
+
+        rows_by_content = {}
+        for row, metadata in enumerate(metadatas):
+            rows_by_content.setdefault((metadata or {}).get("content_hash", ""), []).append(row)
+        for content_hash, rows in rows_by_content.items():
+            with self.locked(content_hash) as directory:
+                self.write_segment(directory, matrix[rows], {
+                    "ids": [ids[row] for row in rows],
+                    "documents": [texts[row] for row in rows],
+                    "metadatas": [metadatas[row] or {} for row in rows],
+                })
+        return list(ids)
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        return self.add_embeddings(texts, self._embeddings.embed_documents(texts), metadatas, ids)
+
+    @staticmethod
+    def get_content_hash(filter: Optional[Dict[str, Any]]) -> str:
+        if not filter or "content_hash" not in filter:
+            raise ValueError("Flat index searches must be filtered by content_hash.")
+        return filter["content_hash"]
+
+    def matching_rows(self, chunks: Dict[str, List[Any]], filter: Dict[str, Any]) -> Optional[np.ndarray]:
+        """Return the rows matching the other filter keys, None when all match."""
+        conditions = {key: value for key, value in filter.items() if key != "content_hash"}
+        if not conditions:
+            return None
+        return np.array([
+            row
+            for row, metadata in enumerate(chunks["metadatas"])
+            if all(metadata.get(key) == value for key, value in conditions.items())
+        ], dtype=np.intp)
+
+    def search_by_vector(
+        self,
+        embedding: List[float],
+        k: int,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Tuple[Document, float, np.ndarray]]:
+        """Return the (chunk, cosine similarity, vector) of the `k` most similar chunks."""
+        segment = self.load(self.get_content_hash(filter))
+        if segment is None:
+            return []
+        matrix, chunks = segment.matrix, segment.chunks
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+
+        rows = self.matching_rows(chunks, filter)
+        count = len(chunks["ids"]) if rows is None else len(rows)
+        k = min(k, count)
+        if k <= 0:
+            return []
+
+        if segment.codes is not None and self.rescore_factor * k < count:
+            # coarse search on the quantized rows, then exact scores of the candidates
+            rows = np.arange(count) if rows is None else rows
+            coarse = self.quantized_scores(segment, rows, query)
+            rows = rows[top_k(coarse, self.rescore_factor * k)]
+        if rows is None:
+            scores = matrix @ query
+            rows = np.arange(count)
+        else:
+            scores = matrix[rows] @ query
+        best = top_k(scores, k)
+        return [
+            (
+                Document(
+                    page_content=chunks["documents"][rows[i]],
+                    metadata=chunks["metadatas"][rows[i]],
+                    id=chunks["ids"][rows[i]],
+                ),
+                float(scores[i]),
+                matrix[rows[i]],
+            )
+            for i in best
+        ]
+
+    @staticmethod
+    def quantized_scores(segment: Segment, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """Return the approximate scores of the rows, computed block by block."""
+        scores = np.empty(len(rows), dtype=np.float32)
+        contiguous = len(rows) == len(segment.scales)
+        for start in range(0, len(rows), SCORE_BLOCK_ROWS):
+            stop = start + SCORE_BLOCK_ROWS
+            if contiguous:
+                codes, scales = segment.codes[start:stop], segment.scales[start:stop]
+            else:
+                block = rows[start:stop]
+                codes, scales = segment.codes[block], segment.scales[block]
+            scores[start:stop] = (codes.astype(np.float32) @ query) * scales
+        return scores
+
+    def similarity_search_by_vectors(
+        self,
+        embeddings: List[List[float]],
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[List[Document]]:
+        """Return the `k` most similar chunks of each query, scored by one matrix product."""
+        segment = self.load(self.get_content_hash(filter))
+        if segment is None:
+            return [[] for _ in embeddings]
+        if segment.codes is not None or self.matching_rows(segment.chunks, filter) is not None:
+            return [self.similarity_search_by_vector(embedding, k, filter) for embedding in embeddings]
+
+        queries = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        scores = segment.matrix @ (queries / norms).T
+        chunks = segment.chunks
+        return [
+            [
+                Document(
+                    page_content=chunks["documents"][row],
+                    metadata=chunks["metadatas"][row],
+                    id=chunks["ids"][row],
+                )
+                for row in top_k(scores[:, column], k)
+            ]
+            for column in range(len(queries))
+        ]
+
+    def similarity_search_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        return [document for document, _, _ in self.search_by_vector(embedding, k, filter)]
+
+    def similarity_search_with_score(
+        self,
+        query: str,
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> List[Tuple[Document, float]]:
+        """Return the chunks and their cosine distance."""
+        embedding = self._embeddings.embed_query(query)
+        return [
+            (document, 1 - similarity)
+            for document, similarity, _ in self.search_by_vector(embedding, k, filter)
+        ]
+
+    def similarity_search(
+        self,
+        query: str,
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        return [document for document, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        return self._cosine_relevance_score_fn
+
+    def max_marginal_relevance_search(
+        self,
+        query: str,
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        filter: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        embedding = self._embeddings.embed_query(query)
+        candidates = self.search_by_vector(embedding, fetch_k, filter)
+        if not candidates:
+            return []
+        selected = maximal_marginal_relevance(
+            np.asarray(embedding, dtype=np.float32),
+            [vector for _, _, vector in candidates],
+            k=k,
+            lambda_mult=lambda_mult,
+        )
+        return [candidates[i][0] for i in selected]
+
+    def get(
+        self,
+        ids: Optional[List[str]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        include: Optional[List[str]] = None,
+    ) -> Dict[str, List[Any]]:
+        """Return the chunks of a content, in the Chroma `get` format, embeddings are normalized."""
+        include = include or ["documents", "metadatas"]
+        result = {"ids": [], "documents": [], "metadatas": []}
+        embeddings = []
+        segment = self.load(self.get_content_hash(where))
+        if segment is not None:
+            chunks = segment.chunks
+            rows = self.matching_rows(chunks, where)
+            rows = range(len(chunks["ids"])) if rows is None else rows
+            wanted = set(ids) if ids is not None else None
+            for row in rows:
+                if wanted is not None and chunks["ids"][row] not in wanted:
+                    continue
+                for key in result:
+                    result[key].append(chunks[key][row])
+                if "embeddings" in include:
+                    embeddings.append(segment.matrix[row].tolist())
+        result["embeddings"] = embeddings
+        return {key: value for key, value in result.items() if key == "ids" or key in include}
+
+    def delete(
+        self,
+        ids: Optional[List[str]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> Optional[bool]:
+        """Delete chunks of the content given by `where`."""
+        content_hash = self.get_content_hash(where)
+        with self.locked(content_hash) as directory:
+            names = self.list_segments(directory)
+            matrix, chunks = self.merge_segments(directory, names)
+            deleted = set(ids) if ids is not None else set(chunks["ids"])
+            keep = [row for row, _id in enumerate(chunks["ids"]) if _id not in deleted]
+            if keep:
+                self.write_segment(directory, matrix[keep], {
+                    key: [values[row] for row in keep] for key, values in chunks.items()
+                })
+            self.remove_segments(directory, names)
+        if not keep:
+            shutil.rmtree(self.content_directory(content_hash), ignore_errors=True)
+        return True
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        directory: str = settings.FLAT_INDEX_DIR,
+        **kwargs: Any,
+    ) -> "FlatVectorStore":
+        store = cls(embedding, directory=directory)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
@@ -0,0 +1,233 @@
+import heapq
+import math
+import os
+import re
+import threading
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+
+import settings
+
+from documents import models as document_models
+from documents.services.answer_cache import get_content_version
+from documents.services.embedding_cache import LocalLRUCache
+from documents.services.pipeline import close_db_connections
+
+from core.custom_logger import logger
+
+
+# words, numbers and compound terms such as clause numbers (12.3.1) or SKUs (AB-1234)
+TOKEN_PATTERN = re.compile(r"\w+(?:[./\-]\w+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """Return the lowercased terms of the text, compound terms are also split in parts."""
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        terms.append(token)
+        if not token.isalnum():
+            terms.extend(part for part in re.split(r"[./\-]", token) if part)
+    return terms
+
+
+class BM25Index:
+    """
+    Okapi BM25 inverted index of the chunks of one content.
+    Postings map a term to the (chunk position, term frequency) pairs, only
+    the chunk ids are kept, texts are read from the vector store.
+    """
+
+    def __init__(
+        self,
+        ids: List[str],
+        lengths: List[int],
+        postings: Dict[str, List[Tuple[int, int]]],
+        k1: float = 1.5,
+        b: float = 0.75,
+    ):
+        self.ids = ids
+        self.lengths = lengths
+        self.postings = postings
+        self.k1 = k1
+        self.b = b
+        self.avg_length = sum(lengths) / len(lengths) if lengths else 0
+
+    @classmethod
+    def build(cls, chunks: Iterable[Tuple[str, str]]) -> "BM25Index":
+        """Build the index from (chunk id, chunk text) pairs."""
+        ids = []
+        lengths = []
+        postings = {}
+        for position, (_id, text) in enumerate(chunks):
+            terms = tokenize(text or "")
+            ids.append(_id)
+            lengths.append(len(terms))
+            for term, frequency in Counter(terms).items():
+                postings.setdefault(term, []).append((position, frequency))
+        return cls(ids, lengths, postings)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"ids": self.ids, "lengths": self.lengths, "postings": self.postings}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "BM25Index":
+        return cls(data["ids"], data["lengths"], data["postings"])
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """Return the (chunk id, score) of the `k` best matching chunks."""
+        if not self.ids:
+            return []
+        chunks_count = len(self.ids)
+        scores = Counter()
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (chunks_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for position, frequency in postings:
+                norm = 1 - self.b + self.b * self.lengths[position] / self.avg_length
+                scores[position] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * norm)
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.ids[position], score) for position, score in best]
+
+
+# indexes loaded in this process, keyed by content hash and version
+loaded_indexes = LocalLRUCache(settings.LEXICAL_INDEX_CACHE_SIZE)
+
+
+def save_lexical_index(content_hash: str, index: BM25Index) -> None:
+    document_models.LexicalIndex.objects.update_or_create(
+        content_hash=content_hash,
+        defaults={"index": index.to_dict(), "chunks_count": len(index.ids)},
+    )
+
+
+def get_lexical_index(content_hash: str) -> Optional[BM25Index]:
+    """Return the BM25 index of the content, None if it is not built yet."""
+    key = f"{content_hash}:{get_content_version(content_hash)}"
+    index = loaded_indexes.get(key)
+    if index is None:
+        data = (
+            document_models.LexicalIndex.objects
+            .filter(content_hash=content_hash)
+            .values_list("index", flat=True)
+            .first()
+        )
+        if data is None:
+            return None
+        index = BM25Index.from_dict(data)
+        loaded_indexes.set(key, index)
+    return index
+
+
+def reciprocal_rank_fusion(
+    rankings: List[List[Document]],
+    k: int,
+    rrf_k: int = 60,
+) -> List[Document]:
+    """Merge ranked lists of chunks, each chunk scores the sum of 1 / (rrf_k + rank)."""
+    scores = Counter()
+    chunks = {}
+    for ranking in rankings:
+        for rank, chunk in enumerate(ranking, start=1):
+            key = chunk.id or chunk.page_content
+            chunks.setdefault(key, chunk)
+            scores[key] += 1 / (rrf_k + rank)
+    return [chunks[key] for key, _ in scores.most_common(k)]
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Return the process thread pool running the dense searches."""
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=settings.HYBRID_SEARCH_WORKERS)
+            _executor_pid = os.getpid()
+        return _executor
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever fusing the dense vector search with the BM25 search of the
+    content chunks by reciprocal rank fusion. The dense search runs on a
+    thread pool while the lexical search, which needs no network call, runs
+    in the calling thread. When the dense search fails or is slower than
+    `dense_timeout`, the lexical results are returned alone. With `adaptive`,
+    the dense search applies a score threshold and the fused results are cut
+    to the number of chunks above it.
+    """
+
+    vector_retriever: BaseRetriever
+    vector_store: VectorStore
+    content_hash: str
+    k: int = 5
+    rrf_k: int = 60
+    dense_timeout: float = 10
+    adaptive: bool = False
+
+    def get_lexical_documents(self, query: str) -> List[Document]:
+        index = get_lexical_index(self.content_hash)
+        if index is None:
+            return []
+        ids = [_id for _id, _ in index.search(query, self.k)]
+        if not ids:
+            return []
+        found = self.vector_store.get(
+            ids=ids,
+            where={"content_hash": self.content_hash},
+            include=["documents", "metadatas"],
+        )
+        chunks = {
+            _id: Document(page_content=text, metadata=metadata or {}, id=_id)
+            for _id, text, metadata in zip(found["ids"], found["documents"], found["metadatas"])
+        }
+        return [chunks[_id] for _id in ids if _id in chunks]
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun,
+    ) -> List[Document]:
+        dense_future = get_executor().submit(
+            close_db_connections(self.vector_retriever.invoke),
+            query,
+            {"callbacks": run_manager.get_child()},
+        )
+        lexical = self.get_lexical_documents(query)
+        if not lexical:
+            return dense_future.result()
+
+        try:
+            dense = dense_future.result(timeout=self.dense_timeout)
+        except TimeoutError:
+            logger.warning(f"Dense search slower than {self.dense_timeout}s, using lexical results")
+            dense = []
+        except Exception as e:
+            logger.warning(f"Dense search failed, using lexical results: {e}")
+            dense = []
+        k = min(self.k, max(len(dense), 1)) if self.adaptive else self.k
+        return reciprocal_rank_fusion([dense, lexical], k=k, rrf_k=self.rrf_k)
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: AsyncCallbackManagerForRetrieverRun,
+    ) -> List[Document]:
+        # the lexical index and the chunks are read from the database on the
+        # thread Django runs the sync code of the request on
+        return await sync_to_async(self.invoke)(query, {"callbacks": run_manager.get_child()})
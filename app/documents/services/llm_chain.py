@@ -1,12 +1,21 @@
+from typing import Any, AsyncIterator, Dict, Iterator, List, NamedTuple, Optional, Tuple
 
+from asgiref.sync import sync_to_async
+
+from langchain_core.documents import Document
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_google_genai import ChatGoogleGenerativeAI
-from documents.services.vector import DocumentVectorStore
+from documents.services.vector import DocumentVectorStore, RetrievalOptions
+from documents.services.answer_cache import AnswerCache
+from documents.services.context import ContextBuilder
+from documents.services.semantic_cache import SemanticAnswerCache
+from documents.services.registry import vector_registry
 from documents import models as document_models
-from documents import enums as document_enums
 
 import settings
 
+from core.custom_logger import logger
+
 
 model = ChatGoogleGenerativeAI(
     model=settings.GEMINI_MODEL,
@@ -26,29 +35,287 @@ Here are some relevant text related to the question:
 Here is the question to answer: {question}
 """
 
+# change it with the template, cached answers of the previous prompt are not used
+PROMPT_VERSION = "2"
+
 prompt = ChatPromptTemplate.from_template(template)
 chain = prompt | model
 
+answer_cache = AnswerCache(model_name=settings.GEMINI_MODEL, prompt_version=PROMPT_VERSION)
+semantic_cache = SemanticAnswerCache(model_name=settings.GEMINI_MODEL, prompt_version=PROMPT_VERSION)
+context_builder = ContextBuilder()
+
+
+class Answer(NamedTuple):
+    content: str
+    cached: bool = False
+    # cached answer of a similar question
+    semantic: bool = False
+    # set when the question failed in a batch, see `answer_questions`
+    error: Optional[str] = None
+
+
+def get_context(
+    question: str,
+    document: document_models.Document,
+    options: Optional[RetrievalOptions] = None,
+) -> List[Document]:
+    """Return the document chunks relevant to the question."""
+    retriever = DocumentVectorStore().get_retriever(document, options)
+    return retriever.invoke(question)
+
+
+def pack_context(question: str, context: List[Document]) -> Tuple[List[Document], str]:
+    """Return the chunks kept in the prompt and the prompt context text."""
+    packed = context_builder.pack(context)
+    text = context_builder.format(packed)
+    logger.info(
+        f"Prompt context: {len(packed)}/{len(context)} chunks, "
+        f"{context_builder.count_tokens(text)} context tokens "
+        f"(unpacked {context_builder.count_tokens(str(context))}), "
+        f"{context_builder.count_tokens(question)} question tokens"
+    )
+    return packed, text
+
+
+def get_sources(context: List[Document]) -> List[Dict[str, Any]]:
+    """Return the position in the document of the context chunks."""
+    return [
+        {
+            "page": chunk.metadata.get("page"),
+            "chunk_index": chunk.metadata.get("chunk_index"),
+            "start_index": chunk.metadata.get("start_index"),
+            "end_index": chunk.metadata.get("end_index"),
+        }
+        for chunk in context
+    ]
+
 
-def answer_question(question: str, document: document_models.Document) -> str:
+def answer_question(
+    question: str,
+    document: document_models.Document,
+    options: Optional[RetrievalOptions] = None,
+) -> Answer:
     """
     Answer a question using the LLM chain with the provided question and context.
+    Answers are cached, the same question about the same content is answered
+    without retrieval nor LLM call.
 
     Args:
         question (str): The question to answer.
+        document (Document): An already indexed document, see `ingest_document_task`.
+        options (RetrievalOptions): The chunks search options, from the settings by default.
 
     Returns:
-        str: The answer to the question.
+        Answer: The answer to the question and whether it comes from the cache.
     """
-    if not document.status == document_enums.DocumentProcessingStatus.COMPLETED:
-        DocumentVectorStore().add_documents(
-            document
-        )
-    
-    retriever = DocumentVectorStore().get_retriever()
+    options = options or RetrievalOptions()
+    variant = options.cache_key()
+    cached = answer_cache.get(document, question, variant)
+    if cached is not None:
+        return Answer(cached, cached=True)
 
+    question_vector = None
+    # similar questions are only matched with the default retrieval options
+    if settings.SEMANTIC_CACHE_ENABLED and options == RetrievalOptions():
+        question_vector = vector_registry.get_embeddings().embed_query(question)
+        cached = semantic_cache.lookup(document, question_vector)
+        if cached is not None:
+            logger.info(f"Semantic answer cache hit, stats: {semantic_cache.get_stats()}")
+            return Answer(cached, cached=True, semantic=True)
+
+    _, context = pack_context(question, get_context(question, document, options))
     response = chain.invoke({
         "question": question,
-        "context": retriever.invoke(question)
+        "context": context,
+    })
+    if not response:
+        return Answer("No answer found.")
+    answer_cache.set(document, question, response.content, variant)
+    if question_vector is not None:
+        semantic_cache.add(document, question_vector, response.content)
+    return Answer(response.content)
+
+
+def get_contexts(
+    questions: List[str],
+    vectors: List[List[float]],
+    document: document_models.Document,
+    options: RetrievalOptions,
+) -> List[Any]:
+    """
+    Return the chunks of each question, searched in one pass. If it fails, the
+    questions are searched one by one and an error only replaces its own chunks.
+    """
+    try:
+        return DocumentVectorStore().batch_search(document, questions, vectors, options)
+    except Exception as e:
+        logger.warning(f"Batch search failed for document {document.uid}, searching one by one: {e}")
+    contexts = []
+    for question in questions:
+        try:
+            contexts.append(get_context(question, document, options))
+        except Exception as e:
+            contexts.append(e)
+    return contexts
+
+
+def answer_questions(
+    questions: List[str],
+    document: document_models.Document,
+    options: Optional[RetrievalOptions] = None,
+) -> List[Answer]:
+    """
+    Answer many questions about one document, in the order of the questions.
+    Cached answers are reused. The other questions are embedded in one request,
+    their chunks searched in one pass, and the LLM called through the chain
+    batch API with at most BATCH_ASK_MAX_CONCURRENCY calls at once. A failed
+    question gets an Answer with `error` set, the others are not affected.
+    """
+    options = options or RetrievalOptions()
+    variant = options.cache_key()
+    answers: List[Optional[Answer]] = [None] * len(questions)
+    pending = []
+    for position, question in enumerate(questions):
+        cached = answer_cache.get(document, question, variant)
+        if cached is not None:
+            answers[position] = Answer(cached, cached=True)
+        else:
+            pending.append(position)
+    if not pending:
+        return answers
+
+    vectors = vector_registry.get_embeddings().embed_documents([questions[position] for position in pending])
+    vector_by_position = dict(zip(pending, vectors))
+    if settings.SEMANTIC_CACHE_ENABLED and options == RetrievalOptions():
+        remaining = []
+        for position in pending:
+            cached = semantic_cache.lookup(document, vector_by_position[position])
+            if cached is not None:
+                answers[position] = Answer(cached, cached=True, semantic=True)
+            else:
+                remaining.append(position)
+        pending = remaining
+    if not pending:
+        return answers
+
+    contexts = get_contexts(
+        [questions[position] for position in pending],
+        [vector_by_position[position] for position in pending],
+        document,
+        options,
+    )
+    inputs = []
+    asked = []
+    for position, context in zip(pending, contexts):
+        if isinstance(context, Exception):
+            logger.error(f"Retrieval failed for a question about document {document.uid}: {context}")
+            answers[position] = Answer("", error="Retrieval failed.")
+            continue
+        _, text = pack_context(questions[position], context)
+        inputs.append({"question": questions[position], "context": text})
+        asked.append(position)
+
+    responses = chain.batch(
+        inputs,
+        config={"max_concurrency": settings.BATCH_ASK_MAX_CONCURRENCY},
+        return_exceptions=True,
+    ) if inputs else []
+    for position, response in zip(asked, responses):
+        if isinstance(response, Exception):
+            logger.error(f"Answer generation failed for a question about document {document.uid}: {response}")
+            answers[position] = Answer("", error="Answer generation failed.")
+            continue
+        if not response:
+            answers[position] = Answer("No answer found.")
+            continue
+        answer_cache.set(document, questions[position], response.content, variant)
+        if settings.SEMANTIC_CACHE_ENABLED and options == RetrievalOptions():
+            semantic_cache.add(document, vector_by_position[position], response.content)
+        answers[position] = Answer(response.content)
+    return answers
+
+
+async def aget_context(
+    question: str,
+    document: document_models.Document,
+    options: Optional[RetrievalOptions] = None,
+) -> List[Document]:
+    """Async version of `get_context`."""
+    retriever = DocumentVectorStore().get_retriever(document, options)
+    return await retriever.ainvoke(question)
+
+
+async def aanswer_question(
+    question: str,
+    document: document_models.Document,
+    options: Optional[RetrievalOptions] = None,
+) -> Answer:
+    """
+    Async version of `answer_question`, retrieval and the LLM call do not block
+    the event loop.
+    """
+    options = options or RetrievalOptions()
+    variant = options.cache_key()
+    cached = await answer_cache.aget(document, question, variant)
+    if cached is not None:
+        return Answer(cached, cached=True)
+
+    question_vector = None
+    if settings.SEMANTIC_CACHE_ENABLED and options == RetrievalOptions():
+        question_vector = await vector_registry.get_embeddings().aembed_query(question)
+        cached = await sync_to_async(semantic_cache.lookup)(document, question_vector)
+        if cached is not None:
+            return Answer(cached, cached=True, semantic=True)
+
+    _, context = pack_context(question, await aget_context(question, document, options))
+    response = await chain.ainvoke({
+        "question": question,
+        "context": context,
     })
-    return response.content if response else "No answer found."
\ No newline at end of file
+    if not response:
+        return Answer("No answer found.")
+    await answer_cache.aset(document, question, response.content, variant)
+    if question_vector is not None:
+        await sync_to_async(semantic_cache.add)(document, question_vector, response.content)
+    return Answer(response.content)
+
+
+def stream_answer(
+    question: str,
+    document: document_models.Document,
+    options: Optional[RetrievalOptions] = None,
+) -> Tuple[List[Document], Iterator[str]]:
+    """
+    Answer a question token by token.
+
+    Returns:
+        The chunks in the prompt context and an iterator over the answer tokens,
+        the LLM is called when the iteration starts.
+    """
+    packed, context = pack_context(question, get_context(question, document, options))
+    tokens = (
+        chunk.content
+        for chunk in chain.stream({"question": question, "context": context})
+        if chunk.content
+    )
+    return packed, tokens
+
+
+async def astream_answer(
+    question: str,
+    document: document_models.Document,
+    options: Optional[RetrievalOptions] = None,
+) -> Tuple[List[Document], AsyncIterator[str]]:
+    """
+    Async version of `stream_answer`, the tokens are read from the LLM without
+    blocking the event loop.
+    """
+    packed, context = pack_context(question, await aget_context(question, document, options))
+
+    async def tokens():
+        async for chunk in chain.astream({"question": question, "context": context}):
+            if chunk.content:
+                yield chunk.content
+
+    return packed, tokens()
@@ -0,0 +1,71 @@
+import hashlib
+import re
+
+from functools import lru_cache
+from typing import List, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+@lru_cache(maxsize=1 << 18)
+def hash_feature(feature: str, dimensions: int) -> Tuple[int, float]:
+    """Return the (column, sign) of a feature, stable across processes unlike `hash`."""
+    digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+    return digest % dimensions, 1.0 if digest >> 63 else -1.0
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    CPU only embeddings computed locally, without model files nor network.
+    Words, word bigrams and character trigrams of the text are hashed into
+    `dimensions` signed buckets (feature hashing), weighted by sublinear term
+    frequency and L2 normalized. Vectors are deterministic, similar texts
+    share features, so they are usable for tests, air-gapped environments or
+    as a fast lexical-leaning fallback. A batch of texts is embedded as one
+    NumPy matrix.
+    """
+
+    def __init__(self, dimensions: int = 768, char_ngrams: int = 3):
+        self.dimensions = dimensions
+        self.char_ngrams = char_ngrams
+
+    @property
+    def model(self) -> str:
+        return f"hashing-{self.dimensions}-{self.char_ngrams}"
+
+    def features(self, text: str) -> List[str]:
+        words = WORD_PATTERN.findall(text.lower())
+        features = [f"w:{word}" for word in words]
+        features.extend(f"b:{first} {second}" for first, second in zip(words, words[1:]))
+        n = self.char_ngrams
+        for word in words:
+            padded = f"<{word}>"
+            features.extend(f"c:{padded[i:i + n]}" for i in range(len(padded) - n + 1))
+        return features
+
+    def embed_matrix(self, texts: List[str]) -> np.ndarray:
+        """Return the float32 (len(texts), dimensions) matrix of the text vectors."""
+        rows, columns, values = [], [], []
+        for row, text in enumerate(texts):
+            for feature in self.features(text):
+                column, sign = hash_feature(feature, self.dimensions)
+                rows.append(row)
+                columns.append(column)
+                values.append(sign)
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        np.add.at(matrix, (np.asarray(rows, dtype=np.intp), np.asarray(columns, dtype=np.intp)), values)
+        # sublinear term frequency keeps repeated words from dominating
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return matrix / norms
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_matrix(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_matrix([text])[0].tolist()
@@ -1,11 +1,16 @@
+import hashlib
 import os
 import requests
 
+from requests.adapters import HTTPAdapter
 from langchain_community import document_loaders
 from documents import models as document_models
+from documents.services import pdf_pages
 
 import settings
 
+from core.custom_logger import logger
+
 
 TEMP_FILE_DIR = os.path.join(
     os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "temp_files"
@@ -14,6 +19,13 @@ if not os.path.exists(TEMP_FILE_DIR):
     os.makedirs(TEMP_FILE_DIR)
     print(f"Created temporary file directory: {TEMP_FILE_DIR}")
 
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB
+
+# shared by the threads of the process, keeps connections to the storage alive
+http_session = requests.Session()
+http_session.mount("http://", HTTPAdapter(pool_maxsize=settings.DOCUMENT_DOWNLOAD_POOL_SIZE))
+http_session.mount("https://", HTTPAdapter(pool_maxsize=settings.DOCUMENT_DOWNLOAD_POOL_SIZE))
+
 
 class DocumentParser:
     PARSERS_TYPE_MAP = {
@@ -29,6 +41,8 @@ class DocumentParser:
         self.document = document
         self.file_path = None
         self.file_extension = None
+        # False when parsing the stored file in place, it must not be deleted
+        self.is_temporary_file = True
 
     @classmethod
     def get_parser(cls, file_extension: str):
@@ -43,28 +57,121 @@ class DocumentParser:
             return f"{settings.BACKEND_URL}{file_field.url}"
         return file_field.url
 
+    def use_parallel_pdf(self) -> bool:
+        """Check if the PDF is big enough to be parsed by a process pool."""
+        if self.file_extension.lower() != "pdf" or settings.DOCUMENT_PDF_WORKERS < 2:
+            return False
+        return pdf_pages.get_page_count(self.file_path) >= settings.DOCUMENT_PDF_PARALLEL_MIN_PAGES
+
     def parse_document(self) -> list:
         """Parse the document using the appropriate parser."""
+        if self.use_parallel_pdf():
+            yield from pdf_pages.extract_pages_parallel(
+                self.file_path,
+                workers=settings.DOCUMENT_PDF_WORKERS,
+                pages_per_task=settings.DOCUMENT_PDF_PAGES_PER_TASK,
+            )
+            return
+
         parser_class = self.get_parser(self.file_extension)
         loader = parser_class(self.file_path)
         
         for item in loader.lazy_load():
             yield item.page_content, item.metadata
    
-    def download_and_parse_document(self, document: document_models.Document) -> list:
-        """Download the document file and parse it."""
-        self.file_extension = document.document_file.name.split('.')[-1]
-        self.file_path = os.path.join(TEMP_FILE_DIR, f"{document.uid}.{self.file_extension}")
+    def _write_chunks(self, chunks) -> int:
+        """
+        Write the chunks to `self.file_path`, return the written size.
+        Writing is aborted as soon as the file gets bigger than MAX_UPLOAD_SIZE.
+        """
+        size = 0
         with open(self.file_path, 'wb') as file:
-            file.write(requests.get(self.get_file_url(document.document_file)).content)
-            print(f"Downloaded document to {self.file_path}")
+            for chunk in chunks:
+                size += len(chunk)
+                if size > settings.MAX_UPLOAD_SIZE:
+                    raise ValueError(f"Document file is larger than {settings.MAX_UPLOAD_SIZE} bytes")
+                file.write(chunk)
+        return size
+
+    def download_file(self, url: str) -> None:
+        """Stream the file at url to `self.file_path` in chunks."""
+        with http_session.get(
+            url,
+            stream=True,
+            timeout=(settings.DOCUMENT_DOWNLOAD_CONNECT_TIMEOUT, settings.DOCUMENT_DOWNLOAD_READ_TIMEOUT),
+        ) as response:
+            response.raise_for_status()
+            content_length = int(response.headers.get("Content-Length") or 0)
+            if content_length > settings.MAX_UPLOAD_SIZE:
+                raise ValueError(f"Document file is too large: {content_length} bytes")
+            size = self._write_chunks(response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE))
+        logger.info(f"Downloaded document to {self.file_path} ({size} bytes)")
+
+    def copy_from_storage(self, file_field) -> None:
+        """
+        Stream the file from the storage backend to `self.file_path` in chunks.
+        Google Cloud files are read through a streaming blob reader instead of
+        being downloaded at once by the storage file object.
+        """
+        with file_field.storage.open(file_field.name, "rb") as storage_file:
+            blob = getattr(storage_file, "blob", None)
+            if blob is not None:
+                reader = blob.open("rb", chunk_size=DOWNLOAD_CHUNK_SIZE)
+            else:
+                reader = storage_file
+            with reader:
+                size = self._write_chunks(iter(lambda: reader.read(DOWNLOAD_CHUNK_SIZE), b""))
+        logger.info(f"Copied document from storage to {self.file_path} ({size} bytes)")
+
+    def fetch_file(self, document: document_models.Document) -> None:
+        """
+        Make the document file available at `self.file_path`.
+        Files on the local filesystem storage are parsed in place, other
+        storages are streamed to a temporary file, HTTP is the fallback.
+        """
+        file_field = document.document_file
+        try:
+            local_path = file_field.storage.path(file_field.name)
+        except NotImplementedError:
+            local_path = None
+        if local_path and os.path.exists(local_path):
+            self.file_path = local_path
+            self.is_temporary_file = False
+            return
+
+        self.file_path = os.path.join(TEMP_FILE_DIR, f"{document.uid}.{self.file_extension}")
+        try:
+            self.copy_from_storage(file_field)
+        except ValueError:
+            raise
+        except Exception:
+            logger.exception(f"Error reading document {document.uid} from storage, downloading it")
+            # a failed download is raised with the storage error as its context
+            self.download_file(self.get_file_url(file_field))
+
+    def fetch_document(self, document: document_models.Document) -> None:
+        """Fetch the document file, it can be parsed from `self.file_path` then."""
+        self.file_extension = document.document_file.name.split('.')[-1]
+        self.fetch_file(document)
         if not os.path.exists(self.file_path):
             raise FileNotFoundError(f"Temporary file {self.file_path} not found.")
+
+    def get_file_hash(self) -> str:
+        """Return the sha256 hex digest of the fetched file."""
+        file_hash = hashlib.sha256()
+        with open(self.file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(DOWNLOAD_CHUNK_SIZE), b""):
+                file_hash.update(chunk)
+        return file_hash.hexdigest()
+
+    def download_and_parse_document(self, document: document_models.Document) -> list:
+        """Fetch the document file and parse it."""
+        self.fetch_document(document)
         return self.parse_document()
         
     def __del__(self):
         """Clean up resources when the instance is deleted."""
-        if not self.file_path:
+        if not self.file_path or not self.is_temporary_file:
             return
         if os.path.exists(self.file_path):
             os.remove(self.file_path)
@@ -0,0 +1,60 @@
+"""
+PDF pages text extraction running in worker processes.
+Kept free of Django imports, so spawned workers can import it without settings.
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Any, Dict, Iterator, List, Tuple
+
+import pymupdf
+
+
+def get_page_count(file_path: str) -> int:
+    with pymupdf.open(file_path) as pdf:
+        return pdf.page_count
+
+
+def extract_pages(file_path: str, start: int, stop: int) -> List[Tuple[str, Dict[str, Any]]]:
+    """Return (text, metadata) of the pages [start, stop), metadata match PyMuPDFLoader."""
+    pages = []
+    with pymupdf.open(file_path) as pdf:
+        pdf_metadata = {
+            key: value
+            for key, value in (pdf.metadata or {}).items()
+            if isinstance(value, (str, int))
+        }
+        for page_number in range(start, min(stop, pdf.page_count)):
+            pages.append((pdf[page_number].get_text(), {
+                "source": file_path,
+                "file_path": file_path,
+                "page": page_number,
+                "total_pages": pdf.page_count,
+                **pdf_metadata,
+            }))
+    return pages
+
+
+def extract_pages_parallel(
+    file_path: str,
+    workers: int,
+    pages_per_task: int,
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Yield (text, metadata) of every page, in order, extracted by a process pool.
+    Each task opens the file itself and extracts a range of pages, at most
+    `2 * workers` ranges are pending so memory stays bounded.
+    """
+    page_count = get_page_count(file_path)
+    ranges = (
+        (start, start + pages_per_task)
+        for start in range(0, page_count, pages_per_task)
+    )
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as executor:
+        pending = deque()
+        for start, stop in ranges:
+            pending.append(executor.submit(extract_pages, file_path, start, stop))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
@@ -0,0 +1,366 @@
+import json
+import threading
+
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.db import connection, transaction
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+import settings
+
+from documents import models as document_models
+
+
+def to_vector_literal(vector: List[float]) -> str:
+    return "[" + ",".join(repr(float(value)) for value in vector) + "]"
+
+
+class PgVectorStore(VectorStore):
+    """
+    Chunks vector store in the application Postgres database (pgvector).
+    Chunks of all contents live in one table with an HNSW or IVFFlat cosine
+    index. The extension is created by a migration, the table and its indexes
+    by the setup_pgvector command at deploy time, never while serving requests.
+    Every web and worker node reads the same index.
+
+    Searches filtered by `content_hash` rank the chunks of that content exactly
+    through its btree index: the approximate index scan only returns about
+    `ef_search` (or the probed lists) candidates before the filter is applied,
+    so a search scoped to one document among many would miss most of its
+    chunks. Unfiltered searches use the approximate index.
+
+    Filters are dicts of equalities on `content_hash`, plus `document_uid` and
+    `user_id` which are resolved by a semi-join on the documents table, so a
+    search is scoped to a document of a user in SQL. The `get` and `delete`
+    methods take the same arguments as the Chroma ones.
+
+    Queries use the database connection of the calling thread. Async searches
+    run on the thread Django runs the sync code of the request on, instead of
+    the default executor of LangChain whose connections are never closed;
+    worker threads close theirs with `close_db_connections`.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        table_name: str,
+        index_type: str = settings.PGVECTOR_INDEX_TYPE,
+        ef_search: int = settings.PGVECTOR_EF_SEARCH,
+    ):
+        if index_type not in ("hnsw", "ivfflat"):
+            raise ValueError(f"Unknown pgvector index type: {index_type}")
+        self._embeddings = embeddings
+        self.table_name = table_name
+        self.index_type = index_type
+        self.ef_search = ef_search
+        self._table_ready = False
+        self._lock = threading.Lock()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embeddings
+
+    def table_exists(self) -> bool:
+        if not self._table_ready:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [self.table_name])
+                self._table_ready = cursor.fetchone()[0]
+        return self._table_ready
+
+    @property
+    def embedding_index_name(self) -> str:
+        return f"{self.table_name}_embedding"
+
+    def create_table(self, dimensions: int) -> None:
+        """Create the chunks table, see the setup_pgvector command."""
+        table = connection.ops.quote_name(self.table_name)
+        with self._lock, connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "id varchar(255) PRIMARY KEY, "
+                "content_hash varchar(64) NOT NULL, "
+                "text text NOT NULL, "
+                "metadata jsonb NOT NULL, "
+                f"embedding vector({int(dimensions)}) NOT NULL)"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.table_name}_content_hash ON {table} (content_hash)"
+            )
+        self._table_ready = True
+
+    def count(self) -> int:
+        table = connection.ops.quote_name(self.table_name)
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM {table}")
+            return cursor.fetchone()[0]
+
+    def index_exists(self) -> bool:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [self.embedding_index_name])
+            return cursor.fetchone()[0]
+
+    def create_index(self, rebuild: bool = False) -> None:
+        """
+        Create the approximate index of the embeddings. IVFFlat clusters the rows
+        present when it is built, it must be built once the chunks are loaded and
+        rebuilt when the table has grown a lot. HNSW needs no training data.
+        """
+        table = connection.ops.quote_name(self.table_name)
+        index = connection.ops.quote_name(self.embedding_index_name)
+        if self.index_type == "hnsw":
+            method = "USING hnsw (embedding vector_cosine_ops)"
+        else:
+            method = f"USING ivfflat (embedding vector_cosine_ops) WITH (lists = {int(settings.PGVECTOR_IVFFLAT_LISTS)})"
+        with connection.cursor() as cursor:
+            if rebuild:
+                cursor.execute(f"DROP INDEX IF EXISTS {index}")
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {index} ON {table} {method}")
+
+    def drop_table(self) -> None:
+        table = connection.ops.quote_name(self.table_name)
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        self._table_ready = False
+
+    def where_clause(self, filter: Optional[Dict[str, Any]]) -> Tuple[str, List[Any]]:
+        """Return the SQL condition and parameters of an equalities filter."""
+        conditions = []
+        params = []
+        document_conditions = []
+        document_params = []
+        for key, value in (filter or {}).items():
+            if key == "content_hash":
+                conditions.append("v.content_hash = %s")
+                params.append(value)
+            elif key == "document_uid":
+                document_conditions.append("d.uid = %s")
+                document_params.append(str(value))
+            elif key == "user_id":
+                document_conditions.append("d.user_id = %s")
+                document_params.append(value)
+            else:
+                conditions.append("v.metadata ->> %s = %s")
+                params.extend([key, str(value)])
+        if document_conditions:
+            documents_table = connection.ops.quote_name(document_models.Document._meta.db_table)
+            conditions.append(
+                f"EXISTS (SELECT 1 FROM {documents_table} d "
+                f"WHERE d.content_hash = v.content_hash AND {' AND '.join(document_conditions)})"
+            )
+            params.extend(document_params)
+        if not conditions:
+            return "", []
+        return "WHERE " + " AND ".join(conditions), params
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        vectors = self._embeddings.embed_documents(texts)
+        return self.add_embeddings(texts, vectors, metadatas, ids)
+
+    def add_embeddings(
+        self,
+        texts: List[str],
+        vectors: List[List[float]],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+    ) -> List[str]:
+        """Upsert already embedded chunks."""
+        metadatas = metadatas or [{} for _ in texts]
+        if ids is None:
+            raise ValueError("Chunk ids are required.")
+        if not self.table_exists():
+            raise ValueError(
+                f"pgvector table {self.table_name} does not exist, create it with the setup_pgvector command."
+            )
+
+        table = connection.ops.quote_name(self.table_name)
+        rows = [
+            (_id, (metadata or {}).get("content_hash", ""), text, json.dumps(metadata or {}), to_vector_literal(vector))
+            for _id, text, metadata, vector in zip(ids, texts, metadatas, vectors)
+        ]
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {table} (id, content_hash, text, metadata, embedding) "
+                "VALUES (%s, %s, %s, %s::jsonb, %s::vector) "
+                "ON CONFLICT (id) DO UPDATE SET content_hash = EXCLUDED.content_hash, "
+                "text = EXCLUDED.text, metadata = EXCLUDED.metadata, embedding = EXCLUDED.embedding",
+                rows,
+            )
+        return list(ids)
+
+    def search_by_vector(
+        self,
+        embedding: List[float],
+        k: int,
+        filter: Optional[Dict[str, Any]] = None,
+        with_embeddings: bool = False,
+    ) -> List[Tuple[Document, float, Optional[List[float]]]]:
+        """Return the (chunk, cosine distance, embedding) of the `k` nearest chunks."""
+        if not self.table_exists():
+            return []
+        table = connection.ops.quote_name(self.table_name)
+        where, params = self.where_clause(filter)
+        columns = "v.id, v.text, v.metadata, v.embedding <=> %s::vector AS distance"
+        if with_embeddings:
+            columns += ", v.embedding::text"
+        query_params = [to_vector_literal(embedding), *params, k]
+        with transaction.atomic(), connection.cursor() as cursor:
+            if filter and "content_hash" in filter:
+                # the materialized rows of the content are ranked exactly, the
+                # approximate index can not be used to order them
+                cursor.execute(
+                    f"WITH v AS MATERIALIZED (SELECT * FROM {table} WHERE content_hash = %s) "
+                    f"SELECT {columns} FROM v {where} ORDER BY distance LIMIT %s",
+                    [filter["content_hash"], *query_params],
+                )
+            else:
+                if self.index_type == "hnsw":
+                    cursor.execute("SELECT set_config('hnsw.ef_search', %s, true)", [str(self.ef_search)])
+                cursor.execute(
+                    f"SELECT {columns} FROM {table} v {where} ORDER BY distance LIMIT %s",
+                    query_params,
+                )
+            rows = cursor.fetchall()
+        results = []
+        for row in rows:
+            metadata = row[2] if isinstance(row[2], dict) else json.loads(row[2])
+            vector = json.loads(row[4]) if with_embeddings else None
+            results.append((Document(page_content=row[1], metadata=metadata, id=row[0]), row[3], vector))
+        return results
+
+    def similarity_search_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        return [document for document, _, _ in self.search_by_vector(embedding, k, filter)]
+
+    def similarity_search_with_score(
+        self,
+        query: str,
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> List[Tuple[Document, float]]:
+        embedding = self._embeddings.embed_query(query)
+        return [
+            (document, distance)
+            for document, distance, _ in self.search_by_vector(embedding, k, filter)
+        ]
+
+    def similarity_search(
+        self,
+        query: str,
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        return [document for document, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        return self._cosine_relevance_score_fn
+
+    def max_marginal_relevance_search(
+        self,
+        query: str,
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        filter: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        embedding = self._embeddings.embed_query(query)
+        candidates = self.search_by_vector(embedding, fetch_k, filter, with_embeddings=True)
+        if not candidates:
+            return []
+        selected = maximal_marginal_relevance(
+            np.array(embedding, dtype=np.float32),
+            [vector for _, _, vector in candidates],
+            k=k,
+            lambda_mult=lambda_mult,
+        )
+        return [candidates[i][0] for i in selected]
+
+    async def asimilarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return await sync_to_async(self.similarity_search)(query, k, **kwargs)
+
+    async def asimilarity_search_with_relevance_scores(
+        self,
+        query: str,
+        k: int = 4,
+        **kwargs: Any,
+    ) -> List[Tuple[Document, float]]:
+        return await sync_to_async(self.similarity_search_with_relevance_scores)(query, k, **kwargs)
+
+    async def amax_marginal_relevance_search(
+        self,
+        query: str,
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        **kwargs: Any,
+    ) -> List[Document]:
+        return await sync_to_async(self.max_marginal_relevance_search)(query, k, fetch_k, lambda_mult, **kwargs)
+
+    def get(
+        self,
+        ids: Optional[List[str]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        include: Optional[List[str]] = None,
+    ) -> Dict[str, List[Any]]:
+        """Return the chunks by ids and/or filter, in the Chroma `get` format."""
+        include = include or ["documents", "metadatas"]
+        result = {"ids": [], "documents": [], "metadatas": [], "embeddings": []}
+        if not self.table_exists():
+            return {key: value for key, value in result.items() if key == "ids" or key in include}
+        table = connection.ops.quote_name(self.table_name)
+        where_sql, params = self.where_clause(where)
+        if ids is not None:
+            where_sql = f"{where_sql} AND v.id = ANY(%s)" if where_sql else "WHERE v.id = ANY(%s)"
+            params.append(list(ids))
+        embedding_column = "v.embedding::text" if "embeddings" in include else "NULL"
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT v.id, v.text, v.metadata, {embedding_column} FROM {table} v {where_sql}", params)
+            for _id, text, metadata, embedding in cursor.fetchall():
+                result["ids"].append(_id)
+                result["documents"].append(text)
+                result["metadatas"].append(metadata if isinstance(metadata, dict) else json.loads(metadata))
+                result["embeddings"].append(json.loads(embedding) if embedding is not None else None)
+        return {key: value for key, value in result.items() if key == "ids" or key in include}
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if not ids or not self.table_exists():
+            return True
+        table = connection.ops.quote_name(self.table_name)
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {table} WHERE id = ANY(%s)", [list(ids)])
+        return True
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        table_name: str = "chunk_vectors",
+        **kwargs: Any,
+    ) -> "PgVectorStore":
+        store = cls(embedding, table_name=table_name, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
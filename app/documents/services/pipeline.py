@@ -0,0 +1,77 @@
+import functools
+import queue
+import threading
+
+from typing import Callable, Iterable, Iterator, TypeVar
+
+from django.db import close_old_connections
+
+
+T = TypeVar("T")
+
+_DONE = object()
+
+
+class _Error:
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+
+def close_db_connections(func: Callable[..., T]) -> Callable[..., T]:
+    """
+    Wrap work run on a worker thread, which opens its own database connection
+    (pgvector store, lexical index). Unusable or expired connections of the
+    thread are closed before and after the work, like Django does around requests.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return wrapper
+
+
+def prefetch(iterable: Iterable[T], maxsize: int) -> Iterator[T]:
+    """
+    Consume the iterable in a background thread through a bounded queue.
+    The producer runs ahead of the consumer by at most `maxsize` items, errors
+    of the producer are raised in the consumer thread.
+    """
+    items = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except BaseException as e:
+            put(_Error(e))
+            return
+        put(_DONE)
+
+    thread = threading.Thread(target=close_db_connections(produce), daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Error):
+                raise item.exc
+            yield item
+    finally:
+        # the consumer stopped early or failed, let the producer exit
+        stop.set()
+        thread.join()
@@ -0,0 +1,106 @@
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+PROJECTION_MODES = ("none", "pca", "truncate")
+
+# models trained to keep their quality when their vectors are truncated
+TRUNCATABLE_MODEL_PREFIXES = ("text-embedding-3",)
+
+
+def check_truncatable(model: Optional[str]) -> None:
+    """Raise a ValueError if the embedding model vectors can not be truncated."""
+    if not model or not model.startswith(TRUNCATABLE_MODEL_PREFIXES):
+        raise ValueError(
+            f"Embedding model {model or 'of the backend'} is not trained for truncated vectors, "
+            f"use the pca projection instead."
+        )
+
+
+class Projection:
+    """
+    Linear reduction of embeddings to `dimensions`, either the first principal
+    components fitted on a sample of the collection (`components` and `mean`)
+    or a truncation to the first dimensions, for models trained for it such as
+    OpenAI text-embedding-3. Projected vectors are L2 normalized again.
+    """
+
+    def __init__(
+        self,
+        dimensions: int,
+        components: Optional[np.ndarray] = None,
+        mean: Optional[np.ndarray] = None,
+    ):
+        self.dimensions = dimensions
+        self.components = components
+        self.mean = mean
+
+    @classmethod
+    def fit_pca(cls, matrix: np.ndarray, dimensions: int) -> "Projection":
+        """Fit the principal components of the rows of the matrix."""
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if dimensions > min(matrix.shape):
+            raise ValueError(f"Can not fit {dimensions} components on a {matrix.shape} sample.")
+        mean = matrix.mean(axis=0)
+        _, _, vt = np.linalg.svd(matrix - mean, full_matrices=False)
+        return cls(dimensions, components=vt[:dimensions].T.astype(np.float32), mean=mean)
+
+    @property
+    def mode(self) -> str:
+        return "truncate" if self.components is None else "pca"
+
+    def transform(self, matrix: np.ndarray) -> np.ndarray:
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if self.components is None:
+            reduced = matrix[:, :self.dimensions]
+        else:
+            reduced = (matrix - self.mean) @ self.components
+        norms = np.linalg.norm(reduced, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return reduced / norms
+
+    def save(self, path: str) -> None:
+        arrays = {"dimensions": np.array(self.dimensions)}
+        if self.components is not None:
+            arrays.update(components=self.components, mean=self.mean)
+        with open(path, "wb") as projection_file:
+            np.savez(projection_file, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "Projection":
+        with np.load(path) as arrays:
+            return cls(
+                int(arrays["dimensions"]),
+                components=arrays["components"] if "components" in arrays else None,
+                mean=arrays["mean"] if "mean" in arrays else None,
+            )
+
+
+class ProjectedEmbeddings(Embeddings):
+    """Embeddings reduced by a projection, documents when stored and queries when searched."""
+
+    def __init__(self, embeddings: Embeddings, projection: Projection):
+        self.embeddings = embeddings
+        self.projection = projection
+
+    @property
+    def stats(self) -> dict:
+        return getattr(self.embeddings, "stats", {})
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self.projection.transform(self.embeddings.embed_documents(texts)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.projection.transform([self.embeddings.embed_query(text)])[0].tolist()
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self.projection.transform(await self.embeddings.aembed_documents(texts)).tolist()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return self.projection.transform([await self.embeddings.aembed_query(text)])[0].tolist()
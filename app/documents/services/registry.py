@@ -0,0 +1,158 @@
+import os
+import threading
+
+from langchain_community.vectorstores import Chroma
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from langchain_openai import OpenAIEmbeddings
+
+import settings
+
+from documents.services.embedding_cache import CachedEmbeddings
+from documents.services.flat_store import FlatVectorStore
+from documents.services.local_embeddings import HashingEmbeddings
+from documents.services.pgvector_store import PgVectorStore
+from documents.services.projection import PROJECTION_MODES, ProjectedEmbeddings, Projection, check_truncatable
+
+
+CHROMA_PERSIST_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "chroma_db"
+)
+CHROMA_COLLECTION_NAME = "restaurant_reviews"
+
+
+def create_openai_embeddings() -> Embeddings:
+    return OpenAIEmbeddings(
+        api_key=settings.OPENAI_API_KEY,
+    )
+
+
+def create_hashing_embeddings() -> Embeddings:
+    return HashingEmbeddings(dimensions=settings.EMBEDDING_HASHING_DIMENSIONS)
+
+
+# embedding providers selected by EMBEDDING_BACKEND
+EMBEDDING_BACKENDS = {
+    "openai": create_openai_embeddings,
+    "hashing": create_hashing_embeddings,
+}
+
+
+def get_base_collection_name() -> str:
+    """Return the collection of the embedding backend vectors before projection."""
+    if settings.EMBEDDING_BACKEND == "openai":
+        return CHROMA_COLLECTION_NAME
+    return f"{CHROMA_COLLECTION_NAME}_{settings.EMBEDDING_BACKEND}"
+
+
+def get_collection_name() -> str:
+    """
+    Return the Chroma collection of the embedding backend and projection,
+    vectors of other dimensions can not share a collection.
+    """
+    if settings.EMBEDDING_PROJECTION == "none":
+        return get_base_collection_name()
+    if settings.EMBEDDING_PROJECTION == "pca":
+        return f"{get_base_collection_name()}_{get_pca_name()}"
+    return f"{get_base_collection_name()}_{settings.EMBEDDING_PROJECTION}{settings.EMBEDDING_PROJECTION_DIMENSIONS}"
+
+
+def get_pca_name(version: str = None) -> str:
+    """Return the name of a fitted PCA, each fit has its own version and collection."""
+    return f"pca{settings.EMBEDDING_PROJECTION_DIMENSIONS}v{version or settings.EMBEDDING_PROJECTION_VERSION}"
+
+
+def get_projection_path(version: str = None) -> str:
+    """Return the file of the PCA projection fitted on the collection, see fit_projection."""
+    return os.path.join(
+        settings.EMBEDDING_PROJECTION_DIR,
+        f"{get_base_collection_name()}_{get_pca_name(version)}.npz",
+    )
+
+
+def create_base_embeddings() -> Embeddings:
+    """Return new embeddings of the backend, cached by text content if enabled."""
+    if settings.EMBEDDING_BACKEND not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {settings.EMBEDDING_BACKEND}")
+    embeddings = EMBEDDING_BACKENDS[settings.EMBEDDING_BACKEND]()
+    # local embeddings are cheaper to compute than to look up
+    if not settings.EMBEDDING_CACHE_ENABLED or isinstance(embeddings, HashingEmbeddings):
+        return embeddings
+    return CachedEmbeddings(embeddings, model_name=embeddings.model)
+
+
+def create_embeddings() -> Embeddings:
+    """Return new embeddings used for documents, reduced by the projection if enabled."""
+    embeddings = create_base_embeddings()
+    if settings.EMBEDDING_PROJECTION not in PROJECTION_MODES:
+        raise ValueError(f"Unknown embedding projection: {settings.EMBEDDING_PROJECTION}")
+    if settings.EMBEDDING_PROJECTION == "truncate":
+        check_truncatable(getattr(embeddings, "model_name", None) or getattr(embeddings, "model", None))
+        return ProjectedEmbeddings(embeddings, Projection(settings.EMBEDDING_PROJECTION_DIMENSIONS))
+    if settings.EMBEDDING_PROJECTION == "pca":
+        path = get_projection_path()
+        if not os.path.exists(path):
+            raise ValueError(f"PCA projection {path} not found, fit it with the fit_projection command.")
+        return ProjectedEmbeddings(embeddings, Projection.load(path))
+    return embeddings
+
+
+def create_vector_store(embeddings: Embeddings) -> VectorStore:
+    """Return a new client of the persistent documents vector store."""
+    if settings.VECTOR_STORE_BACKEND == "pgvector":
+        return PgVectorStore(embeddings, table_name=f"chunk_vectors_{get_collection_name()}")
+    if settings.VECTOR_STORE_BACKEND == "flat":
+        return FlatVectorStore(embeddings, directory=os.path.join(settings.FLAT_INDEX_DIR, get_collection_name()))
+    return Chroma(
+        collection_name=get_collection_name(),
+        persist_directory=CHROMA_PERSIST_DIR,
+        embedding_function=embeddings,
+    )
+
+
+class VectorStoreRegistry:
+    """
+    Process wide holder of the embeddings and vector store clients.
+    Clients are created lazily on first use and shared by all threads of the
+    process (gunicorn worker or celery worker). A forked child process gets
+    its own clients instead of reusing the parent connections.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._embeddings = None
+        self._vector_store = None
+
+    def _ensure_process(self) -> None:
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._embeddings = None
+            self._vector_store = None
+
+    def get_embeddings(self) -> Embeddings:
+        with self._lock:
+            self._ensure_process()
+            if self._embeddings is None:
+                self._embeddings = create_embeddings()
+            return self._embeddings
+
+    def get_vector_store(self) -> VectorStore:
+        embeddings = self.get_embeddings()
+        with self._lock:
+            self._ensure_process()
+            if self._vector_store is None:
+                self._vector_store = create_vector_store(embeddings)
+            return self._vector_store
+
+    def close(self) -> None:
+        """Drop the clients, they are created again on next use."""
+        with self._lock:
+            client = getattr(self._vector_store, "_client", None)
+            if client is not None and hasattr(client, "clear_system_cache"):
+                client.clear_system_cache()
+            self._embeddings = None
+            self._vector_store = None
+
+
+vector_registry = VectorStoreRegistry()
@@ -0,0 +1,122 @@
+from typing import List, Optional
+
+import numpy as np
+import redis
+from django.core.cache import cache
+
+import settings
+
+from documents import models as document_models
+from documents.services.answer_cache import KEY_PREFIX, get_content_version
+
+from core.custom_logger import logger
+
+
+SEMANTIC_KEY_PREFIX = f"{KEY_PREFIX}:semantic"
+STATS_KEY = f"{SEMANTIC_KEY_PREFIX}:stats"
+
+
+class SemanticAnswerCache:
+    """
+    Cache of answers looked up by question embedding similarity.
+    Each document content has its own small index, a float32 matrix of the
+    normalized question embeddings with the answers, bounded to `max_entries`
+    by evicting the least recently used entry. It is invalidated together
+    with the exact match cache when the content is indexed again. Redis errors
+    are logged and treated as misses.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        prompt_version: str,
+        threshold: float = settings.SEMANTIC_CACHE_THRESHOLD,
+        max_entries: int = settings.SEMANTIC_CACHE_MAX_ENTRIES,
+    ):
+        self.model_name = model_name
+        self.prompt_version = prompt_version
+        self.threshold = threshold
+        self.max_entries = max_entries
+
+    def make_key(self, document: document_models.Document) -> str:
+        version = get_content_version(document.content_hash)
+        return (
+            f"{SEMANTIC_KEY_PREFIX}:{document.uid}:{document.content_hash}:{version}:"
+            f"{self.model_name}:{self.prompt_version}"
+        )
+
+    @staticmethod
+    def normalize(vector: List[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def count(self, name: str) -> None:
+        key = f"{STATS_KEY}:{name}"
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+    def get_stats(self) -> dict:
+        try:
+            hits = cache.get(f"{STATS_KEY}:hits", 0)
+            misses = cache.get(f"{STATS_KEY}:misses", 0)
+        except redis.RedisError:
+            hits = misses = 0
+        total = hits + misses
+        return {"hits": hits, "misses": misses, "hit_rate": hits / total if total else 0}
+
+    def lookup(self, document: document_models.Document, question_vector: List[float]) -> Optional[str]:
+        """Return the answer of the most similar cached question above the threshold."""
+        if not settings.SEMANTIC_CACHE_ENABLED:
+            return None
+        try:
+            return self._lookup(document, question_vector)
+        except redis.RedisError as e:
+            logger.warning(f"Semantic answer cache read error: {e}")
+            return None
+
+    def _lookup(self, document: document_models.Document, question_vector: List[float]) -> Optional[str]:
+        key = self.make_key(document)
+        index = cache.get(key)
+        if not index or index["vectors"].shape[1] != len(question_vector):
+            self.count("misses")
+            return None
+
+        similarities = index["vectors"] @ self.normalize(question_vector)
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            self.count("misses")
+            return None
+
+        # most recently used entries are kept at the end
+        order = [i for i in range(len(index["answers"])) if i != best] + [best]
+        index = {
+            "vectors": index["vectors"][order],
+            "answers": [index["answers"][i] for i in order],
+        }
+        cache.set(key, index, timeout=settings.ANSWER_CACHE_TTL)
+        self.count("hits")
+        return index["answers"][-1]
+
+    def add(self, document: document_models.Document, question_vector: List[float], answer: str) -> None:
+        if not settings.SEMANTIC_CACHE_ENABLED:
+            return
+        try:
+            self._add(document, question_vector, answer)
+        except redis.RedisError as e:
+            logger.warning(f"Semantic answer cache write error: {e}")
+
+    def _add(self, document: document_models.Document, question_vector: List[float], answer: str) -> None:
+        key = self.make_key(document)
+        index = cache.get(key)
+        if not index or index["vectors"].shape[1] != len(question_vector):
+            index = {
+                "vectors": np.empty((0, len(question_vector)), dtype=np.float32),
+                "answers": [],
+            }
+        vectors = np.vstack([index["vectors"], self.normalize(question_vector)])
+        answers = index["answers"] + [answer]
+        cache.set(key, {
+            "vectors": vectors[-self.max_entries:],
+            "answers": answers[-self.max_entries:],
+        }, timeout=settings.ANSWER_CACHE_TTL)
@@ -1,122 +1,476 @@
-import os
-
-from typing import List, Tuple, Dict, Any
-
-from langchain_community.vectorstores import Chroma
-# TODO change to gemeni embedding or ollama (some free embedding)
-from langchain_openai import OpenAIEmbeddings
+import hashlib
+import time
 
 import settings
 
+from collections import Counter
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
 from documents import models as document_models
-from documents import enums as document_enums
 from documents.services.parsers import DocumentParser
+from documents.services.chunking import DocumentChunker
+from documents.services.embedding import BatchEmbedder
+from documents.services.embedding_cache import CachedEmbeddings
+from documents.services.lexical import (
+    BM25Index,
+    HybridRetriever,
+    reciprocal_rank_fusion,
+    save_lexical_index,
+)
+from documents.services.pipeline import prefetch
+from documents.services.projection import ProjectedEmbeddings
+from documents.services.registry import vector_registry
+from documents.services.answer_cache import bump_content_version
+
+from core.custom_logger import logger
 
 from langchain_core.documents import Document
 
 
-CHROMA_PERSIST_DIR = os.path.join(
-    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "chroma_db"
-)
+SEARCH_TYPES = ("similarity", "mmr", "similarity_score_threshold")
+
+
+class RetrievalOptions(NamedTuple):
+    """
+    Options of the chunks search:
+    - similarity: the `k` most similar chunks
+    - mmr: `k` chunks among the `fetch_k` most similar, re-ranked by maximal
+      marginal relevance, `lambda_mult` trades similarity (1) for diversity (0)
+    - similarity_score_threshold: at most `k` chunks with a relevance score
+      above `score_threshold`, fewer when the scores drop
+    """
+    search_type: str = settings.RETRIEVAL_SEARCH_TYPE
+    k: int = settings.RETRIEVAL_K
+    fetch_k: int = settings.RETRIEVAL_FETCH_K
+    lambda_mult: float = settings.RETRIEVAL_MMR_LAMBDA
+    score_threshold: float = settings.RETRIEVAL_SCORE_THRESHOLD
+
+    def search_kwargs(self) -> Dict[str, Any]:
+        if self.search_type == "mmr":
+            return {"k": self.k, "fetch_k": max(self.fetch_k, self.k), "lambda_mult": self.lambda_mult}
+        if self.search_type == "similarity_score_threshold":
+            return {"k": self.k, "score_threshold": self.score_threshold}
+        return {"k": self.k}
+
+    def cache_key(self) -> str:
+        """Return a key of the options changing the retrieved chunks."""
+        return ":".join(f"{name}={value}" for name, value in self.search_kwargs().items()) + f":{self.search_type}"
+
+
+class ChunkCopier():
+    """
+    Store chunks with the vectors of the identical chunks of a previous content.
+    Chunks are copied batch by batch while the document is parsed, like new
+    chunks are embedded, so they are not all held in memory.
+    """
+
+    def __init__(
+        self,
+        document_vector_store: "DocumentVectorStore",
+        source_hash: str,
+        batch_size: int = settings.EMBEDDING_BATCH_SIZE,
+    ):
+        self.document_vector_store = document_vector_store
+        self.source_hash = source_hash
+        self.batch_size = batch_size
+        self.pending: List[Tuple[Document, str]] = []
+        self.stored = 0
+
+    def add(self, chunk: Document, source_id: str) -> None:
+        self.pending.append((chunk, source_id))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+        self.stored += self.document_vector_store.copy_chunks(self.source_hash, self.pending, self.batch_size)
+        self.pending = []
 
 
 class DocumentVectorStore():
     """Concrete implementation of BaseVectorStore for document vectorization."""
     
+    @staticmethod
+    def get_search_filter(document: document_models.Document) -> Dict[str, Any]:
+        """
+        Return the metadata filter scoping a search to the chunks of one document.
+        Chunks are shared by all documents with the same content, access to them
+        is granted by the ownership of the document. Chroma resolves the filter
+        through its indexed metadata segment before the vector search, so only
+        the document chunks are scanned. With pgvector the document and its
+        owner are also checked in SQL.
+        """
+        if settings.VECTOR_STORE_BACKEND == "pgvector":
+            return {
+                "content_hash": document.content_hash,
+                "document_uid": document.uid,
+                "user_id": document.user_id,
+            }
+        return {"content_hash": document.content_hash}
+
     def get_retriever(
         self,
+        document: document_models.Document,
+        options: Optional[RetrievalOptions] = None,
     ):
-        embeddings = OpenAIEmbeddings(
-            api_key=settings.OPENAI_API_KEY,
-        )
-        vector_store = Chroma(
-            collection_name="restaurant_reviews",
-            persist_directory=CHROMA_PERSIST_DIR,
-            embedding_function=embeddings
-        )
+        options = options or RetrievalOptions()
+        vector_store = vector_registry.get_vector_store()
         retriever = vector_store.as_retriever(
-            search_kwargs={"k": 5}
+            search_type=options.search_type,
+            search_kwargs={
+                **options.search_kwargs(),
+                "filter": self.get_search_filter(document),
+            }
         )
+        # fusing the BM25 results would add back the near duplicates mmr removed
+        if settings.RETRIEVAL_MODE == "hybrid" and options.search_type != "mmr":
+            return HybridRetriever(
+                vector_retriever=retriever,
+                vector_store=vector_store,
+                content_hash=document.content_hash,
+                k=options.k,
+                rrf_k=settings.HYBRID_RRF_K,
+                dense_timeout=settings.HYBRID_DENSE_TIMEOUT,
+                adaptive=options.search_type == "similarity_score_threshold",
+            )
         return retriever
 
+    def search_by_vectors(
+        self,
+        document: document_models.Document,
+        vectors: List[List[float]],
+        k: int,
+    ) -> List[List[Document]]:
+        """
+        Return the `k` most similar chunks of the document for each query vector,
+        in one search when the store supports it (Chroma and the flat index).
+        """
+        vector_store = vector_registry.get_vector_store()
+        search_filter = self.get_search_filter(document)
+        if hasattr(vector_store, "similarity_search_by_vectors"):
+            return vector_store.similarity_search_by_vectors(vectors, k=k, filter=search_filter)
+        collection = getattr(vector_store, "_collection", None)
+        if collection is not None:
+            results = collection.query(
+                query_embeddings=vectors,
+                n_results=k,
+                where=search_filter,
+                include=["documents", "metadatas"],
+            )
+            return [
+                [
+                    Document(page_content=text, metadata=metadata or {}, id=_id)
+                    for _id, text, metadata in zip(ids, texts, metadatas)
+                ]
+                for ids, texts, metadatas in zip(results["ids"], results["documents"], results["metadatas"])
+            ]
+        return [
+            vector_store.similarity_search_by_vector(vector, k=k, filter=search_filter)
+            for vector in vectors
+        ]
+
+    def batch_search(
+        self,
+        document: document_models.Document,
+        questions: List[str],
+        vectors: List[List[float]],
+        options: Optional[RetrievalOptions] = None,
+    ) -> List[List[Document]]:
+        """
+        Return the chunks relevant to each question from their embeddings.
+        Similarity searches run in one pass, fused with the BM25 results in
+        hybrid mode. Other search types use the retriever for each question.
+        """
+        options = options or RetrievalOptions()
+        retriever = self.get_retriever(document, options)
+        if options.search_type != "similarity":
+            return [retriever.invoke(question) for question in questions]
+        dense = self.search_by_vectors(document, vectors, options.k)
+        if not isinstance(retriever, HybridRetriever):
+            return dense
+        return [
+            reciprocal_rank_fusion(
+                [chunks, retriever.get_lexical_documents(question)],
+                k=options.k,
+                rrf_k=settings.HYBRID_RRF_K,
+            )
+            for question, chunks in zip(questions, dense)
+        ]
+
     @property
     def collection_name(self) -> str:
         """Return the name of the Chroma collection for documents."""
         return "documents"
     
-    def _prepare_data_texts(
+    def make_chunk_id(
         self,
-        document: document_models.Document,
-    ) -> List[Tuple[str, Dict[str, Any]]]:
-        """Prepare data texts and metadata for document vectorization."""
-    
-        texts_and_metadata = []
-        document.status = document_enums.DocumentProcessingStatus.PROCESSING
-        document.save(
-            update_fields=["status", "updated_at"]
+        content_hash: str,
+        text_hash: str,
+        occurrence: int,
+    ) -> str:
+        """
+        Return the id of a chunk, derived from its text hash so it is stable when
+        the content is indexed again. Repeated texts are told apart by their
+        occurrence number.
+        """
+        return f"{self.collection_name}_{content_hash[:32]}_{text_hash[:32]}_{occurrence}"
+
+    @staticmethod
+    def make_chunk_hash(text: str, metadata: Dict[str, Any]) -> str:
+        """Return the hash of the chunk text and position, used to detect changed chunks."""
+        key = f"{metadata.get('page')}:{metadata.get('start_index')}:{text}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get_indexed_chunks(
+        self,
+        content_hash: str,
+    ) -> Dict[str, str]:
+        """Return the chunk hash by chunk id of the content chunks in the vector store."""
+        vector_store = vector_registry.get_vector_store()
+        indexed = vector_store.get(
+            where={"content_hash": content_hash},
+            include=["metadatas"],
         )
-        
-        if not document.document_file:
-            return texts_and_metadata
-        
-        try:
-            metadata = {
-                "uid": str(document.uid),
-                "title": document.title,
-                "description": document.description or "",
-                "user_id": str(document.user_id),
-                "created_at": document.created_at.isoformat(),
-                "updated_at": document.updated_at.isoformat(),
-            }
-            parser = DocumentParser(document)
-            for text, meta in parser.download_and_parse_document(document):
-                metadata.update(meta)
-                texts_and_metadata.append((text, metadata))
-        
-        except Exception as e:
-            print(f"Error processing document {document.uid}: {e}")
-            document.status = document_enums.DocumentProcessingStatus.FAILED
-            document.save(
-                update_fields=["status", "updated_at"]
+        return {
+            _id: (metadata or {}).get("chunk_hash")
+            for _id, metadata in zip(indexed["ids"], indexed["metadatas"])
+        }
+
+    def get_reusable_chunks(
+        self,
+        content_hash: str,
+    ) -> Dict[str, str]:
+        """
+        Return the chunk id by text hash of the content chunks, whose vectors can be
+        reused. The text hash is read from the chunk id, see `make_chunk_id`.
+        """
+        if not content_hash:
+            return {}
+        reusable = {}
+        for _id in self.get_indexed_chunks(content_hash):
+            text_hash = _id.rsplit("_", 2)[-2]
+            reusable.setdefault(text_hash, _id)
+        return reusable
+
+    def _iter_chunks(
+        self,
+        content_hash: str,
+        parser: DocumentParser,
+        indexed: Dict[str, str],
+        seen: Set[str],
+        pages: Set[Any],
+        reusable: Optional[Dict[str, str]] = None,
+        copier: Optional["ChunkCopier"] = None,
+    ) -> Iterator[Document]:
+        """
+        Yield the new or changed chunks of the content ready to be embedded.
+        Ids of all chunks of the content are collected in `seen`. Chunks whose
+        text is in `reusable` (text hash -> chunk id of the previous content)
+        are not yielded but stored by the `copier` with the vectors of that chunk.
+        """
+        reusable = reusable or {}
+        texts_and_metadata = (
+            (text, {**meta, "content_hash": content_hash})
+            for text, meta in parser.parse_document()
+        )
+        occurrences = Counter()
+        for text, chunk_metadata in DocumentChunker().chunk(texts_and_metadata):
+            pages.add(chunk_metadata.get("page"))
+            text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+            occurrences[text_hash] += 1
+            _id = self.make_chunk_id(content_hash, text_hash, occurrences[text_hash])
+            seen.add(_id)
+
+            chunk_hash = self.make_chunk_hash(text, chunk_metadata)
+            if indexed.get(_id) == chunk_hash:
+                continue
+            chunk = Document(
+                page_content=text,
+                metadata={**chunk_metadata, "chunk_hash": chunk_hash},
+                id=_id,
             )
-        
-        document.status = document_enums.DocumentProcessingStatus.COMPLETED
-        document.save(
-            update_fields=["status", "updated_at"]
+            source_id = reusable.get(text_hash[:32])
+            if source_id is not None and copier is not None:
+                copier.add(chunk, source_id)
+                continue
+            yield chunk
+
+    @staticmethod
+    def add_embedded_chunks(
+        vector_store: Any,
+        chunks: List[Document],
+        vectors: List[List[float]],
+    ) -> None:
+        """Store chunks with already computed vectors."""
+        texts = [chunk.page_content for chunk in chunks]
+        metadatas = [chunk.metadata for chunk in chunks]
+        ids = [chunk.id for chunk in chunks]
+        if hasattr(vector_store, "add_embeddings"):
+            vector_store.add_embeddings(texts, vectors, metadatas, ids)
+        else:
+            vector_store._collection.upsert(ids=ids, embeddings=vectors, documents=texts, metadatas=metadatas)
+
+    def copy_chunks(
+        self,
+        source_hash: str,
+        copies: List[Tuple[Document, str]],
+        batch_size: int = settings.EMBEDDING_BATCH_SIZE,
+    ) -> int:
+        """
+        Store the chunks with the vectors of the identical chunks of the source
+        content, without embedding them again. Return the number of stored chunks,
+        chunks missing from the source are embedded.
+        """
+        vector_store = vector_registry.get_vector_store()
+        stored = 0
+        missing = []
+        for start in range(0, len(copies), batch_size):
+            batch = copies[start:start + batch_size]
+            found = vector_store.get(
+                ids=list({source_id for _, source_id in batch}),
+                where={"content_hash": source_hash},
+                include=["embeddings"],
+            )
+            vectors = dict(zip(found["ids"], found["embeddings"]))
+            pairs = [(chunk, vectors[source_id]) for chunk, source_id in batch if source_id in vectors]
+            missing.extend(chunk for chunk, source_id in batch if source_id not in vectors)
+            if pairs:
+                self.add_embedded_chunks(
+                    vector_store,
+                    [chunk for chunk, _ in pairs],
+                    [[float(value) for value in vector] for _, vector in pairs],
+                )
+                stored += len(pairs)
+        if missing:
+            stored += BatchEmbedder(vector_store).add_documents(missing)
+        return stored
+
+    def build_lexical_index(self, content_hash: str) -> None:
+        """Build the BM25 index of the content from its chunks in the vector store."""
+        indexed = vector_registry.get_vector_store().get(
+            where={"content_hash": content_hash},
+            include=["documents"],
         )
-        return texts_and_metadata
+        index = BM25Index.build(zip(indexed["ids"], indexed["documents"]))
+        save_lexical_index(content_hash, index)
+        logger.info(f"Built lexical index of content {content_hash}: {len(index.postings)} terms")
+
+    def delete_content(self, content_hash: str) -> None:
+        """Delete the chunks of the content if no document uses them anymore."""
+        if not content_hash:
+            return
+        if document_models.Document.objects.filter(content_hash=content_hash).exists():
+            return
+        document_models.LexicalIndex.objects.filter(content_hash=content_hash).delete()
+        indexed = self.get_indexed_chunks(content_hash)
+        if indexed:
+            vector_registry.get_vector_store().delete(
+                ids=list(indexed),
+                where={"content_hash": content_hash},
+            )
+            logger.info(f"Deleted {len(indexed)} unused chunks of content {content_hash}")
+
+    def set_content_hash(
+        self,
+        document: document_models.Document,
+        content_hash: str,
+    ) -> None:
+        """Point the document to the indexed content, previous content is deleted if unused."""
+        previous_hash = document.content_hash
+        document.content_hash = content_hash
+        document.file_hash = content_hash
+        document.save(update_fields=["content_hash", "file_hash"])
+        if previous_hash != content_hash:
+            self.delete_content(previous_hash)
 
     def add_documents(
         self,
         document: document_models.Document,
+        force: bool = False,
     ) -> None:
-        texts_and_metadata = self._prepare_data_texts(
-            document=document
-        )
-        embeddings = OpenAIEmbeddings(
-            api_key=settings.OPENAI_API_KEY,
-        )
-        vector_store = Chroma(
-            collection_name="restaurant_reviews",
-            persist_directory=CHROMA_PERSIST_DIR,
-            embedding_function=embeddings
+        """
+        Parse the document file and index its content in the vector store.
+        Chunks are stored once per file content (sha256) and shared by every
+        document with the same content, whoever uploaded it:
+        - content already indexed for this or another document is not parsed again
+        - re-indexing a content only embeds new or changed chunks and deletes stale ones
+        - a changed file copies the vectors of the chunks whose text is unchanged
+          from its previous content instead of embedding them again
+        - the BM25 index of the content is built from the stored chunks
+        - `force` embeds every chunk again, e.g. after an embedding backend change,
+          chunks are upserted in place so the content is served while re-indexing
+        Pages are parsed and chunked in a background thread, chunks are embedded
+        and stored batch by batch, so memory does not grow with the document.
+        Errors are propagated to the caller, which owns the document status.
+        """
+        if not document.document_file:
+            return
+
+        start = time.perf_counter()
+        parser = DocumentParser(document)
+        # the upload hash avoids fetching the file when its content is indexed already
+        content_hash = document.file_hash
+        fetched = not content_hash
+        if fetched:
+            parser.fetch_document(document)
+            content_hash = parser.get_file_hash()
+        if content_hash == document.content_hash and not force:
+            logger.info(f"Document {document.uid} content is unchanged, skipping indexing")
+            if not document_models.LexicalIndex.objects.filter(content_hash=content_hash).exists():
+                self.build_lexical_index(content_hash)
+            return
+        if not force and document_models.Document.objects.filter(content_hash=content_hash).exists():
+            self.set_content_hash(document, content_hash)
+            logger.info(f"Document {document.uid} content is already indexed, sharing its chunks")
+            return
+        if not fetched:
+            parser.fetch_document(document)
+
+        embeddings = vector_registry.get_embeddings()
+        vector_store = vector_registry.get_vector_store()
+        cache_stats = dict(getattr(embeddings, "stats", {}))
+
+        indexed = self.get_indexed_chunks(content_hash)
+        # a changed file reuses the vectors of the chunks of its previous content
+        previous_hash = document.content_hash
+        reusable = {} if force else self.get_reusable_chunks(previous_hash)
+        copier = ChunkCopier(self, previous_hash)
+        seen = set()
+        pages = set()
+        embedder = BatchEmbedder(vector_store)
+        chunks = prefetch(
+            self._iter_chunks(content_hash, parser, {} if force else indexed, seen, pages, reusable, copier),
+            maxsize=embedder.batch_size * embedder.max_workers,
         )
+        embedded = embedder.add_documents(chunks)
+        copier.flush()
+        copied = copier.stored
+        stored = embedded + copied
 
-        documents = []
-        ids = []
-        for idx in range(0, len(texts_and_metadata)):
-            text = texts_and_metadata[idx][0]
-            print("Text:", text)
-            metadata = texts_and_metadata[idx][1]
-            uid = metadata.get("uid")
-            _id = f"{self.collection_name}_{uid}_{idx}"
-            document = Document(
-                page_content=text,
-                metadata=metadata,
-                id=_id
-            )
-            documents.append(document)
-            ids.append(_id)
-        
-        if documents:
-            vector_store.add_documents(documents=documents, ids=ids)
+        stale_ids = [_id for _id in indexed if _id not in seen]
+        if stale_ids:
+            vector_store.delete(ids=stale_ids, where={"content_hash": content_hash})
+        if hasattr(vector_store, "compact"):
+            vector_store.compact(content_hash)
+        lexical_missing = not document_models.LexicalIndex.objects.filter(content_hash=content_hash).exists()
+        if stored or stale_ids or lexical_missing:
+            self.build_lexical_index(content_hash)
+        if stored or stale_ids:
+            bump_content_version(content_hash)
+
+        self.set_content_hash(document, content_hash)
+
+        elapsed = time.perf_counter() - start
+        logger.info(
+            f"Indexed document {document.uid}: {len(pages)} pages, {len(seen)} chunks, "
+            f"{stored} upserted ({copied} reused from the previous content), {len(stale_ids)} deleted "
+            f"in {elapsed:.2f}s ({len(pages) / elapsed if elapsed else 0:.2f} pages/s)"
+        )
+        cached_embeddings = embeddings.embeddings if isinstance(embeddings, ProjectedEmbeddings) else embeddings
+        if isinstance(cached_embeddings, CachedEmbeddings):
+            cache_stats = {
+                name: value - cache_stats.get(name, 0)
+                for name, value in cached_embeddings.stats.items()
+            }
+            logger.info(f"Embedding cache for document {document.uid}: {cache_stats}")
@@ -0,0 +1,16 @@
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from documents import models as document_models
+
+
+@receiver(post_delete, sender=document_models.Document)
+def delete_document_content(sender, instance, **kwargs):
+    """Delete the indexed chunks of a deleted document once no other document uses them."""
+    if not instance.content_hash:
+        return
+    from documents.services.vector import DocumentVectorStore
+
+    content_hash = instance.content_hash
+    transaction.on_commit(lambda: DocumentVectorStore().delete_content(content_hash))
@@ -0,0 +1,43 @@
+from celery import shared_task
+from celery.signals import worker_process_shutdown, worker_shutdown
+
+from documents import models as document_models
+from documents import enums as document_enums
+from documents.services.vector import DocumentVectorStore
+from documents.services.registry import vector_registry
+
+from core.custom_logger import logger
+
+
+@worker_shutdown.connect
+@worker_process_shutdown.connect
+def on_worker_shutdown(*_, **__):
+    vector_registry.close()
+
+
+@shared_task(name="ingest_document_task")
+def ingest_document_task(document_id: int, force: bool = False):
+    """
+    Parse, embed and index an uploaded document.
+    Moves the document status PENDING -> PROCESSING -> COMPLETED/FAILED.
+    With `force` an already indexed content is embedded again, see `add_documents`.
+    """
+    document = document_models.Document.objects.filter(id=document_id).first()
+    if document is None:
+        return
+
+    # a forced re-indexing keeps serving the indexed content until it is done
+    if not (force and document.status == document_enums.DocumentProcessingStatus.COMPLETED):
+        document.status = document_enums.DocumentProcessingStatus.PROCESSING
+        document.save(update_fields=["status", "updated_at"])
+
+    try:
+        DocumentVectorStore().add_documents(document, force=force)
+    except Exception:
+        logger.exception(f"Error processing document {document.uid}")
+        document.status = document_enums.DocumentProcessingStatus.FAILED
+        document.save(update_fields=["status", "updated_at"])
+        return
+
+    document.status = document_enums.DocumentProcessingStatus.COMPLETED
+    document.save(update_fields=["status", "updated_at"])
@@ -1,3 +1,1542 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
 
-# Create your tests here.
+from unittest import mock
+
+import redis
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import AsyncClient, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from langchain_core.documents import Document
+
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from documents import enums as document_enums
+from documents import models as document_models
+from documents.services.chunking import DocumentChunker
+from documents.services.context import ContextBuilder
+from documents.services.embedding import BatchEmbedder
+from documents.services.embedding_cache import CachedEmbeddings, LocalLRUCache
+from documents.services import answer_cache as answer_cache_module
+from documents.services import lexical, llm_chain, pdf_pages
+from documents.services.semantic_cache import SemanticAnswerCache
+from documents.services.llm_chain import Answer, answer_question, answer_questions
+from documents.services.parsers import DocumentParser
+from documents.services import flat_store
+from documents.services.flat_store import FlatVectorStore
+from documents.services.pgvector_store import PgVectorStore
+from documents.services.pipeline import prefetch
+from documents.services.projection import ProjectedEmbeddings, Projection, check_truncatable
+from documents.services.vector import ChunkCopier, DocumentVectorStore, RetrievalOptions
+from documents.services import registry as registry_module
+from documents.services.local_embeddings import HashingEmbeddings
+from documents.services.registry import VectorStoreRegistry
+
+UPLOAD_DOCUMENT_URL = reverse("documents:upload")
+
+
+def ask_url(document_uid):
+    return reverse("documents:test_vector", args=[document_uid])
+
+
+def ask_async_url(document_uid):
+    return reverse("documents:ask_async", args=[document_uid])
+
+
+def ask_stream_url(document_uid):
+    return reverse("documents:ask_stream", args=[document_uid])
+
+
+def ask_async_stream_url(document_uid):
+    return reverse("documents:ask_async_stream", args=[document_uid])
+
+
+def ask_batch_url(document_uid):
+    return reverse("documents:ask_batch", args=[document_uid])
+
+
+def create_user(**params):
+    return get_user_model().objects.create_user(**params)
+
+
+class DocumentApiTests(TestCase):
+    """Test the documents API. For coverage use: coverage run --omit=*/migrations/* manage.py test documents"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email="test@example.com", password="testpass123")
+        self.client.force_authenticate(user=self.user)
+
+    def test_upload_enqueues_ingestion(self):
+        """Test uploading a document schedules the ingestion task"""
+        payload = {
+            "title": "Test document",
+            "document_file": SimpleUploadedFile("test.txt", b"Some text content"),
+        }
+        with mock.patch("documents.tasks.ingest_document_task.delay") as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                res = self.client.post(UPLOAD_DOCUMENT_URL, payload, format="multipart")
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        document = document_models.Document.objects.get(uid=res.data["uid"])
+        self.assertEqual(document.status, document_enums.DocumentProcessingStatus.PENDING)
+        delay.assert_called_once_with(document.id)
+
+    def test_pending_documents_queued(self):
+        """Test the documents left pending are queued for ingestion, the indexed ones are not"""
+        pending = document_models.Document.objects.create(
+            user=self.user,
+            title="Pending document",
+            document_file=SimpleUploadedFile("pending.txt", b"Some text content"),
+        )
+        document_models.Document.objects.create(
+            user=self.user,
+            title="Indexed document",
+            document_file=SimpleUploadedFile("indexed.txt", b"Other text content"),
+            status=document_enums.DocumentProcessingStatus.COMPLETED,
+        )
+
+        with mock.patch("documents.tasks.ingest_document_task.delay") as delay:
+            call_command("ingest_pending_documents", stdout=io.StringIO())
+
+        delay.assert_called_once_with(pending.id)
+
+    def test_admin_file_change_enqueues_ingestion(self):
+        """Test replacing the file of an indexed document in the admin indexes it again"""
+        from django.contrib.admin.sites import AdminSite
+        from documents.admin import DocumentAdmin
+
+        document = document_models.Document.objects.create(
+            user=self.user,
+            title="Indexed document",
+            document_file=SimpleUploadedFile("indexed.txt", b"Old text content"),
+            file_hash="old-file-hash",
+            content_hash="old-content-hash",
+            status=document_enums.DocumentProcessingStatus.COMPLETED,
+        )
+        document.document_file = SimpleUploadedFile("replaced.txt", b"New text content")
+        form = mock.Mock(changed_data=["document_file"])
+
+        with mock.patch("documents.tasks.ingest_document_task.delay") as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                DocumentAdmin(document_models.Document, AdminSite()).save_model(None, document, form, True)
+
+        document.refresh_from_db()
+        self.assertEqual(document.status, document_enums.DocumentProcessingStatus.PENDING)
+        self.assertEqual(document.file_hash, "")
+        delay.assert_called_once_with(document.id)
+
+    def test_reindex_keeps_served_content(self):
+        """Test re-indexing forces one task per content and keeps the indexed content served"""
+        for title in ("First document", "Second document"):
+            document_models.Document.objects.create(
+                user=self.user,
+                title=title,
+                document_file=SimpleUploadedFile("shared.txt", b"Some text content"),
+                content_hash="shared-hash",
+                status=document_enums.DocumentProcessingStatus.COMPLETED,
+            )
+
+        with mock.patch("documents.tasks.ingest_document_task.delay") as delay:
+            call_command("reindex_documents", stdout=io.StringIO())
+
+        delay.assert_called_once_with(mock.ANY, force=True)
+        self.assertEqual(
+            set(document_models.Document.objects.values_list("content_hash", flat=True)),
+            {"shared-hash"},
+        )
+
+    def test_upload_same_content_shares_file(self):
+        """Test uploading the same content twice stores the file once"""
+        other_user = create_user(email="other@example.com", password="testpass123")
+        other_client = APIClient()
+        other_client.force_authenticate(user=other_user)
+
+        uids = []
+        with mock.patch("documents.tasks.ingest_document_task.delay"):
+            for client in (self.client, other_client):
+                payload = {
+                    "title": "Handbook",
+                    "document_file": SimpleUploadedFile("handbook.txt", b"Same handbook content"),
+                }
+                res = client.post(UPLOAD_DOCUMENT_URL, payload, format="multipart")
+                self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+                uids.append(res.data["uid"])
+
+        first, second = [document_models.Document.objects.get(uid=uid) for uid in uids]
+        self.assertEqual(first.file_hash, second.file_hash)
+        self.assertEqual(first.document_file.name, second.document_file.name)
+        self.assertNotEqual(first.user, second.user)
+
+    def test_ask_not_ready_document(self):
+        """Test asking about a document which is not indexed yet is rejected"""
+        document = document_models.Document.objects.create(
+            user=self.user,
+            title="Test document",
+            document_file=SimpleUploadedFile("test.txt", b"Some text content"),
+        )
+        res = self.client.get(ask_url(document.uid), {"query": "test"})
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(res.data["status"], document_enums.DocumentProcessingStatus.PENDING)
+
+    def test_ask_stream_events(self):
+        """Test the answer is streamed as token events followed by a done event"""
+        document = document_models.Document.objects.create(
+            user=self.user,
+            title="Test document",
+            document_file=SimpleUploadedFile("test.txt", b"Some text content"),
+            status=document_enums.DocumentProcessingStatus.COMPLETED,
+        )
+        context = [Document(page_content="Some text", metadata={"page": 0, "chunk_index": 0})]
+        with mock.patch(
+            "documents.views.stream_answer",
+            return_value=(context, iter(["Hel", "lo"])),
+        ):
+            res = self.client.get(
+                ask_stream_url(document.uid), {"query": "test"}, HTTP_ACCEPT="text/event-stream"
+            )
+            body = b"".join(res.streaming_content).decode()
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res["Content-Type"], "text/event-stream")
+        events = [event.split("\n")[0] for event in body.strip().split("\n\n")]
+        self.assertEqual(events, ["event: token", "event: token", "event: done"])
+        self.assertIn('"page": 0', body)
+
+    def test_ask_with_retrieval_options(self):
+        """Test the retrieval options of the query are passed to the search"""
+        document = document_models.Document.objects.create(
+            user=self.user,
+            title="Test document",
+            document_file=SimpleUploadedFile("test.txt", b"Some text content"),
+            status=document_enums.DocumentProcessingStatus.COMPLETED,
+        )
+
+        with mock.patch("documents.views.answer_question", return_value=Answer("An answer")) as answer:
+            res = self.client.get(ask_url(document.uid), {"query": "test", "search_type": "mmr", "k": 3})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        options = answer.call_args.args[2]
+        self.assertEqual((options.search_type, options.k), ("mmr", 3))
+
+    def test_ask_invalid_retrieval_options(self):
+        """Test unknown search types are rejected"""
+        document = document_models.Document.objects.create(
+            user=self.user,
+            title="Test document",
+            document_file=SimpleUploadedFile("test.txt", b"Some text content"),
+            status=document_enums.DocumentProcessingStatus.COMPLETED,
+        )
+
+        res = self.client.get(ask_url(document.uid), {"query": "test", "search_type": "random"})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_ask_batch(self):
+        """Test many questions are answered in order, errors only fail their question"""
+        document = document_models.Document.objects.create(
+            user=self.user,
+            title="Test document",
+            document_file=SimpleUploadedFile("test.txt", b"Some text content"),
+            status=document_enums.DocumentProcessingStatus.COMPLETED,
+        )
+        answers = [Answer("First answer", cached=True), Answer("", error="Answer generation failed.")]
+
+        with mock.patch("documents.views.answer_questions", return_value=answers) as answer:
+            res = self.client.post(
+                ask_batch_url(document.uid),
+                {"questions": ["First?", "Second?"], "k": 3},
+                format="json",
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["answers"], [
+            {"question": "First?", "answer": "First answer", "cache": "HIT", "error": None},
+            {"question": "Second?", "answer": "", "cache": "MISS", "error": "Answer generation failed."},
+        ])
+        self.assertEqual(answer.call_args.args[2].k, 3)
+
+    def test_ask_batch_limit(self):
+        """Test empty or too large batches are rejected"""
+        document = document_models.Document.objects.create(
+            user=self.user,
+            title="Test document",
+            document_file=SimpleUploadedFile("test.txt", b"Some text content"),
+            status=document_enums.DocumentProcessingStatus.COMPLETED,
+        )
+
+        empty = self.client.post(ask_batch_url(document.uid), {"questions": []}, format="json")
+        too_many = self.client.post(ask_batch_url(document.uid), {"questions": ["?"] * 1000}, format="json")
+
+        self.assertEqual(empty.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(too_many.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_ask_async(self):
+        """Test the async ask view answers with a JWT authenticated user"""
+        document = document_models.Document.objects.create(
+            user=self.user,
+            title="Test document",
+            document_file=SimpleUploadedFile("test.txt", b"Some text content"),
+            status=document_enums.DocumentProcessingStatus.COMPLETED,
+        )
+        token = RefreshToken.for_user(self.user).access_token
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+
+        with mock.patch("documents.views.aanswer_question", return_value=Answer("An answer")) as answer:
+            res = client.get(ask_async_url(document.uid), {"query": "test"})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.json(), {"answer": "An answer"})
+        self.assertEqual(res["X-Answer-Cache"], "MISS")
+        answer.assert_awaited_once()
+
+    async def test_ask_async_stream_events(self):
+        """Test the async stream view sends the events as the tokens are generated"""
+        document = await document_models.Document.objects.acreate(
+            user=self.user,
+            title="Test document",
+            document_file=SimpleUploadedFile("test.txt", b"Some text content"),
+            status=document_enums.DocumentProcessingStatus.COMPLETED,
+        )
+        token = AccessToken.for_user(self.user)
+        context = [Document(page_content="Some text", metadata={"page": 0})]
+
+        async def tokens():
+            yield "Hel"
+            yield "lo"
+
+        async def astream_answer(question, document, options):
+            return context, tokens()
+
+        with mock.patch("documents.views.astream_answer", astream_answer):
+            res = await AsyncClient().get(
+                ask_async_stream_url(document.uid),
+                {"query": "test"},
+                headers={"Authorization": f"Bearer {token}"},
+            )
+            body = "".join([chunk.decode() async for chunk in res.streaming_content])
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        events = [event.split("\n")[0] for event in body.strip().split("\n\n")]
+        self.assertEqual(events, ["event: token", "event: token", "event: done"])
+
+    def test_ask_async_requires_authentication(self):
+        """Test the async ask view rejects anonymous requests"""
+        res = APIClient().get(ask_async_url("00000000-0000-0000-0000-000000000000"))
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_ask_other_user_document(self):
+        """Test asking about a document of another user is not allowed"""
+        other_user = create_user(email="other@example.com", password="testpass123")
+        document = document_models.Document.objects.create(
+            user=other_user,
+            title="Other document",
+            document_file=SimpleUploadedFile("test.txt", b"Some text content"),
+            status=document_enums.DocumentProcessingStatus.COMPLETED,
+        )
+        res = self.client.get(ask_url(document.uid), {"query": "test"})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class DocumentChunkerTests(SimpleTestCase):
+    """Test splitting parsed pages into token bounded chunks"""
+
+    def setUp(self):
+        self.chunker = DocumentChunker(chunk_size=20, chunk_overlap=5)
+
+    def test_chunks_are_token_bounded(self):
+        """Test every chunk fits into the configured token size"""
+        text = "\n\n".join(f"Paragraph {i} has a few words in it." for i in range(30))
+        chunks = list(self.chunker.chunk([(text, {"page": 0})]))
+
+        self.assertGreater(len(chunks), 1)
+        for chunk, metadata in chunks:
+            self.assertLessEqual(self.chunker.count_tokens(chunk), 20)
+            self.assertEqual(metadata["token_count"], self.chunker.count_tokens(chunk))
+
+    def test_chunk_metadata_offsets(self):
+        """Test chunks keep their page and offsets in the page text"""
+        pages = [
+            ("First page. " * 20, {"page": 0, "source": "a.pdf"}),
+            ("Second page. " * 20, {"page": 1, "source": "a.pdf"}),
+        ]
+        chunks = list(self.chunker.chunk(pages))
+
+        self.assertEqual(
+            [metadata["chunk_index"] for _, metadata in chunks],
+            list(range(len(chunks))),
+        )
+        for chunk, metadata in chunks:
+            page_text = pages[metadata["page"]][0]
+            self.assertEqual(page_text[metadata["start_index"]:metadata["end_index"]], chunk)
+            self.assertEqual(metadata["source"], "a.pdf")
+
+    def test_overlap_must_be_smaller_than_size(self):
+        """Test the chunker rejects an overlap bigger than the chunk"""
+        with self.assertRaises(ValueError):
+            DocumentChunker(chunk_size=10, chunk_overlap=10)
+
+    @mock.patch("documents.services.chunking.tiktoken.get_encoding", side_effect=ConnectionError("offline"))
+    def test_offline_token_counting(self, get_encoding):
+        """Test tokens are counted locally when the encoding cannot be downloaded for the hashing backend"""
+        with mock.patch("documents.services.chunking.settings.EMBEDDING_BACKEND", "hashing"):
+            chunker = DocumentChunker(chunk_size=20, chunk_overlap=5)
+        text = "\n\n".join(f"Paragraph {i} has a few words in it." for i in range(30))
+
+        chunks = list(chunker.chunk([(text, {"page": 0})]))
+
+        self.assertGreater(len(chunks), 1)
+        for chunk, metadata in chunks:
+            self.assertLessEqual(metadata["token_count"], 20)
+        with self.assertRaises(ConnectionError):
+            DocumentChunker(chunk_size=20, chunk_overlap=5)
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+class BatchEmbedderTests(SimpleTestCase):
+    """Test batching and retrying of embedding requests"""
+
+    def make_documents(self, count, token_count=10):
+        return [
+            Document(page_content=f"chunk {i}", metadata={"token_count": token_count}, id=str(i))
+            for i in range(count)
+        ]
+
+    def test_batches_bounded_by_size_and_tokens(self):
+        """Test batches respect both the count and the token limits"""
+        embedder = BatchEmbedder(mock.Mock(), batch_size=4, batch_max_tokens=25)
+        batches = list(embedder.make_batches(self.make_documents(7)))
+
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 2, 1])
+
+    def test_add_documents_stores_all_batches(self):
+        """Test every document is stored exactly once"""
+        vector_store = mock.Mock()
+        embedder = BatchEmbedder(vector_store, batch_size=3, batch_max_tokens=1000, max_workers=2)
+
+        stored = embedder.add_documents(self.make_documents(10))
+
+        self.assertEqual(stored, 10)
+        ids = [
+            _id
+            for call in vector_store.add_documents.call_args_list
+            for _id in call.kwargs["ids"]
+        ]
+        self.assertCountEqual(ids, [str(i) for i in range(10)])
+
+    @mock.patch("documents.services.embedding.time.sleep")
+    def test_rate_limit_is_retried(self, sleep):
+        """Test a rate limited batch is retried after a back-off"""
+        vector_store = mock.Mock()
+        vector_store.add_documents.side_effect = [RateLimitError(), None]
+        embedder = BatchEmbedder(vector_store, max_retries=2)
+
+        self.assertEqual(embedder.add_documents(self.make_documents(2)), 2)
+        sleep.assert_called_once()
+
+    def test_other_errors_are_raised(self):
+        """Test non rate limit errors are not retried"""
+        vector_store = mock.Mock()
+        vector_store.add_documents.side_effect = ValueError("bad input")
+        embedder = BatchEmbedder(vector_store, max_retries=2)
+
+        with self.assertRaises(ValueError):
+            embedder.add_documents(self.make_documents(2))
+        self.assertEqual(vector_store.add_documents.call_count, 1)
+
+
+class FakeRedisLRUCache:
+    def __init__(self):
+        self.data = {}
+
+    def get_many(self, keys):
+        return {key: self.data[key] for key in keys if key in self.data}
+
+    def set_many(self, items):
+        self.data.update(items)
+
+    def incr_stats(self, **counters):
+        pass
+
+
+class EmbeddingCacheTests(SimpleTestCase):
+    """Test the content hash embeddings cache"""
+
+    def setUp(self):
+        self.embeddings = mock.Mock()
+        self.embeddings.embed_documents.side_effect = lambda texts: [[float(len(t))] for t in texts]
+        CachedEmbeddings.local_cache = LocalLRUCache(100)
+
+    def test_local_lru_eviction(self):
+        """Test the least recently used entry is evicted first"""
+        cache = LocalLRUCache(2)
+        cache.set("a", [1.0])
+        cache.set("b", [2.0])
+        cache.get("a")
+        cache.set("c", [3.0])
+
+        self.assertEqual(cache.get("a"), [1.0])
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(len(cache), 2)
+
+    def test_duplicate_texts_embedded_once(self):
+        """Test repeated texts are embedded once and then served from cache"""
+        cached = CachedEmbeddings(self.embeddings, "model", redis_cache=FakeRedisLRUCache())
+
+        vectors = cached.embed_documents(["header", "body text", "header"])
+        self.assertEqual(vectors, [[6.0], [9.0], [6.0]])
+        self.embeddings.embed_documents.assert_called_once_with(["header", "body text"])
+
+        cached.embed_documents(["header", "body text"])
+        self.assertEqual(self.embeddings.embed_documents.call_count, 1)
+        self.assertEqual(cached.stats, {"local_hits": 2, "redis_hits": 0, "misses": 2})
+
+    def test_local_tier_stores_packed_vectors(self):
+        """Test the in-process tier keeps float32 bytes and returns float lists"""
+        cached = CachedEmbeddings(self.embeddings, "model", redis_cache=FakeRedisLRUCache())
+        cached.embed_documents(["text"])
+
+        self.assertIsInstance(CachedEmbeddings.local_cache.get(cached.cache_key("text")), bytes)
+        self.assertEqual(cached.embed_query("text"), [4.0])
+        self.assertEqual(cached.stats["local_hits"], 1)
+
+    def test_redis_tier_shared_between_processes(self):
+        """Test vectors missing locally are read from the redis tier"""
+        redis_cache = FakeRedisLRUCache()
+        CachedEmbeddings(self.embeddings, "model", redis_cache=redis_cache).embed_documents(["text"])
+        CachedEmbeddings.local_cache = LocalLRUCache(100)
+
+        cached = CachedEmbeddings(self.embeddings, "model", redis_cache=redis_cache)
+        self.assertEqual(cached.embed_query("text"), [4.0])
+        self.assertEqual(cached.stats["redis_hits"], 1)
+        self.assertEqual(self.embeddings.embed_documents.call_count, 1)
+
+    def test_cache_key_depends_on_model(self):
+        """Test the same text embedded by different models is cached apart"""
+        first = CachedEmbeddings(self.embeddings, "model-a", redis_cache=FakeRedisLRUCache())
+        second = CachedEmbeddings(self.embeddings, "model-b", redis_cache=FakeRedisLRUCache())
+
+        self.assertNotEqual(first.cache_key("text"), second.cache_key("text"))
+
+
+class VectorStoreRegistryTests(SimpleTestCase):
+    """Test the process wide vector store clients registry"""
+
+    @mock.patch("documents.services.registry.create_vector_store")
+    @mock.patch("documents.services.registry.create_embeddings")
+    def test_clients_created_once(self, create_embeddings, create_vector_store):
+        """Test clients are created lazily once and reused until closed"""
+        registry = VectorStoreRegistry()
+
+        first = registry.get_vector_store()
+        second = registry.get_vector_store()
+
+        self.assertIs(first, second)
+        create_embeddings.assert_called_once()
+        create_vector_store.assert_called_once_with(create_embeddings.return_value)
+
+        registry.close()
+        registry.get_vector_store()
+        self.assertEqual(create_vector_store.call_count, 2)
+
+    @mock.patch("documents.services.registry.settings.EMBEDDING_BACKEND", "hashing")
+    def test_hashing_backend_selected(self):
+        """Test the local embeddings backend uses its own collection"""
+        self.assertIsInstance(registry_module.create_embeddings(), HashingEmbeddings)
+        self.assertEqual(registry_module.get_collection_name(), "restaurant_reviews_hashing")
+
+    @mock.patch("documents.services.registry.create_vector_store")
+    @mock.patch("documents.services.registry.create_embeddings")
+    def test_forked_process_gets_new_clients(self, create_embeddings, create_vector_store):
+        """Test a child process does not reuse the parent clients"""
+        registry = VectorStoreRegistry()
+        registry.get_vector_store()
+
+        with mock.patch("documents.services.registry.os.getpid", return_value=-1):
+            registry.get_vector_store()
+
+        self.assertEqual(create_vector_store.call_count, 2)
+
+
+class DocumentDownloadTests(SimpleTestCase):
+    """Test streaming documents files to disk"""
+
+    def setUp(self):
+        self.parser = DocumentParser(mock.Mock())
+        handle, self.parser.file_path = tempfile.mkstemp()
+        os.close(handle)
+
+    def mock_response(self, chunks, content_length=None):
+        response = mock.MagicMock()
+        response.__enter__.return_value = response
+        response.headers = {"Content-Length": str(content_length)} if content_length else {}
+        response.iter_content.return_value = iter(chunks)
+        return response
+
+    @mock.patch("documents.services.parsers.http_session")
+    def test_download_streams_to_file(self, http_session):
+        """Test the file is written chunk by chunk"""
+        http_session.get.return_value = self.mock_response([b"abc", b"def"])
+
+        self.parser.download_file("http://storage/file.txt")
+
+        with open(self.parser.file_path, "rb") as file:
+            self.assertEqual(file.read(), b"abcdef")
+        self.assertTrue(http_session.get.call_args.kwargs["stream"])
+
+    @mock.patch("documents.services.parsers.settings.MAX_UPLOAD_SIZE", 4)
+    @mock.patch("documents.services.parsers.http_session")
+    def test_download_aborts_when_too_large(self, http_session):
+        """Test the download stops once the file exceeds the max size"""
+        chunks = iter([b"abc", b"def", b"ghi"])
+        http_session.get.return_value = self.mock_response(chunks)
+
+        with self.assertRaises(ValueError):
+            self.parser.download_file("http://storage/file.txt")
+        self.assertEqual(next(chunks), b"ghi")
+
+    @mock.patch("documents.services.parsers.settings.MAX_UPLOAD_SIZE", 4)
+    @mock.patch("documents.services.parsers.http_session")
+    def test_download_rejects_large_content_length(self, http_session):
+        """Test a too large declared size is rejected before reading the body"""
+        response = self.mock_response([b"abc"], content_length=100)
+        http_session.get.return_value = response
+
+        with self.assertRaises(ValueError):
+            self.parser.download_file("http://storage/file.txt")
+        response.iter_content.assert_not_called()
+
+
+class DocumentStorageReadTests(SimpleTestCase):
+    """Test reading documents files from the storage backend"""
+
+    def make_document(self, storage):
+        document = mock.Mock()
+        document.uid = "test-uid"
+        document.document_file.name = "document/test.txt"
+        document.document_file.storage = storage
+        return document
+
+    def test_local_file_parsed_in_place(self):
+        """Test a file on the local storage is not copied nor deleted"""
+        handle, path = tempfile.mkstemp(suffix=".txt")
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        storage = mock.Mock()
+        storage.path.return_value = path
+        parser = DocumentParser(mock.Mock())
+
+        parser.fetch_file(self.make_document(storage))
+        self.assertEqual(parser.file_path, path)
+        storage.open.assert_not_called()
+
+        del parser
+        self.assertTrue(os.path.exists(path))
+
+    @mock.patch("documents.services.parsers.http_session")
+    def test_remote_file_copied_from_storage(self, http_session):
+        """Test a remote storage file is streamed without HTTP requests"""
+        storage = mock.Mock()
+        storage.path.side_effect = NotImplementedError
+        storage_file = mock.MagicMock()
+        storage_file.__enter__.return_value = storage_file
+        storage_file.blob = None
+        storage_file.read.side_effect = [b"abc", b"def", b""]
+        storage.open.return_value = storage_file
+        parser = DocumentParser(mock.Mock())
+        parser.file_extension = "txt"
+
+        parser.fetch_file(self.make_document(storage))
+
+        with open(parser.file_path, "rb") as file:
+            self.assertEqual(file.read(), b"abcdef")
+        http_session.get.assert_not_called()
+
+    @mock.patch("documents.services.parsers.http_session")
+    def test_storage_error_raised_with_failed_download(self, http_session):
+        """Test a storage error is not swallowed when the download fallback fails too"""
+        storage = mock.Mock()
+        storage.path.side_effect = NotImplementedError
+        storage.open.side_effect = OSError("Storage unavailable")
+        http_session.get.side_effect = ConnectionError("Connection refused")
+        parser = DocumentParser(mock.Mock())
+        parser.file_extension = "txt"
+
+        with self.assertRaises(ConnectionError) as error:
+            parser.fetch_file(self.make_document(storage))
+
+        self.assertIsInstance(error.exception.__context__, OSError)
+
+
+class ParallelPdfExtractionTests(SimpleTestCase):
+    """Test extracting PDF pages with a process pool"""
+
+    def setUp(self):
+        import pymupdf
+
+        handle, self.file_path = tempfile.mkstemp(suffix=".pdf")
+        os.close(handle)
+        self.addCleanup(os.remove, self.file_path)
+        with pymupdf.open() as pdf:
+            for i in range(7):
+                pdf.new_page().insert_text((72, 72), f"Page number {i}")
+            pdf.save(self.file_path)
+
+    def test_parallel_pages_in_order(self):
+        """Test parallel extraction yields the same pages in the same order"""
+        sequential = pdf_pages.extract_pages(self.file_path, 0, 7)
+        parallel = list(pdf_pages.extract_pages_parallel(self.file_path, workers=2, pages_per_task=2))
+
+        self.assertEqual(parallel, sequential)
+        self.assertEqual([metadata["page"] for _, metadata in parallel], list(range(7)))
+        self.assertIn("Page number 6", parallel[-1][0])
+
+
+class PrefetchPipelineTests(SimpleTestCase):
+    """Test the bounded queue between ingestion stages"""
+
+    def test_items_kept_in_order(self):
+        """Test items are yielded in the producer order"""
+        self.assertEqual(list(prefetch(iter(range(100)), maxsize=3)), list(range(100)))
+
+    def test_producer_runs_ahead_bounded(self):
+        """Test the producer never gets more than maxsize items ahead"""
+        produced = []
+
+        def produce():
+            for i in range(50):
+                produced.append(i)
+                yield i
+
+        consumed = 0
+        for _ in prefetch(produce(), maxsize=5):
+            consumed += 1
+            # queued items + the one waiting to be put + the consumed ones
+            self.assertLessEqual(len(produced), consumed + 5 + 1)
+
+    def test_producer_error_raised(self):
+        """Test an error while producing is raised to the consumer"""
+        def produce():
+            yield 1
+            raise ValueError("parse error")
+
+        with self.assertRaises(ValueError):
+            list(prefetch(produce(), maxsize=2))
+
+    def test_producer_thread_closes_connections(self):
+        """Test the database connections of the producer thread are closed around its work"""
+        with mock.patch("documents.services.pipeline.close_old_connections") as close_old_connections:
+            self.assertEqual(list(prefetch(iter([1, 2]), maxsize=2)), [1, 2])
+
+        self.assertEqual(close_old_connections.call_count, 2)
+
+
+@mock.patch("documents.services.vector.vector_registry")
+@mock.patch("documents.services.vector.DocumentParser")
+class IncrementalIndexingTests(TestCase):
+    """Test re-indexing only the changed content of documents"""
+
+    def setUp(self):
+        self.user = create_user(email="test@example.com", password="testpass123")
+        self.document = document_models.Document.objects.create(
+            user=self.user,
+            title="Test document",
+            document_file=SimpleUploadedFile("test.txt", b"Some text content"),
+        )
+        self.vector_store = DocumentVectorStore()
+
+    def setup_mocks(self, parser_class, vector_registry, pages, file_hash, indexed=None):
+        parser = parser_class.return_value
+        parser.get_file_hash.return_value = file_hash
+        parser.parse_document.return_value = iter(pages)
+        store = vector_registry.get_vector_store.return_value
+        indexed = indexed or {}
+        store.get.return_value = {
+            "ids": list(indexed),
+            "documents": ["" for _ in indexed],
+            "metadatas": [{"chunk_hash": chunk_hash} for chunk_hash in indexed.values()],
+        }
+        return store
+
+    def stored_documents(self, store):
+        return [
+            document
+            for call in store.add_documents.call_args_list
+            for document in call.kwargs["documents"]
+        ]
+
+    def test_unchanged_file_skipped(self, parser_class, vector_registry):
+        """Test a file with the indexed content hash is not parsed again"""
+        self.document.content_hash = "same-hash"
+        store = self.setup_mocks(parser_class, vector_registry, [], "same-hash")
+
+        self.vector_store.add_documents(self.document)
+
+        parser_class.return_value.parse_document.assert_not_called()
+        store.add_documents.assert_not_called()
+
+    def test_only_changed_chunks_upserted(self, parser_class, vector_registry):
+        """Test unchanged chunks are kept and stale chunks deleted when indexing again"""
+        pages = [("First page text.", {"page": 0}), ("Second page text.", {"page": 1})]
+        store = self.setup_mocks(parser_class, vector_registry, pages, "content-hash")
+        self.vector_store.add_documents(self.document)
+
+        first_index = {
+            document.id: document.metadata["chunk_hash"]
+            for document in self.stored_documents(store)
+        }
+        self.assertEqual(len(first_index), 2)
+        self.assertEqual(self.document.content_hash, "content-hash")
+
+        # e.g. after a chunking change, the same content is indexed again
+        self.document.content_hash = ""
+        pages = [("First page text.", {"page": 0}), ("Changed second page.", {"page": 1})]
+        store = self.setup_mocks(parser_class, vector_registry, pages, "content-hash", first_index)
+        self.vector_store.add_documents(self.document)
+
+        upserted = self.stored_documents(store)
+        self.assertEqual([document.page_content for document in upserted], ["Changed second page."])
+        deleted = store.delete.call_args.kwargs["ids"]
+        self.assertEqual(len(deleted), 1)
+        self.assertNotIn(deleted[0], [document.id for document in upserted])
+
+    def test_forced_indexing_embeds_unchanged_content(self, parser_class, vector_registry):
+        """Test a forced re-indexing embeds every chunk again in place of the indexed ones"""
+        pages = [("First page text.", {"page": 0})]
+        store = self.setup_mocks(parser_class, vector_registry, pages, "content-hash")
+        self.vector_store.add_documents(self.document)
+        first_index = {
+            document.id: document.metadata["chunk_hash"]
+            for document in self.stored_documents(store)
+        }
+
+        store = self.setup_mocks(parser_class, vector_registry, pages, "content-hash", first_index)
+        self.vector_store.add_documents(self.document, force=True)
+
+        self.assertEqual([document.id for document in self.stored_documents(store)], list(first_index))
+        store.delete.assert_not_called()
+        self.assertEqual(self.document.content_hash, "content-hash")
+
+    def test_changed_file_reuses_unchanged_chunks(self, parser_class, vector_registry):
+        """Test a changed file copies the vectors of its unchanged chunks instead of embedding them"""
+        self.document.content_hash = "old-hash"
+        self.document.save()
+        pages = [("First page text.", {"page": 0}), ("Changed second page.", {"page": 1})]
+        store = self.setup_mocks(parser_class, vector_registry, pages, "new-hash")
+        old_first, old_second = [
+            self.vector_store.make_chunk_id("old-hash", hashlib.sha256(text.encode("utf-8")).hexdigest(), 1)
+            for text in ("First page text.", "Old second page.")
+        ]
+
+        def get(ids=None, where=None, include=None):
+            if where["content_hash"] != "old-hash":
+                return {"ids": [], "documents": [], "metadatas": [], "embeddings": []}
+            if include == ["embeddings"]:
+                self.assertEqual(ids, [old_first])
+                return {"ids": [old_first], "embeddings": [[0.6, 0.8]]}
+            self.assertEqual(include, ["metadatas"])
+            return {"ids": [old_first, old_second], "metadatas": [{}, {}]}
+
+        store.get.side_effect = get
+
+        self.vector_store.add_documents(self.document)
+
+        self.assertEqual(
+            [document.page_content for document in self.stored_documents(store)],
+            ["Changed second page."],
+        )
+        texts, vectors, metadatas, ids = store.add_embeddings.call_args.args
+        self.assertEqual(texts, ["First page text."])
+        self.assertEqual(vectors, [[0.6, 0.8]])
+        self.assertEqual(metadatas[0]["content_hash"], "new-hash")
+        self.assertIn("new-hash", ids[0])
+        store.delete.assert_called_with(ids=[old_first, old_second], where={"content_hash": "old-hash"})
+
+    def test_copies_flushed_in_batches(self, parser_class, vector_registry):
+        """Test copied chunks are stored batch by batch while they are collected"""
+        copier = ChunkCopier(self.vector_store, "old-hash", batch_size=2)
+        with mock.patch.object(
+            self.vector_store, "copy_chunks", side_effect=lambda source_hash, batch, batch_size: len(batch),
+        ) as copy_chunks:
+            for n in range(5):
+                copier.add(Document(page_content=f"Text {n}.", id=f"new-{n}"), f"old-{n}")
+            self.assertEqual(copy_chunks.call_count, 2)
+            copier.flush()
+
+        self.assertEqual(copy_chunks.call_count, 3)
+        self.assertEqual(copier.stored, 5)
+        self.assertEqual(copier.pending, [])
+
+    def test_upload_hash_skips_fetching(self, parser_class, vector_registry):
+        """Test a content already indexed is shared without fetching the file again"""
+        document_models.Document.objects.create(
+            user=self.user,
+            title="Other document",
+            document_file=self.document.document_file.name,
+            content_hash="shared-hash",
+        )
+        self.document.file_hash = "shared-hash"
+        self.setup_mocks(parser_class, vector_registry, [], "other-hash")
+
+        self.vector_store.add_documents(self.document)
+
+        parser_class.return_value.fetch_document.assert_not_called()
+        self.assertEqual(self.document.content_hash, "shared-hash")
+
+    def test_same_content_shared_between_users(self, parser_class, vector_registry):
+        """Test a content indexed for another user is not embedded again"""
+        other_user = create_user(email="other@example.com", password="testpass123")
+        document_models.Document.objects.create(
+            user=other_user,
+            title="Other document",
+            document_file=self.document.document_file.name,
+            content_hash="shared-hash",
+        )
+        store = self.setup_mocks(parser_class, vector_registry, [("Text.", {})], "shared-hash")
+
+        self.vector_store.add_documents(self.document)
+
+        parser_class.return_value.parse_document.assert_not_called()
+        store.add_documents.assert_not_called()
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.content_hash, "shared-hash")
+        self.assertEqual(
+            DocumentVectorStore.get_search_filter(self.document),
+            {"content_hash": "shared-hash"},
+        )
+
+    def test_unused_content_deleted(self, parser_class, vector_registry):
+        """Test chunks of the previous content are deleted once no document uses them"""
+        self.document.content_hash = "old-hash"
+        self.document.save()
+        store = self.setup_mocks(
+            parser_class, vector_registry, [("New text.", {"page": 0})], "new-hash",
+            indexed={"old-chunk": "old-chunk-hash"},
+        )
+
+        self.vector_store.add_documents(self.document)
+
+        store.delete.assert_called_with(ids=["old-chunk"], where={"content_hash": "old-hash"})
+
+
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+@mock.patch("documents.services.llm_chain.settings.SEMANTIC_CACHE_ENABLED", False)
+class AnswerCacheTests(TestCase):
+    """Test the exact match answers cache"""
+
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        user = create_user(email="test@example.com", password="testpass123")
+        self.document = document_models.Document.objects.create(
+            user=user,
+            title="Test document",
+            document_file=SimpleUploadedFile("test.txt", b"Some text content"),
+            status=document_enums.DocumentProcessingStatus.COMPLETED,
+            content_hash="content-hash",
+        )
+
+    def test_normalize_question(self):
+        """Test questions differing by case, spaces or final punctuation match"""
+        self.assertEqual(
+            answer_cache_module.normalize_question("  What is the   Termination clause?? "),
+            answer_cache_module.normalize_question("what is the termination clause"),
+        )
+
+    @mock.patch("documents.services.llm_chain.get_context", return_value=[])
+    @mock.patch("documents.services.llm_chain.chain")
+    def test_second_question_served_from_cache(self, chain, get_context):
+        """Test the same question is answered once by the LLM"""
+        chain.invoke.return_value = mock.Mock(content="The answer")
+
+        first = answer_question("What is the termination clause?", self.document)
+        second = answer_question("what is the termination clause", self.document)
+
+        self.assertEqual(first, Answer("The answer", cached=False))
+        self.assertEqual(second, Answer("The answer", cached=True))
+        chain.invoke.assert_called_once()
+
+    @mock.patch("documents.services.llm_chain.DocumentVectorStore")
+    @mock.patch("documents.services.llm_chain.vector_registry")
+    @mock.patch("documents.services.llm_chain.chain")
+    def test_batch_questions(self, chain, vector_registry, vector_store_class):
+        """Test a batch embeds and searches once and isolates the failed questions"""
+        llm_chain.answer_cache.set(self.document, "First question", "Cached answer", RetrievalOptions().cache_key())
+        embeddings = vector_registry.get_embeddings.return_value
+        embeddings.embed_documents.return_value = [[1.0, 0.0], [0.0, 1.0]]
+        vector_store_class.return_value.batch_search.return_value = [[], []]
+        chain.batch.return_value = [mock.Mock(content="Second answer"), RuntimeError("LLM quota")]
+
+        answers = answer_questions(["First question", "Second question", "Third question"], self.document)
+
+        self.assertEqual(answers, [
+            Answer("Cached answer", cached=True),
+            Answer("Second answer"),
+            Answer("", error="Answer generation failed."),
+        ])
+        embeddings.embed_documents.assert_called_once_with(["Second question", "Third question"])
+        vector_store_class.return_value.batch_search.assert_called_once()
+        self.assertEqual(len(chain.batch.call_args.args[0]), 2)
+        self.assertEqual(chain.batch.call_args.kwargs["return_exceptions"], True)
+
+    @mock.patch("documents.services.llm_chain.get_context", return_value=[])
+    @mock.patch("documents.services.llm_chain.chain")
+    def test_reindexing_invalidates_answers(self, chain, get_context):
+        """Test answers are not reused once the content is indexed again"""
+        chain.invoke.return_value = mock.Mock(content="The answer")
+
+        answer_question("What is the termination clause?", self.document)
+        answer_cache_module.bump_content_version(self.document.content_hash)
+        answer = answer_question("What is the termination clause?", self.document)
+
+        self.assertFalse(answer.cached)
+        self.assertEqual(chain.invoke.call_count, 2)
+
+    @mock.patch("documents.services.llm_chain.get_context", return_value=[])
+    @mock.patch("documents.services.llm_chain.chain")
+    def test_redis_outage_is_a_miss(self, chain, get_context):
+        """Test questions are answered and content versions bumped while Redis is down"""
+        chain.invoke.return_value = mock.Mock(content="The answer")
+        outage = redis.exceptions.ConnectionError("Connection refused")
+
+        with mock.patch("documents.services.answer_cache.cache") as cache:
+            for method in ("get", "set", "add", "incr"):
+                getattr(cache, method).side_effect = outage
+            answer = answer_question("What is the termination clause?", self.document)
+            answer_cache_module.bump_content_version(self.document.content_hash)
+
+        self.assertEqual(answer, Answer("The answer", cached=False))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SemanticAnswerCacheTests(TestCase):
+    """Test the answers cache looked up by question similarity"""
+
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        user = create_user(email="test@example.com", password="testpass123")
+        self.document = document_models.Document.objects.create(
+            user=user,
+            title="Test document",
+            document_file=SimpleUploadedFile("test.txt", b"Some text content"),
+            status=document_enums.DocumentProcessingStatus.COMPLETED,
+            content_hash="content-hash",
+        )
+        self.cache = SemanticAnswerCache(model_name="model", prompt_version="1", threshold=0.9, max_entries=2)
+
+    def test_similar_question_hit(self):
+        """Test a question above the similarity threshold reuses the answer"""
+        self.cache.add(self.document, [1.0, 0.0, 0.0], "The answer")
+
+        self.assertEqual(self.cache.lookup(self.document, [0.95, 0.1, 0.0]), "The answer")
+        self.assertIsNone(self.cache.lookup(self.document, [0.5, 0.5, 0.5]))
+        self.assertEqual(self.cache.get_stats()["hits"], 1)
+        self.assertEqual(self.cache.get_stats()["misses"], 1)
+
+    def test_least_recently_used_evicted(self):
+        """Test the index keeps only the most recently used entries"""
+        self.cache.add(self.document, [1.0, 0.0, 0.0], "First")
+        self.cache.add(self.document, [0.0, 1.0, 0.0], "Second")
+        self.cache.lookup(self.document, [1.0, 0.0, 0.0])
+        self.cache.add(self.document, [0.0, 0.0, 1.0], "Third")
+
+        self.assertEqual(self.cache.lookup(self.document, [1.0, 0.0, 0.0]), "First")
+        self.assertIsNone(self.cache.lookup(self.document, [0.0, 1.0, 0.0]))
+
+    def test_reindexing_invalidates_answers(self):
+        """Test similar answers are not reused once the content is indexed again"""
+        self.cache.add(self.document, [1.0, 0.0, 0.0], "The answer")
+        answer_cache_module.bump_content_version(self.document.content_hash)
+
+        self.assertIsNone(self.cache.lookup(self.document, [1.0, 0.0, 0.0]))
+
+    def test_redis_outage_is_a_miss(self):
+        """Test Redis errors are treated as misses and skipped writes"""
+        with mock.patch("documents.services.semantic_cache.cache") as cache:
+            cache.get.side_effect = redis.exceptions.ConnectionError("Connection refused")
+            self.cache.add(self.document, [1.0, 0.0, 0.0], "The answer")
+
+            self.assertIsNone(self.cache.lookup(self.document, [1.0, 0.0, 0.0]))
+        cache.set.assert_not_called()
+
+    @mock.patch("documents.services.llm_chain.get_context", return_value=[])
+    @mock.patch("documents.services.llm_chain.chain")
+    @mock.patch("documents.services.llm_chain.vector_registry")
+    def test_paraphrased_question_served_from_cache(self, registry, chain, get_context):
+        """Test a paraphrased question is answered once by the LLM"""
+        registry.get_embeddings.return_value.embed_query.side_effect = [[1.0, 0.0], [0.99, 0.05]]
+        chain.invoke.return_value = mock.Mock(content="The answer")
+
+        first = answer_question("What is the termination clause?", self.document)
+        second = answer_question("Explain the termination clause", self.document)
+
+        self.assertEqual(first, Answer("The answer"))
+        self.assertEqual(second, Answer("The answer", cached=True, semantic=True))
+        chain.invoke.assert_called_once()
+
+
+class LexicalSearchTests(SimpleTestCase):
+    """Test the BM25 search and its fusion with the vector search"""
+
+    def setUp(self):
+        self.index = lexical.BM25Index.build([
+            ("a", "The contract may be terminated with a notice period."),
+            ("b", "Clause 12.3 sets the penalties for late delivery of SKU AB-1234."),
+            ("c", "Payment is due within thirty days of the invoice."),
+        ])
+
+    def test_tokenize_keeps_compound_terms(self):
+        """Test clause numbers and SKUs are indexed whole and by part"""
+        self.assertEqual(lexical.tokenize("Clause 12.3, AB-1234"), ["clause", "12.3", "12", "3", "ab-1234", "ab", "1234"])
+
+    def test_exact_term_ranked_first(self):
+        """Test chunks with the exact rare terms are ranked first"""
+        results = self.index.search("what does clause 12.3 say?", k=2)
+
+        self.assertEqual(results[0][0], "b")
+        self.assertEqual(self.index.search("AB-1234", k=1)[0][0], "b")
+        self.assertEqual(self.index.search("unrelated", k=3), [])
+
+    def test_index_serialization(self):
+        """Test the index gives the same results once loaded back"""
+        loaded = lexical.BM25Index.from_dict(json.loads(json.dumps(self.index.to_dict())))
+
+        self.assertEqual(loaded.search("notice period", k=3), self.index.search("notice period", k=3))
+
+    def test_reciprocal_rank_fusion(self):
+        """Test chunks found by both searches are ranked first"""
+        a, b, c = (Document(page_content=name, id=name) for name in "abc")
+
+        fused = lexical.reciprocal_rank_fusion([[a, b], [c, b]], k=3)
+
+        self.assertEqual([chunk.id for chunk in fused], ["b", "a", "c"])
+
+    @mock.patch("documents.services.lexical.get_lexical_index")
+    def test_lexical_results_when_dense_search_fails(self, get_lexical_index):
+        """Test the lexical results are returned when the embedding API fails"""
+        get_lexical_index.return_value = self.index
+        vector_store = mock.Mock(spec=lexical.VectorStore)
+        vector_store.get = mock.Mock(return_value={
+            "ids": ["b"],
+            "documents": ["Clause 12.3 sets the penalties."],
+            "metadatas": [{"page": 4}],
+        })
+        vector_retriever = mock.Mock(spec=lexical.BaseRetriever)
+        vector_retriever.invoke.side_effect = TimeoutError("Embeddings API timeout")
+        retriever = lexical.HybridRetriever(
+            vector_retriever=vector_retriever,
+            vector_store=vector_store,
+            content_hash="content-hash",
+            k=1,
+            dense_timeout=1,
+        )
+
+        chunks = retriever.invoke("clause 12.3")
+
+        self.assertEqual([chunk.id for chunk in chunks], ["b"])
+        self.assertEqual(chunks[0].metadata, {"page": 4})
+
+
+class ContextBuilderTests(SimpleTestCase):
+    """Test packing the retrieved chunks in the prompt context"""
+
+    def make_chunk(self, text, page, start, chunk_id=None):
+        return Document(
+            page_content=text,
+            metadata={
+                "page": page,
+                "start_index": start,
+                "end_index": start + len(text),
+                "title": "Test document",
+                "created_at": "2026-10-18T10:00:00",
+            },
+            id=chunk_id,
+        )
+
+    def test_overlapping_chunks_merged(self):
+        """Test overlapping chunks of a page are merged and duplicates dropped"""
+        page_text = "The first sentence. The second sentence. The third sentence."
+        first = self.make_chunk(page_text[:40], page=0, start=0, chunk_id="a")
+        second = self.make_chunk(page_text[20:], page=0, start=20, chunk_id="b")
+        other_page = self.make_chunk(page_text[:40], page=1, start=0, chunk_id="c")
+
+        packed = ContextBuilder().pack([second, first, first, other_page])
+
+        self.assertEqual([chunk.page_content for chunk in packed], [page_text, page_text[:40]])
+        self.assertEqual(packed[0].metadata["start_index"], 0)
+
+    def test_token_budget(self):
+        """Test chunks are added by relevance until the token budget is used"""
+        builder = ContextBuilder(max_tokens=40)
+        chunks = [
+            self.make_chunk("word " * 15, page=0, start=0),
+            self.make_chunk("word " * 15, page=1, start=0),
+            self.make_chunk("short text", page=2, start=0),
+        ]
+
+        packed = builder.pack(chunks)
+
+        self.assertEqual([chunk.metadata["page"] for chunk in packed], [0, 2])
+        self.assertLessEqual(builder.count_tokens(builder.format(packed)), 40)
+
+    def test_metadata_left_out(self):
+        """Test only the page and the text of the chunks are in the context"""
+        context = ContextBuilder().format([self.make_chunk("Some text", page=2, start=0)])
+
+        self.assertEqual(context, "[page 3]\nSome text")
+
+
+class RetrievalOptionsTests(SimpleTestCase):
+    """Test the chunks search modes of the retriever"""
+
+    def get_search(self, vector_registry, options):
+        document = document_models.Document(content_hash="content-hash")
+        with mock.patch("documents.services.vector.settings.RETRIEVAL_MODE", "dense"):
+            DocumentVectorStore().get_retriever(document, options)
+        return vector_registry.get_vector_store.return_value.as_retriever.call_args.kwargs
+
+    @mock.patch("documents.services.vector.vector_registry")
+    def test_mmr_search(self, vector_registry):
+        """Test mmr re-ranks at least k candidates"""
+        search = self.get_search(vector_registry, RetrievalOptions(search_type="mmr", k=5, fetch_k=3, lambda_mult=0.3))
+
+        self.assertEqual(search["search_type"], "mmr")
+        self.assertEqual(search["search_kwargs"]["fetch_k"], 5)
+        self.assertEqual(search["search_kwargs"]["lambda_mult"], 0.3)
+        self.assertEqual(search["search_kwargs"]["filter"], {"content_hash": "content-hash"})
+
+    @mock.patch("documents.services.vector.vector_registry")
+    def test_mmr_not_fused_with_lexical_results(self, vector_registry):
+        """Test mmr chunks are not fused with the BM25 results in hybrid mode"""
+        document = document_models.Document(content_hash="content-hash")
+        with mock.patch("documents.services.vector.settings.RETRIEVAL_MODE", "hybrid"), \
+                mock.patch("documents.services.vector.HybridRetriever") as hybrid_retriever:
+            mmr = DocumentVectorStore().get_retriever(document, RetrievalOptions(search_type="mmr"))
+            similarity = DocumentVectorStore().get_retriever(document, RetrievalOptions(search_type="similarity"))
+
+        self.assertEqual(mmr, vector_registry.get_vector_store.return_value.as_retriever.return_value)
+        self.assertEqual(similarity, hybrid_retriever.return_value)
+        hybrid_retriever.assert_called_once()
+
+    @mock.patch("documents.services.vector.vector_registry")
+    def test_score_threshold_search(self, vector_registry):
+        """Test the score threshold search keeps k as the maximum number of chunks"""
+        options = RetrievalOptions(search_type="similarity_score_threshold", k=4, score_threshold=0.7)
+        search = self.get_search(vector_registry, options)
+
+        self.assertEqual(search["search_kwargs"]["k"], 4)
+        self.assertEqual(search["search_kwargs"]["score_threshold"], 0.7)
+
+    def test_options_change_the_answer_cache_key(self):
+        """Test answers retrieved with other options are cached apart"""
+        self.assertNotEqual(RetrievalOptions(k=3).cache_key(), RetrievalOptions(k=4).cache_key())
+        self.assertEqual(RetrievalOptions().cache_key(), RetrievalOptions().cache_key())
+
+
+class HashingEmbeddingsTests(SimpleTestCase):
+    """Test the local CPU embeddings backend"""
+
+    def setUp(self):
+        self.embeddings = HashingEmbeddings(dimensions=256)
+
+    def test_vectors_deterministic_and_normalized(self):
+        """Test vectors are the same for every instance and of unit length"""
+        vector = self.embeddings.embed_query("Termination of the contract")
+
+        self.assertEqual(vector, HashingEmbeddings(dimensions=256).embed_query("Termination of the contract"))
+        self.assertEqual(len(vector), 256)
+        self.assertAlmostEqual(sum(value * value for value in vector), 1, places=5)
+
+    def test_similar_texts_closer(self):
+        """Test texts sharing words are more similar than unrelated texts"""
+        query, similar, unrelated = self.embeddings.embed_documents([
+            "how can the contract be terminated",
+            "the contract may be terminated with a notice",
+            "payment of the invoices is due monthly",
+        ])
+
+        def similarity(first, second):
+            return sum(a * b for a, b in zip(first, second))
+
+        self.assertGreater(similarity(query, similar), similarity(query, unrelated))
+
+    def test_batch_matches_single_texts(self):
+        """Test embedding a batch gives the vectors of each text"""
+        texts = ["First text", "", "Second text"]
+
+        batch = self.embeddings.embed_documents(texts)
+
+        self.assertEqual(batch, [self.embeddings.embed_query(text) for text in texts])
+
+
+class PgVectorStoreTests(TestCase):
+    """Test the pgvector store filters and the chunks cleanup of deleted documents"""
+
+    def test_document_filter_is_a_semi_join(self):
+        """Test searches scoped to a document check its owner in SQL"""
+        store = PgVectorStore(HashingEmbeddings(dimensions=8), table_name="chunk_vectors_test")
+
+        where, params = store.where_clause({
+            "content_hash": "content-hash",
+            "document_uid": "document-uid",
+            "user_id": 1,
+        })
+
+        self.assertIn("v.content_hash = %s", where)
+        self.assertIn("EXISTS (SELECT 1 FROM", where)
+        self.assertIn("d.uid = %s AND d.user_id = %s", where)
+        self.assertEqual(params, ["content-hash", "document-uid", 1])
+
+    def test_scoped_search_recall_among_other_contents(self):
+        """Test a search scoped to a content finds all its chunks while many similar chunks of other contents exist"""
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'vector'")
+            if not cursor.fetchone():
+                self.skipTest("pgvector extension not installed")
+        embeddings = HashingEmbeddings(dimensions=16)
+        store = PgVectorStore(embeddings, table_name="chunk_vectors_test", ef_search=10)
+        store.create_table(16)
+        others = [f"Payment terms of the other contract number {i}" for i in range(1000)]
+        store.add_texts(
+            others,
+            metadatas=[{"content_hash": f"other-{i % 50}"} for i in range(len(others))],
+            ids=[f"other-{i}" for i in range(len(others))],
+        )
+        store.add_texts(
+            ["Termination clause", "Delivery schedule", "Payment is due monthly"],
+            metadatas=[{"content_hash": "content-hash"}] * 3,
+            ids=["a", "b", "c"],
+        )
+        store.create_index()
+
+        results = store.similarity_search("payment terms", k=3, filter={"content_hash": "content-hash"})
+
+        self.assertEqual(sorted(chunk.id for chunk in results), ["a", "b", "c"])
+        self.assertEqual(results[0].id, "c")
+
+    def test_write_requires_setup(self):
+        """Test chunks are not written before the table is set up at deploy"""
+        store = PgVectorStore(HashingEmbeddings(dimensions=8), table_name="chunk_vectors_missing")
+
+        with self.assertRaises(ValueError):
+            store.add_texts(["Text"], metadatas=[{"content_hash": "content-hash"}], ids=["a"])
+
+    @mock.patch("documents.services.vector.DocumentVectorStore.delete_content")
+    def test_deleted_document_chunks_deleted(self, delete_content):
+        """Test deleting a document deletes its unused content chunks"""
+        user = create_user(email="test@example.com", password="testpass123")
+        document = document_models.Document.objects.create(
+            user=user,
+            title="Test document",
+            document_file=SimpleUploadedFile("test.txt", b"Some text content"),
+            content_hash="content-hash",
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            document.delete()
+
+        delete_content.assert_called_once_with("content-hash")
+
+
+class FlatVectorStoreTests(SimpleTestCase):
+    """Test the memory-mapped flat index of a content"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.store = FlatVectorStore(HashingEmbeddings(dimensions=64), directory=self.directory)
+        self.filter = {"content_hash": "contenthash"}
+        self.store.add_texts(
+            ["The contract may be terminated", "Payment is due monthly"],
+            metadatas=[{"content_hash": "contenthash", "page": 0}, {"content_hash": "contenthash", "page": 1}],
+            ids=["a", "b"],
+        )
+        self.store.add_texts(
+            ["Deliveries are late", "Payment is due weekly"],
+            metadatas=[{"content_hash": "contenthash", "page": 2}, {"content_hash": "contenthash", "page": 1}],
+            ids=["c", "b"],
+        )
+
+    def test_exact_top_k(self):
+        """Test the most similar chunks are returned in order"""
+        results = self.store.similarity_search("how is the contract terminated", k=2, filter=self.filter)
+
+        self.assertEqual(results[0].id, "a")
+        self.assertEqual(len(results), 2)
+
+    def test_segments_compacted_and_upserted(self):
+        """Test batches are merged in one matrix, a chunk keeps its latest version"""
+        self.store.compact("contenthash")
+
+        directory = os.path.join(self.directory, "contenthash")
+        self.assertEqual(len(FlatVectorStore.list_segments(directory)), 1)
+        chunks = self.store.get(where=self.filter)
+        self.assertEqual(sorted(chunks["ids"]), ["a", "b", "c"])
+        self.assertIn("Payment is due weekly", chunks["documents"])
+        self.assertNotIn("Payment is due monthly", chunks["documents"])
+
+    def test_delete(self):
+        """Test deleted chunks are not found anymore"""
+        self.store.delete(ids=["a"], where=self.filter)
+        self.assertEqual(sorted(self.store.get(where=self.filter)["ids"]), ["b", "c"])
+
+        self.store.delete(ids=["b", "c"], where=self.filter)
+        self.assertEqual(self.store.similarity_search("payment", filter=self.filter), [])
+
+    def test_batch_search_matches_single_searches(self):
+        """Test many queries searched in one pass return the same chunks as one by one"""
+        embeddings = HashingEmbeddings(dimensions=64)
+        queries = ["how is the contract terminated", "when is the payment due"]
+        vectors = embeddings.embed_documents(queries)
+
+        results = self.store.similarity_search_by_vectors(vectors, k=2, filter=self.filter)
+
+        self.assertEqual(
+            [[chunk.id for chunk in chunks] for chunks in results],
+            [[chunk.id for chunk in self.store.similarity_search(query, k=2, filter=self.filter)] for query in queries],
+        )
+
+    def test_search_requires_content_filter(self):
+        """Test unscoped searches are rejected"""
+        with self.assertRaises(ValueError):
+            self.store.similarity_search("payment")
+
+
+class QuantizedFlatIndexTests(SimpleTestCase):
+    """Test the quantized flat index search with re-scoring"""
+
+    def setUp(self):
+        import numpy as np
+
+        self.np = np
+        rng = np.random.default_rng(0)
+        self.matrix = rng.normal(size=(200, 32)).astype(np.float32)
+        self.matrix /= np.linalg.norm(self.matrix, axis=1, keepdims=True)
+
+    def test_int8_quantization_error(self):
+        """Test int8 codes times their scale approximate the vectors"""
+        codes, scales = flat_store.quantize(self.matrix, "int8")
+
+        self.assertEqual(codes.dtype, self.np.int8)
+        restored = codes.astype(self.np.float32) * scales[:, None]
+        self.assertLess(self.np.abs(restored - self.matrix).max(), 0.01)
+
+    def test_rescored_results_exact(self):
+        """Test the quantized search returns the exact top k with their float32 scores"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        ids = [str(i) for i in range(len(self.matrix))]
+        query = self.matrix[7] + 0.05 * self.matrix[8]
+        expected = [str(i) for i in self.np.argsort(-(self.matrix @ (query / self.np.linalg.norm(query))))[:5]]
+
+        for quantization in ("float16", "int8"):
+            store = FlatVectorStore(None, directory=os.path.join(directory, quantization), quantization=quantization)
+            store.add_embeddings([""] * len(ids), self.matrix.tolist(), [{"content_hash": "content"}] * len(ids), ids)
+
+            results = store.search_by_vector(query.tolist(), k=5, filter={"content_hash": "content"})
+
+            self.assertIsNotNone(store.load("content").codes)
+            self.assertEqual([document.id for document, _, _ in results], expected)
+
+
+class ProjectionTests(SimpleTestCase):
+    """Test the reduction of the embeddings dimensions"""
+
+    def setUp(self):
+        import numpy as np
+
+        self.np = np
+        rng = np.random.default_rng(0)
+        # vectors spanning 4 directions of a 32 dimensions space
+        self.matrix = (rng.normal(size=(100, 4)) @ rng.normal(size=(4, 32))).astype(np.float32)
+        self.matrix -= self.matrix.mean(axis=0)
+
+    def test_pca_keeps_neighbours(self):
+        """Test a PCA of the spanned directions keeps the similarities"""
+        projection = Projection.fit_pca(self.matrix, 4)
+        full = self.matrix / self.np.linalg.norm(self.matrix, axis=1, keepdims=True)
+        reduced = projection.transform(self.matrix)
+
+        self.assertEqual(reduced.shape, (100, 4))
+        self.assertEqual(
+            list(self.np.argsort(-(full @ full[0]))[:5]),
+            list(self.np.argsort(-(reduced @ reduced[0]))[:5]),
+        )
+
+    def test_save_and_load(self):
+        """Test a saved projection gives the same vectors"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, "projection.npz")
+        projection = Projection.fit_pca(self.matrix, 4)
+
+        projection.save(path)
+
+        self.np.testing.assert_allclose(Projection.load(path).transform(self.matrix), projection.transform(self.matrix))
+        Projection(8).save(path)
+        self.assertEqual(Projection.load(path).mode, "truncate")
+
+    @mock.patch("documents.services.registry.settings.EMBEDDING_PROJECTION", "pca")
+    def test_pca_versions_have_own_collection(self):
+        """Test each fitted PCA version has its own file and collection"""
+        with mock.patch("documents.services.registry.settings.EMBEDDING_PROJECTION_VERSION", "2"):
+            collection, path = registry_module.get_collection_name(), registry_module.get_projection_path()
+
+        self.assertNotEqual(collection, registry_module.get_collection_name())
+        self.assertNotEqual(path, registry_module.get_projection_path())
+        self.assertEqual(path, registry_module.get_projection_path("2"))
+
+    def test_saved_projection_not_overwritten(self):
+        """Test fitting a PCA again does not replace the projection of stored vectors"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        with mock.patch("documents.services.registry.settings.EMBEDDING_PROJECTION_DIR", directory):
+            Projection(8).save(registry_module.get_projection_path("1"))
+
+            with self.assertRaises(CommandError):
+                call_command("fit_projection", "--save", "--version", "1", stdout=io.StringIO())
+
+    def test_truncation_requires_trained_model(self):
+        """Test truncated vectors are only allowed for the models trained for it"""
+        check_truncatable("text-embedding-3-small")
+        with self.assertRaises(ValueError):
+            check_truncatable("text-embedding-ada-002")
+
+        with mock.patch("documents.services.registry.settings.EMBEDDING_PROJECTION", "truncate"), \
+                mock.patch("documents.services.registry.settings.EMBEDDING_BACKEND", "hashing"):
+            with self.assertRaises(ValueError):
+                registry_module.create_embeddings()
+
+    def test_projected_embeddings(self):
+        """Test documents and queries are reduced the same way"""
+        embeddings = ProjectedEmbeddings(HashingEmbeddings(dimensions=64), Projection(16))
+
+        vectors = embeddings.embed_documents(["Some text"])
+
+        self.assertEqual(len(vectors[0]), 16)
+        self.assertEqual(vectors[0], embeddings.embed_query("Some text"))
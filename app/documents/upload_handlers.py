@@ -0,0 +1,26 @@
+import hashlib
+
+from django.core.files.uploadhandler import FileUploadHandler
+
+
+class Sha256UploadHandler(FileUploadHandler):
+    """
+    Compute the sha256 of uploaded files while they are received.
+    Must be the first upload handler, data is passed on unchanged to the next
+    handlers which build the uploaded file. Digests are stored by field name in
+    `request.upload_hashes`.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.sha256 = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.sha256.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        if not hasattr(self.request, "upload_hashes"):
+            self.request.upload_hashes = {}
+        self.request.upload_hashes[self.field_name] = self.sha256.hexdigest()
+        return None
@@ -4,9 +4,18 @@ from documents import views as document_views
 
 app_name = "documents"
 
+# views which do not hold a thread while waiting, the only ones served under ASGI (see asgi_urls.py)
+async_urlpatterns = [
+    path("ask/<uuid:document_uid>/async/", document_views.AsyncAskView.as_view(), name="ask_async"),
+    path("ask/<uuid:document_uid>/async/stream/", document_views.AsyncAskStreamView.as_view(), name="ask_async_stream"),
+]
+
 urlpatterns = [
     path("upload/", document_views.DocumentUploadView.as_view(), name="upload"),
     path("my-documents/", document_views.MyDocumentsView.as_view(), name="my_documents"),
 
     path("ask/<uuid:document_uid>/", document_views.TestVectorView.as_view(), name="test_vector"),
+    path("ask/<uuid:document_uid>/stream/", document_views.AskStreamView.as_view(), name="ask_stream"),
+    path("ask/<uuid:document_uid>/batch/", document_views.AskBatchView.as_view(), name="ask_batch"),
+    *async_urlpatterns,
 ]
@@ -1,3 +1,10 @@
+import time
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views import View
+
 from rest_framework import generics
 from rest_framework.views import APIView
 
@@ -6,13 +13,53 @@ from rest_framework.response import Response
 from rest_framework import status
 
 from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.exceptions import AuthenticationFailed
 from drf_spectacular.utils import extend_schema, OpenApiExample, OpenApiParameter, OpenApiTypes
 
 from documents import models as document_models
+from documents import enums as document_enums
 from documents import serializers as document_serializers
+from documents import tasks as document_tasks
+from documents.renderers import EventStreamRenderer, format_event
+from documents.upload_handlers import Sha256UploadHandler
+
+from documents.services.llm_chain import (
+    aanswer_question,
+    answer_question,
+    answer_questions,
+    astream_answer,
+    get_sources,
+    stream_answer,
+)
+
+from core.custom_logger import logger
 
-from documents.services.llm_chain import answer_question
 
+ANSWER_CACHE_HEADER = "X-Answer-Cache"
+
+
+def format_done_event(document, context, start, retrieval_time, first_token_time) -> str:
+    """Log the timings of a streamed answer and return its `done` event."""
+    total_time = time.perf_counter() - start
+    logger.info(
+        f"Streamed answer for document {document.uid}: retrieval {retrieval_time:.3f}s, "
+        f"first token {first_token_time or total_time:.3f}s, total {total_time:.3f}s"
+    )
+    return format_event("done", {
+        "sources": get_sources(context),
+        "retrieval_time": retrieval_time,
+        "time_to_first_token": first_token_time,
+        "total_time": total_time,
+    })
+
+
+def get_answer_cache_status(answer) -> str:
+    if answer.semantic:
+        return "SEMANTIC-HIT"
+    return "HIT" if answer.cached else "MISS"
 
 
 class DocumentUploadView(generics.CreateAPIView):
@@ -63,8 +110,16 @@ class DocumentUploadView(generics.CreateAPIView):
         ]
     )
     def post(self, request, *args, **kwargs):
+        # hash the file while it is received, before the request data is parsed
+        request.upload_handlers.insert(0, Sha256UploadHandler(request._request))
         return self.create(request, *args, **kwargs)
 
+    def perform_create(self, serializer):
+        document = serializer.save()
+        transaction.on_commit(
+            lambda: document_tasks.ingest_document_task.delay(document.id)
+        )
+
 
 class MyDocumentsView(generics.ListAPIView):
     """
@@ -91,45 +146,320 @@ class MyDocumentsView(generics.ListAPIView):
         return super().get(request, *args, **kwargs)
     
 
-class TestVectorView(APIView):
+class DocumentQuestionMixin:
     """
-    View for testing vector search functionality.
+    Lookup of the document asked about, it must be owned by the user and indexed.
     """
-    permission_classes = [IsAuthenticated]
+    question_parameters = [
+        OpenApiParameter(
+            name="query",
+            type=OpenApiTypes.STR,
+            location=OpenApiParameter.QUERY,
+            description="The query string to search for in the vector store.",
+            required=True,
+            default="ask any question about your documents",
+        ),
+        OpenApiParameter(
+            name="search_type",
+            type=OpenApiTypes.STR,
+            location=OpenApiParameter.QUERY,
+            description="similarity, mmr (diverse chunks) or similarity_score_threshold "
+            "(fewer chunks when the scores are low). Defaults to RETRIEVAL_SEARCH_TYPE.",
+            enum=["similarity", "mmr", "similarity_score_threshold"],
+        ),
+        OpenApiParameter(
+            name="k",
+            type=OpenApiTypes.INT,
+            location=OpenApiParameter.QUERY,
+            description="Maximum number of chunks retrieved.",
+        ),
+        OpenApiParameter(
+            name="fetch_k",
+            type=OpenApiTypes.INT,
+            location=OpenApiParameter.QUERY,
+            description="Number of candidate chunks re-ranked by mmr.",
+        ),
+        OpenApiParameter(
+            name="lambda_mult",
+            type=OpenApiTypes.FLOAT,
+            location=OpenApiParameter.QUERY,
+            description="mmr similarity (1) to diversity (0) trade-off.",
+        ),
+        OpenApiParameter(
+            name="score_threshold",
+            type=OpenApiTypes.FLOAT,
+            location=OpenApiParameter.QUERY,
+            description="Minimum relevance score of the chunks for similarity_score_threshold.",
+        ),
+    ]
 
-    @extend_schema(
-        parameters=[
-            OpenApiParameter(
-                name="query",
-                type=OpenApiTypes.STR,
-                location=OpenApiParameter.QUERY,
-                description="The query string to search for in the vector store.",
-                required=True,
-                default="ask any question about your documents",
-            ),
-        ]
-    )
-    def get(self, request, *args, **kwargs):
+    def get_retrieval_options(self, request):
+        """Return the validated retrieval options of the query parameters."""
+        serializer = document_serializers.RetrievalOptionsSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return serializer.get_options()
+
+    def get_ready_document(self, request):
+        """Return the document and None, or None and an error response."""
         document_uid = self.kwargs.get("document_uid")
-        document = document_models.Document.objects.filter(uid=document_uid).first()
+        document = document_models.Document.objects.filter(
+            uid=document_uid,
+            user=request.user,
+        ).first()
         
         if not document:
-            return Response(
+            return None, Response(
                 {"detail": "Document not found."},
                 status=status.HTTP_404_NOT_FOUND
             )
         
+        if document.status != document_enums.DocumentProcessingStatus.COMPLETED:
+            return None, Response(
+                {
+                    "detail": "Document is not ready yet.",
+                    "status": document.status,
+                },
+                status=status.HTTP_409_CONFLICT
+            )
+        return document, None
+
+
+class TestVectorView(DocumentQuestionMixin, APIView):
+    """
+    View for testing vector search functionality.
+    """
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(parameters=DocumentQuestionMixin.question_parameters)
+    def get(self, request, *args, **kwargs):
+        document, error_response = self.get_ready_document(request)
+        if error_response:
+            return error_response
+
         user_input = request.query_params.get("query", "test")
         response = answer_question(
             user_input,
-            document
+            document,
+            self.get_retrieval_options(request),
         )
-        if not response:
+        if not response.content:
             return Response(
                 {"detail": "No answer found."},
                 status=status.HTTP_404_NOT_FOUND
             )
         return Response(
-            {"answer": response},
-            status=status.HTTP_200_OK
-        )
\ No newline at end of file
+            {"answer": response.content},
+            status=status.HTTP_200_OK,
+            headers={ANSWER_CACHE_HEADER: get_answer_cache_status(response)},
+        )
+
+
+class AskBatchView(DocumentQuestionMixin, APIView):
+    """
+    View answering many questions about one document in one request.
+    Answers are returned in the order of the questions, a failed question has
+    an `error` and does not fail the others.
+    """
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        request=document_serializers.BatchQuestionsSerializer,
+        examples=[
+            OpenApiExample(
+                "Checklist",
+                value={"questions": ["Who are the parties?", "What is the termination notice period?"]},
+                request_only=True,
+            ),
+        ],
+    )
+    def post(self, request, *args, **kwargs):
+        document, error_response = self.get_ready_document(request)
+        if error_response:
+            return error_response
+
+        serializer = document_serializers.BatchQuestionsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        questions = serializer.validated_data["questions"]
+
+        start = time.perf_counter()
+        answers = answer_questions(questions, document, serializer.get_options())
+        logger.info(
+            f"Answered {len(questions)} questions about document {document.uid} "
+            f"in {time.perf_counter() - start:.2f}s, {sum(answer.cached for answer in answers)} cached"
+        )
+        return Response(
+            {
+                "answers": [
+                    {
+                        "question": question,
+                        "answer": answer.content,
+                        "cache": get_answer_cache_status(answer),
+                        "error": answer.error,
+                    }
+                    for question, answer in zip(questions, answers)
+                ],
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+class AskStreamView(DocumentQuestionMixin, APIView):
+    """
+    View streaming the answer as Server-Sent Events.
+    Sends `token` events with the answer text as it is generated, then a `done`
+    event with the sources of the answer and the timings, or an `error` event.
+    Streams under WSGI, AsyncAskStreamView is the ASGI version.
+    """
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [EventStreamRenderer, JSONRenderer]
+
+    @extend_schema(
+        parameters=DocumentQuestionMixin.question_parameters,
+        responses={(200, "text/event-stream"): OpenApiTypes.STR},
+    )
+    def get(self, request, *args, **kwargs):
+        document, error_response = self.get_ready_document(request)
+        if error_response:
+            return error_response
+
+        user_input = request.query_params.get("query", "test")
+        response = StreamingHttpResponse(
+            self.event_stream(user_input, document, self.get_retrieval_options(request)),
+            content_type="text/event-stream",
+        )
+        # disable buffering by proxies, every event is sent as soon as it is yielded
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    def event_stream(self, question, document, options):
+        start = time.perf_counter()
+        first_token_time = None
+        try:
+            context, tokens = stream_answer(question, document, options)
+            retrieval_time = time.perf_counter() - start
+            for token in tokens:
+                if first_token_time is None:
+                    first_token_time = time.perf_counter() - start
+                yield format_event("token", {"text": token})
+        except Exception as e:
+            logger.error(f"Error streaming answer for document {document.uid}: {e}")
+            yield format_event("error", {"detail": "Answer generation failed."})
+            return
+
+        yield format_done_event(document, context, start, retrieval_time, first_token_time)
+
+
+class AsyncDocumentQuestionMixin:
+    """
+    Checks of the async question views: authentication with the DRF
+    authentication classes, document ownership and indexing status, with the
+    same error payloads as DocumentQuestionMixin.
+    """
+    authentication_classes = api_settings.DEFAULT_AUTHENTICATION_CLASSES
+
+    def authenticate(self, request):
+        drf_request = Request(
+            request,
+            authenticators=[auth() for auth in self.authentication_classes],
+        )
+        try:
+            return drf_request.user
+        except AuthenticationFailed:
+            return None
+
+    async def aget_ready_document(self, request, document_uid):
+        """Return the indexed document of the user, or the error response."""
+        user = await sync_to_async(self.authenticate)(request)
+        if not user or not user.is_authenticated:
+            return None, JsonResponse(
+                {"detail": "Authentication credentials were not provided."},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+
+        document = await document_models.Document.objects.filter(
+            uid=document_uid,
+            user=user,
+        ).afirst()
+        if not document:
+            return None, JsonResponse(
+                {"detail": "Document not found."},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        if document.status != document_enums.DocumentProcessingStatus.COMPLETED:
+            return None, JsonResponse(
+                {
+                    "detail": "Document is not ready yet.",
+                    "status": document.status,
+                },
+                status=status.HTTP_409_CONFLICT
+            )
+        return document, None
+
+
+class AsyncAskView(AsyncDocumentQuestionMixin, View):
+    """
+    Async version of TestVectorView for ASGI deployments (see scripts/server_run.sh).
+    Answers with the same payloads, waiting for the retrieval and the LLM does
+    not hold a thread.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        document, error_response = await self.aget_ready_document(request, kwargs.get("document_uid"))
+        if error_response:
+            return error_response
+
+        options_serializer = document_serializers.RetrievalOptionsSerializer(data=request.GET)
+        if not options_serializer.is_valid():
+            return JsonResponse(options_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        user_input = request.GET.get("query", "test")
+        response = await aanswer_question(user_input, document, options_serializer.get_options())
+        return JsonResponse(
+            {"answer": response.content},
+            status=status.HTTP_200_OK,
+            headers={ANSWER_CACHE_HEADER: get_answer_cache_status(response)},
+        )
+
+
+class AsyncAskStreamView(AsyncDocumentQuestionMixin, View):
+    """
+    Async version of AskStreamView for ASGI deployments. Under ASGI Django
+    consumes a sync streaming iterator whole before sending it, so the events
+    are produced by an async generator over the LLM stream instead.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        document, error_response = await self.aget_ready_document(request, kwargs.get("document_uid"))
+        if error_response:
+            return error_response
+
+        options_serializer = document_serializers.RetrievalOptionsSerializer(data=request.GET)
+        if not options_serializer.is_valid():
+            return JsonResponse(options_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        user_input = request.GET.get("query", "test")
+        response = StreamingHttpResponse(
+            self.event_stream(user_input, document, options_serializer.get_options()),
+            content_type="text/event-stream",
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    async def event_stream(self, question, document, options):
+        start = time.perf_counter()
+        first_token_time = None
+        try:
+            context, tokens = await astream_answer(question, document, options)
+            retrieval_time = time.perf_counter() - start
+            async for token in tokens:
+                if first_token_time is None:
+                    first_token_time = time.perf_counter() - start
+                yield format_event("token", {"text": token})
+        except Exception as e:
+            logger.error(f"Error streaming answer for document {document.uid}: {e}")
+            yield format_event("error", {"detail": "Answer generation failed."})
+            return
+
+        yield format_done_event(document, context, start, retrieval_time, first_token_time)
@@ -364,6 +364,8 @@ CELERY_BEAT_SCHEDULE = {
 CELERY_TASK_ROUTES = {
     # Celery health check / example task
     'celery_test_task': {'queue': 'main-queue'},
+    # Documents parsing / embedding, kept apart from short tasks
+    'ingest_document_task': {'queue': 'documents-queue'},
 }
 
 
@@ -443,4 +445,101 @@ MASTER_PASSWORD = os.environ.get("MASTER_PASSWORD", "Dev@2025")
 CLEAN_CHROMA_ON_SERVER_UPDATE = bool(int(os.environ.get("CLEAN_CHROMA_ON_SERVER_UPDATE", 1)))
 GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY", None)
 GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-1.5-flash")
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", None)
\ No newline at end of file
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", None)
+
+# -------------- DOCUMENTS RAG ------------- #
+# Chunk sizes are measured in tokens of DOCUMENT_CHUNK_ENCODING
+DOCUMENT_CHUNK_SIZE = int(os.environ.get("DOCUMENT_CHUNK_SIZE", 500))
+DOCUMENT_CHUNK_OVERLAP = int(os.environ.get("DOCUMENT_CHUNK_OVERLAP", 50))
+DOCUMENT_CHUNK_ENCODING = os.environ.get("DOCUMENT_CHUNK_ENCODING", "cl100k_base")
+DOCUMENT_CHUNK_SEPARATORS = ["\n\n", "\n", ". ", " ", ""]
+
+# Embedding requests: batches are bounded by chunks count and tokens
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", 64))
+EMBEDDING_BATCH_MAX_TOKENS = int(os.environ.get("EMBEDDING_BATCH_MAX_TOKENS", 8000 * 8))
+EMBEDDING_MAX_WORKERS = int(os.environ.get("EMBEDDING_MAX_WORKERS", 4))
+EMBEDDING_MAX_RETRIES = int(os.environ.get("EMBEDDING_MAX_RETRIES", 5))
+EMBEDDING_BACKOFF_BASE = float(os.environ.get("EMBEDDING_BACKOFF_BASE", 1))  # seconds
+EMBEDDING_BACKOFF_MAX = float(os.environ.get("EMBEDDING_BACKOFF_MAX", 60))  # seconds
+
+# Embeddings cache keyed by (model, sha256 of text), sizes are numbers of vectors
+EMBEDDING_CACHE_ENABLED = bool(int(os.environ.get("EMBEDDING_CACHE_ENABLED", 1)))
+EMBEDDING_CACHE_LOCAL_SIZE = int(os.environ.get("EMBEDDING_CACHE_LOCAL_SIZE", 10000))  # ~6 KB per 1536-d vector
+EMBEDDING_CACHE_REDIS_SIZE = int(os.environ.get("EMBEDDING_CACHE_REDIS_SIZE", 200000))
+
+# Documents files download from the storage
+DOCUMENT_DOWNLOAD_CONNECT_TIMEOUT = float(os.environ.get("DOCUMENT_DOWNLOAD_CONNECT_TIMEOUT", 5))  # seconds
+DOCUMENT_DOWNLOAD_READ_TIMEOUT = float(os.environ.get("DOCUMENT_DOWNLOAD_READ_TIMEOUT", 60))  # seconds
+DOCUMENT_DOWNLOAD_POOL_SIZE = int(os.environ.get("DOCUMENT_DOWNLOAD_POOL_SIZE", 10))
+
+# Parallel PDF pages extraction, disabled when workers < 2
+DOCUMENT_PDF_WORKERS = int(os.environ.get("DOCUMENT_PDF_WORKERS", 0))
+DOCUMENT_PDF_PAGES_PER_TASK = int(os.environ.get("DOCUMENT_PDF_PAGES_PER_TASK", 16))
+DOCUMENT_PDF_PARALLEL_MIN_PAGES = int(os.environ.get("DOCUMENT_PDF_PARALLEL_MIN_PAGES", 50))
+
+# Answers cache, keyed by document content version and normalized question
+ANSWER_CACHE_ENABLED = bool(int(os.environ.get("ANSWER_CACHE_ENABLED", 1)))
+ANSWER_CACHE_TTL = int(os.environ.get("ANSWER_CACHE_TTL", 60 * 60 * 24))  # seconds
+
+# Semantic answers cache, similar questions (cosine >= threshold) reuse the answer
+SEMANTIC_CACHE_ENABLED = bool(int(os.environ.get("SEMANTIC_CACHE_ENABLED", 1)))
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", 0.92))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", 200))  # per document
+
+# Retrieval: "hybrid" fuses the vector and BM25 searches, "dense" is the vector search only
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "hybrid")
+HYBRID_RRF_K = int(os.environ.get("HYBRID_RRF_K", 60))
+HYBRID_DENSE_TIMEOUT = float(os.environ.get("HYBRID_DENSE_TIMEOUT", 10))  # seconds, then lexical results only
+HYBRID_SEARCH_WORKERS = int(os.environ.get("HYBRID_SEARCH_WORKERS", 8))
+LEXICAL_INDEX_CACHE_SIZE = int(os.environ.get("LEXICAL_INDEX_CACHE_SIZE", 100))  # indexes per process
+
+# Prompt context budget, counted in tokens of DOCUMENT_CHUNK_ENCODING
+CONTEXT_MAX_TOKENS = int(os.environ.get("CONTEXT_MAX_TOKENS", 2000))
+
+# Chunks search: "similarity", "mmr" (diverse chunks) or "similarity_score_threshold" (k shrinks on low scores)
+RETRIEVAL_SEARCH_TYPE = os.environ.get("RETRIEVAL_SEARCH_TYPE", "similarity")
+RETRIEVAL_K = int(os.environ.get("RETRIEVAL_K", 5))
+RETRIEVAL_FETCH_K = int(os.environ.get("RETRIEVAL_FETCH_K", 20))  # mmr candidates
+RETRIEVAL_MMR_LAMBDA = float(os.environ.get("RETRIEVAL_MMR_LAMBDA", 0.5))
+RETRIEVAL_SCORE_THRESHOLD = float(os.environ.get("RETRIEVAL_SCORE_THRESHOLD", 0.5))
+
+# Embedding provider: "openai" or "hashing" (local CPU, no network, for tests and air-gapped staging)
+# documents must be indexed again after a change, each backend has its own collection
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "openai")
+EMBEDDING_HASHING_DIMENSIONS = int(os.environ.get("EMBEDDING_HASHING_DIMENSIONS", 768))
+
+# Vector store: "chroma" (local directory), "pgvector" (table in the application database) or "flat"
+VECTOR_STORE_BACKEND = os.environ.get("VECTOR_STORE_BACKEND", "chroma")
+PGVECTOR_INDEX_TYPE = os.environ.get("PGVECTOR_INDEX_TYPE", "hnsw")  # or "ivfflat"
+PGVECTOR_EF_SEARCH = int(os.environ.get("PGVECTOR_EF_SEARCH", 100))
+PGVECTOR_IVFFLAT_LISTS = int(os.environ.get("PGVECTOR_IVFFLAT_LISTS", 100))
+# "flat" keeps one memory-mapped float32 matrix per content, exact search for small documents
+FLAT_INDEX_DIR = os.environ.get(
+    "FLAT_INDEX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "documents", "flat_index")
+)
+FLAT_INDEX_CACHE_SIZE = int(os.environ.get("FLAT_INDEX_CACHE_SIZE", 256))  # open segments per process
+# quantized copy of the flat index scored first ("none", "float16" or "int8"), candidates are re-scored in float32,
+# the float32 matrix is kept next to the copy: less memory scanned per search, but 1.5x (float16) or 1.25x (int8) the disk size
+FLAT_INDEX_QUANTIZATION = os.environ.get("FLAT_INDEX_QUANTIZATION", "none")
+FLAT_INDEX_RESCORE_FACTOR = int(os.environ.get("FLAT_INDEX_RESCORE_FACTOR", 4))
+
+# Embeddings dimensionality reduction: "none", "pca" (fitted with fit_projection) or "truncate"
+# "truncate" is only allowed for models trained for it (OpenAI text-embedding-3), use "pca" for the others
+# documents must be indexed again after a change, each projection has its own collection
+EMBEDDING_PROJECTION = os.environ.get("EMBEDDING_PROJECTION", "none")
+EMBEDDING_PROJECTION_DIMENSIONS = int(os.environ.get("EMBEDDING_PROJECTION_DIMENSIONS", 256))
+# PCA fitted by fit_projection --version, its vectors have their own collection
+EMBEDDING_PROJECTION_VERSION = os.environ.get("EMBEDDING_PROJECTION_VERSION", "1")
+EMBEDDING_PROJECTION_DIR = os.environ.get(
+    "EMBEDDING_PROJECTION_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "documents", "projections")
+)
+
+# Batch questions endpoint
+BATCH_ASK_MAX_QUESTIONS = int(os.environ.get("BATCH_ASK_MAX_QUESTIONS", 50))
+BATCH_ASK_MAX_CONCURRENCY = int(os.environ.get("BATCH_ASK_MAX_CONCURRENCY", 8))  # LLM calls at once
+
+# Server mode, see scripts/server_run.sh: "wsgi" serves every route, "asgi" only
+# the async question views (asgi_urls.py), run next to a wsgi service
+SERVER_MODE = os.environ.get("SERVER_MODE", "wsgi")
+if SERVER_MODE == "asgi":
+    ROOT_URLCONF = "asgi_urls"
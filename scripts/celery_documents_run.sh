@@ -0,0 +1,4 @@
+#! /bin/sh
+# long ingestion jobs run on their own worker, they never hold up the short tasks of main-queue.
+# each ingestion embeds on a thread pool and may parse large PDFs on a process pool, keep it low
+celery -A core worker -l info -Q documents-queue -n documents@%h -c ${CELERY_DOCUMENTS_CONCURRENCY:-2}
\ No newline at end of file
@@ -1,2 +1,2 @@
 #! /bin/sh
-celery -A core worker -l info -Q main-queue -B
\ No newline at end of file
+celery -A core worker -l info -Q main-queue -n main@%h -B
\ No newline at end of file
@@ -11,12 +11,24 @@ then
 
     echo "PostgreSQL started"
    python /app/manage.py migrate
+   if [ "$VECTOR_STORE_BACKEND" = "pgvector" ]; then python /app/manage.py setup_pgvector; fi
    python /app/manage.py createsuperuser --noinput
 #    python /app/manage.py collectstatic --no-input --clear
     python /app/manage.py runserver 0.0.0.0:8000
 else
    python /app/manage.py migrate
+   if [ "$VECTOR_STORE_BACKEND" = "pgvector" ]; then python /app/manage.py setup_pgvector; fi
    python /app/manage.py createsuperuser --noinput
-   gunicorn --bind 0.0.0.0:8000 --workers 2 --threads 8 --timeout 0 --max-requests 1000 --max-requests-jitter 50 wsgi:application
+   if [ "$SERVER_MODE" = "asgi" ]
+   then
+      # async views wait on I/O in the event loop instead of holding a thread.
+      # Sync views would all share one thread per worker under ASGI, so this mode
+      # only serves the async question routes (app/asgi_urls.py):
+      #   /api/documents/ask/<uid>/async/ and /api/documents/ask/<uid>/async/stream/
+      # run a SERVER_MODE=wsgi service too and route the other paths to it.
+      gunicorn --bind 0.0.0.0:8000 --workers 2 -k uvicorn.workers.UvicornWorker --timeout 0 --max-requests 1000 --max-requests-jitter 50 asgi:application
+   else
+      gunicorn --bind 0.0.0.0:8000 --workers 2 --threads 8 --timeout 0 --max-requests 1000 --max-requests-jitter 50 wsgi:application
+   fi
 fi
 exec "$@"